@@ -1,9 +1,31 @@
 import streamlit as st
 import pandas as pd
 from supabase import create_client, Client
+from streamlit.runtime.scriptrunner_utils.script_requests import ScriptRequestType
+from streamlit.runtime.scriptrunner_utils.script_run_context import get_script_run_ctx
+import hashlib
+import math
+import os
 import time
-from experiment_3 import UnnamedState
+import instrumentation
+import kb_admin
+import kb_transfer
+from experiment_3 import ScoringCancelled, UnnamedState
+from kb_cache import KnowledgeBaseCache
+from kb_changes import KnowledgeBaseSubscriber, RealtimeChangeSource
 from llm import generate_description
+from scoring_pool import get_shared_scoring_pool
+from supabase_loader import fetch_columns, fetch_concurrently, fetch_descriptions, fetch_disease_symptoms, fetch_kb_revision, fetch_subsymptoms
+
+rerun_started_at = (time.time(), time.perf_counter())
+
+def rerun():
+    finish_rerun()
+    st.rerun()
+
+def finish_rerun():
+    wall_start, start = rerun_started_at
+    instrumentation.record_span("rerun", wall_start, time.perf_counter() - start, role=st.session_state.get("role"))
 
 def to_proper_decimal_string(float_data):
     x = f"{float_data:.6f}".replace(".", ",")
@@ -13,124 +35,134 @@ def to_proper_percentage_string(float_data):
     x = f"{float_data * 100:.1f}%".replace(".", ",")
     return x
 
-def update_asked_symptom_and_answer_possibilities():
-    current_state = st.session_state["current_state"]
+def script_run_interrupted():
+    # Whether a rerun or stop was requested while this script run is busy in
+    # the engine. Streamlit only acts on it at the next st call, which a
+    # blocked scoring call never reaches.
+    #
+    # There is no public API for this: it reads ScriptRequests._state as of
+    # Streamlit 1.47, without its lock (a stale read only delays the cancel
+    # to the next poll). If a later version moves it, this reports "not
+    # interrupted" and scoring just runs to the end.
+    ctx = get_script_run_ctx(suppress_warning=True)
+    if ctx is None or ctx.script_requests is None:
+        return False
+
+    state = getattr(ctx.script_requests, "_state", None)
+    return state is not None and state != ScriptRequestType.CONTINUE
+
+def update_asked_symptom_and_answer_possibilities(current_state, question_no):
     asked_symptom = current_state.get_best_symptom_to_ask()
-    st.session_state["asked_symptom"] = asked_symptom
 
     # Choose possibilities
-    if asked_symptom is not None and st.session_state["question_no"] <= 10:
+    if asked_symptom is not None and question_no <= 10:
         possibilities = current_state.get_possibilities(asked_symptom)
     else:
         possibilities = []
+
+    # Only stored once the question is known, so a cancelled run leaves the
+    # session as it was.
+    st.session_state["current_state"] = current_state
+    st.session_state["question_no"] = question_no
+    st.session_state["asked_symptom"] = asked_symptom
     st.session_state["possibilities"] = possibilities
 
-def next_question():
-    st.session_state["question_no"] = st.session_state["question_no"] + 1
-    update_asked_symptom_and_answer_possibilities()
+def next_question(next_state):
+    update_asked_symptom_and_answer_possibilities(next_state, st.session_state["question_no"] + 1)
 
 @st.cache_resource
 def init_supabase():
     url: str = st.secrets["SUPABASE_URL"]
     key: str = st.secrets["SUPABASE_KEY"]
     supabase: Client = create_client(url, key)
+
+    # Count and time every PostgREST round trip for instrumentation.
+    session = supabase.postgrest.session
+    session.event_hooks["request"].append(start_supabase_request)
+    session.event_hooks["response"].append(finish_supabase_request)
     return supabase
 
+def start_supabase_request(request):
+    request.extensions["instrumentation_start"] = (time.time(), time.perf_counter())
+
+def finish_supabase_request(response):
+    wall_start, start = response.request.extensions["instrumentation_start"]
+    instrumentation.count("supabase_round_trips")
+    instrumentation.record_span("supabase", wall_start, time.perf_counter() - start, method=response.request.method, path=response.request.url.path)
+
 supabase = init_supabase()
 
-def init_new_session():
+def fetch_knowledge_base_tables():
     supabase = init_supabase()
-    df = fetch_disease_symptoms_from_supabase(supabase)
+    result = fetch_concurrently({
+        "disease_symptoms": lambda: fetch_disease_symptoms(supabase),
+        "subsymptoms": lambda: fetch_subsymptoms(supabase),
+    })
+    return result["disease_symptoms"], result["subsymptoms"]
 
-    subsymptom_df_dict = {
-        "Gejala": [],
-        "Variasi": [],
-        "AnakGejala": [],
-    }
-    response = (
-        supabase.table("variant_free_subsymptoms")
-        .select("subsymptom", "parent")
-        .execute()
-    )
-    for x in response.data:
-        gejala = x["parent"]
-        variasi = None
-        anak_gejala = x["subsymptom"]
+def knowledge_base_source_prefix():
+    database = hashlib.sha1(st.secrets["SUPABASE_URL"].encode()).hexdigest()[:12]
+    return f"supabase-{database}"
 
-        subsymptom_df_dict["Gejala"].append(gejala)
-        subsymptom_df_dict["Variasi"].append(variasi)
-        subsymptom_df_dict["AnakGejala"].append(anak_gejala)
+def fetch_knowledge_base_source():
+    # Names the KB's current contents for its on-disk snapshot. The revision
+    # is read before any rows, so a snapshot is never older than its name.
+    return f"{knowledge_base_source_prefix()}-{fetch_kb_revision(init_supabase())}"
 
-    response = (
-        supabase.table("variant_specific_subsymptoms")
-        .select("subsymptom", "parent", "parent_variant")
-        .execute()
+@st.cache_resource
+def get_knowledge_base_cache():
+    # One snapshot of the KB per process, shared by every session. A restart
+    # maps the compiled KB from disk when the database hasn't changed since.
+    return KnowledgeBaseCache(
+        fetch_knowledge_base_tables,
+        ttl=float(st.secrets.get("KB_CACHE_TTL", 300)),
+        opening_book_depth=3,
+        description_loader=lambda: fetch_descriptions(init_supabase()),
+        source_loader=fetch_knowledge_base_source,
+        snapshot_dir=st.secrets.get("KB_SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".kb_snapshots")),
+        source_prefix=knowledge_base_source_prefix()
     )
-    for x in response.data:
-        gejala = x["parent"]
-        variasi = x["parent_variant"]
-        anak_gejala = x["subsymptom"]
 
-        subsymptom_df_dict["Gejala"].append(gejala)
-        subsymptom_df_dict["Variasi"].append(variasi)
-        subsymptom_df_dict["AnakGejala"].append(anak_gejala)
-
-    subsymptom_df = pd.DataFrame(subsymptom_df_dict)
+@st.cache_resource
+def get_knowledge_base_subscriber():
+    source = RealtimeChangeSource(st.secrets["SUPABASE_URL"], st.secrets["SUPABASE_KEY"])
+    return KnowledgeBaseSubscriber(get_knowledge_base_cache(), source)
 
-    current_state = UnnamedState(df, subsymptom_df)
-    st.session_state["current_state"] = current_state
-    st.session_state["question_no"] = 1
+def bump_knowledge_base_version():
+    # Called after every admin write so new sessions don't start from stale
+    # data. With the change feed on, the write reaches the cache as a delta
+    # instead of forcing a full reload.
+    if not st.secrets.get("KB_CHANGE_FEED", False):
+        get_knowledge_base_cache().bump_version()
 
-    update_asked_symptom_and_answer_possibilities()
+    for table in ADMIN_TABLES:
+        st.session_state.pop(f"admin_{table}", None)
 
-def fetch_disease_symptoms_from_supabase(supabase):
-    df_dict = {
-        "Id": [],
-        "Penyakit": [],
-        "Gejala": [],
-        "Variasi": [],
-        "Frekuensi": []
-    }
+if st.secrets.get("KB_CHANGE_FEED", False):
+    get_knowledge_base_subscriber()
 
-    response = (
-        supabase.table("disease_variant_free_symptoms")
-        .select("id, disease_symptoms(disease, frequency), symptom")
-        .execute()
-    )
-    for x in response.data:
-        id_ = x["id"]
-        penyakit = x["disease_symptoms"]["disease"]
-        gejala = x["symptom"]
-        variasi = None
-        frekuensi = x["disease_symptoms"]["frequency"] if x["disease_symptoms"]["frequency"] else None
-
-        df_dict["Id"].append(id_)
-        df_dict["Penyakit"].append(penyakit)
-        df_dict["Gejala"].append(gejala)
-        df_dict["Variasi"].append(variasi)
-        df_dict["Frekuensi"].append(frekuensi)
-
-    response = (
-        supabase.table("disease_variant_specific_symptoms")
-        .select("id, disease_symptoms(disease, frequency), symptom, variant")
-        .execute()
-    )
-    for x in response.data:
-        id_ = x["id"]
-        penyakit = x["disease_symptoms"]["disease"]
-        gejala = x["symptom"]
-        variasi = x["variant"]
-        frekuensi = x["disease_symptoms"]["frequency"] if x["disease_symptoms"]["frequency"] else None
-
-        df_dict["Id"].append(id_)
-        df_dict["Penyakit"].append(penyakit)
-        df_dict["Gejala"].append(gejala)
-        df_dict["Variasi"].append(variasi)
-        df_dict["Frekuensi"].append(frekuensi)
-    
-    df = pd.DataFrame(df_dict)
-    df = df.sort_values("Id")
-    return df
+def init_new_session():
+    # Callers rerun right after, so a cancelled start just keeps the previous
+    # session (if any).
+    try:
+        with instrumentation.span("init_new_session"):
+            start_new_session()
+    except ScoringCancelled:
+        pass
+
+def start_new_session():
+    # The session keeps its snapshot, so reruns render descriptions from
+    # memory and a reload elsewhere doesn't change the session's KB midway.
+    snapshot = get_knowledge_base_cache().get()
+    knowledge_base = snapshot.knowledge_base
+
+    # Opt-in: score questions in worker processes shared by all sessions.
+    scoring_workers = int(st.secrets.get("SCORING_WORKERS", 0))
+    scoring_pool = get_shared_scoring_pool(knowledge_base, scoring_workers) if scoring_workers > 0 else None
+
+    current_state = UnnamedState(knowledge_base, scoring_pool=scoring_pool, should_cancel=script_run_interrupted)
+    update_asked_symptom_and_answer_possibilities(current_state, 1)
+    st.session_state["kb_snapshot"] = snapshot
 
 @st.dialog("Ubah data")
 def ask_password():
@@ -145,7 +177,7 @@ def ask_password():
 
             if password_correct:
                 st.session_state["role"] = "admin"
-                st.rerun()
+                rerun()
             else:
                 st.toast("Kata sandi salah.", icon="❌")
 
@@ -177,110 +209,49 @@ def edit_disease_symptom(chosen_disease, symptom, old_variant, old_frequency, sy
         )
 
         if st.form_submit_button("Simpan"):
-            if new_frequency == "-":
-                new_frequency = ""
-
-            if new_variant != "-" and new_variant not in variant_options:
-                (
-                    supabase.table("symptom_variants")
-                    .insert({
-                        "symptom": symptom,
-                        "name": new_variant
-                    })
-                    .execute()
-                )
-
-            if old_variant is None:
-                if new_variant != "-":
-                    (
-                        supabase.table("disease_variant_free_symptoms")
-                        .delete()
-                        .eq("id", symptom_id)
-                        .execute()
-                    )
-
-                    (
-                        supabase.table("disease_variant_specific_symptoms")
-                        .insert({
-                            "id": symptom_id,
-                            "symptom": symptom,
-                            "variant": new_variant,
-                        })
-                        .execute()
-                    )
-
-            else:
-                if new_variant == "-":
-                    (
-                        supabase.table("disease_variant_specific_symptoms")
-                        .delete()
-                        .eq("id", symptom_id)
-                        .execute()
-                    )
-
-                    (
-                        supabase.table("disease_variant_free_symptoms")
-                        .insert({
-                            "id": symptom_id,
-                            "symptom": symptom,
-                        })
-                        .execute()
-                    )
-                
-                else:
-                    (
-                        supabase.table("disease_variant_specific_symptoms")
-                        .update({
-                            "variant": new_variant
-                        })
-                        .eq("id", symptom_id)
-                        .execute()
-                    )
-
             (
-                supabase.table("disease_symptoms")
-                .update({
-                    "frequency": new_frequency
+                supabase.rpc("edit_disease_symptom", {
+                    "p_id": symptom_id,
+                    "p_symptom": symptom,
+                    "p_variant": new_variant if new_variant != "-" else None,
+                    "p_frequency": new_frequency if new_frequency != "-" else "",
                 })
-                .eq("id", symptom_id)
                 .execute()
             )
 
-            st.rerun()
+            bump_knowledge_base_version()
+            rerun()
 
 @st.dialog(f"Tambah Gejala Penyakit")
 def add_disease_symptom(chosen_disease):
     st.markdown(f"**Penyakit: {chosen_disease}**")
 
-    existing_symptoms = set()
-
-    response = (
-        supabase.table("disease_variant_free_symptoms")
-        .select("symptom, disease_symptoms!inner(disease)")
-        .eq("disease_symptoms.disease", chosen_disease)
-        .execute()
-    )
-    for x in response.data:
-        existing_symptoms.add(x["symptom"])
+    responses = fetch_concurrently({
+        "variant_free": lambda: (
+            supabase.table("disease_variant_free_symptoms")
+            .select("symptom, disease_symptoms!inner(disease)")
+            .eq("disease_symptoms.disease", chosen_disease)
+            .execute()
+        ),
+        "variant_specific": lambda: (
+            supabase.table("disease_variant_specific_symptoms")
+            .select("symptom, disease_symptoms!inner(disease)")
+            .eq("disease_symptoms.disease", chosen_disease)
+            .execute()
+        ),
+        "symptoms": lambda: (
+            supabase.table("symptoms")
+            .select("name")
+            .execute()
+        ),
+    })
 
-    response = (
-        supabase.table("disease_variant_specific_symptoms")
-        .select("symptom, disease_symptoms!inner(disease)")
-        .eq("disease_symptoms.disease", chosen_disease)
-        .execute()
-    )
-    for x in response.data:
+    existing_symptoms = set()
+    for x in responses["variant_free"].data + responses["variant_specific"].data:
         existing_symptoms.add(x["symptom"])
     
     reusable_symptoms = set()
-    
-    response = (
-        supabase.table("symptoms")
-        .select("name")
-        .execute()
-    )
-
-    for x in response.data:
+    for x in responses["symptoms"].data:
         if x["name"] not in existing_symptoms:
             reusable_symptoms.add(x["name"])
 
@@ -317,66 +288,20 @@ def add_disease_symptom(chosen_disease):
         )
     
     if st.button("Simpan", disabled=(new_variant is None)):
-        if new_symptom not in reusable_symptoms:
-            (
-                supabase.table("symptoms")
-                .insert({
-                    "name": new_symptom
-                })
-                .execute()
-            )
-
-        if new_variant != "-" and new_variant not in variant_options:
-            (
-                supabase.table("symptom_variants")
-                .insert({
-                    "symptom": new_symptom,
-                    "name": new_variant
-                })
-                .execute()
-            )
-
+        # Creates the symptom and variant if they are new, and returns the id
+        # of the new row, all in one transaction.
         (
-            supabase.table("disease_symptoms")
-            .insert({
-                "disease": chosen_disease,
-                "frequency": new_frequency,
+            supabase.rpc("add_disease_symptom", {
+                "p_disease": chosen_disease,
+                "p_symptom": new_symptom,
+                "p_variant": new_variant if new_variant != "-" else None,
+                "p_frequency": new_frequency if new_frequency != "-" else "",
             })
             .execute()
         )
 
-        response = (
-            supabase.table("disease_symptoms")
-            .select("id")
-            .eq("disease", chosen_disease)
-            .eq("frequency", new_frequency)
-            .order("created_at", desc=True)
-            .limit(1)
-            .execute()
-        )
-        new_id = response.data[0]["id"]
-
-        if new_variant == "-":
-            (
-                supabase.table("disease_variant_free_symptoms")
-                .insert({
-                    "id": new_id,
-                    "symptom": new_symptom,
-                })
-                .execute()
-            )
-        else:
-            (
-                supabase.table("disease_variant_specific_symptoms")
-                .insert({
-                    "id": new_id,
-                    "symptom": new_symptom,
-                    "variant": new_variant
-                })
-                .execute()
-            )
-        
-        st.rerun()
+        bump_knowledge_base_version()
+        rerun()
 
 @st.dialog(f"Hapus Gejala Penyakit")
 def delete_disease_symptom(chosen_disease, symptom, symptom_id):
@@ -390,7 +315,8 @@ def delete_disease_symptom(chosen_disease, symptom, symptom_id):
                 .eq("id", symptom_id)
                 .execute()
             )
-            st.rerun()
+            bump_knowledge_base_version()
+            rerun()
 
 @st.dialog("Tambah Penyakit")
 def add_disease():
@@ -429,75 +355,8 @@ def add_disease():
                         })
                         .execute()
                     )
-                    st.rerun()
-
-@st.dialog("Ubah Penyakit")
-def edit_disease(old_name, old_description):
-    st.markdown(f"**Penyakit: {old_name}**")
-    with st.form("edit_disease_form", enter_to_submit=False, border=False):
-        disease_name = st.text_input("Nama", value=old_name)
-        disease_description = st.text_area(
-            "Deskripsi (opsional)",
-            value=old_description,
-            placeholder="Tulis deskripsi di sini, atau tulis \"GENERATE\" (tanpa tanda petik) untuk pembangkitan otomatis."
-        )
-
-        if st.form_submit_button("Ubah"):
-            disease_name = disease_name.strip()
-            if disease_name == "":
-                st.error("Nama tidak boleh kosong.")
-            else:
-                disease_description = disease_description.strip()
-                if disease_description == "-":
-                    disease_description = ""
-                elif disease_description == "GENERATE":
-                    disease_description = generate_description(disease_name)
-                
-                if disease_name != old_name:
-                    existing_data = (
-                        supabase.table("diseases")
-                        .select("name")
-                        .eq("name", disease_name)
-                        .execute()
-                    )
-                    if len(existing_data.data) > 0:
-                        st.error(f"Penyakit dengan nama \"{disease_name}\" sudah ada.")
-                    else:
-                        (
-                            supabase.table("diseases")
-                            .update({
-                                "name": disease_name,
-                                "description": disease_description
-                            })
-                            .eq("name", old_name)
-                            .execute()
-                        )
-                        st.rerun()
-
-                else:
-                    (
-                        supabase.table("diseases")
-                        .update({
-                            "description": disease_description
-                        })
-                        .eq("name", old_name)
-                        .execute()
-                    )
-                    st.rerun()
-
-@st.dialog(f"Hapus Penyakit")
-def delete_disease(disease_name):
-    st.markdown(f"**Hapus penyakit {disease_name}?**")        
-
-    with st.form("delete_disease_form", enter_to_submit=False, border=False):
-        if st.form_submit_button("Ya"):
-            (
-                supabase.table("diseases")
-                .delete()
-                .eq("name", disease_name)
-                .execute()
-            )
-            st.rerun()
+                    bump_knowledge_base_version()
+                    rerun()
 
 @st.dialog("Tambah Gejala")
 def add_symptom():
@@ -536,75 +395,8 @@ def add_symptom():
                         })
                         .execute()
                     )
-                    st.rerun()
-
-@st.dialog("Ubah Gejala")
-def edit_symptom(old_name, old_description):
-    st.markdown(f"**Gejala: {old_name}**")
-    with st.form("edit_symptom_form", enter_to_submit=False, border=False):
-        symptom_name = st.text_input("Nama", value=old_name)
-        symptom_description = st.text_area(
-            "Deskripsi (opsional)",
-            value=old_description,
-            placeholder="Tulis deskripsi di sini, atau tulis \"GENERATE\" (tanpa tanda petik) untuk pembangkitan otomatis."
-        )
-
-        if st.form_submit_button("Ubah"):
-            symptom_name = symptom_name.strip()
-            if symptom_name == "":
-                st.error("Nama tidak boleh kosong.")
-            else:
-                symptom_description = symptom_description.strip()
-                if symptom_description == "-":
-                    symptom_description = ""
-                elif symptom_description == "GENERATE":
-                    symptom_description = generate_description(symptom_name)
-                
-                if symptom_name != old_name:
-                    existing_data = (
-                        supabase.table("symptoms")
-                        .select("name")
-                        .eq("name", symptom_name)
-                        .execute()
-                    )
-                    if len(existing_data.data) > 0:
-                        st.error(f"Gejala dengan nama \"{symptom_name}\" sudah ada.")
-                    else:
-                        (
-                            supabase.table("symptoms")
-                            .update({
-                                "name": symptom_name,
-                                "description": symptom_description
-                            })
-                            .eq("name", old_name)
-                            .execute()
-                        )
-                        st.rerun()
-
-                else:
-                    (
-                        supabase.table("symptoms")
-                        .update({
-                            "description": symptom_description
-                        })
-                        .eq("name", old_name)
-                        .execute()
-                    )
-                    st.rerun()
-
-@st.dialog(f"Hapus Gejala")
-def delete_symptom(symptom_name):
-    st.markdown(f"**Hapus gejala {symptom_name}?**")        
-
-    with st.form("delete_symptom_form", enter_to_submit=False, border=False):
-        if st.form_submit_button("Ya"):
-            (
-                supabase.table("symptoms")
-                .delete()
-                .eq("name", symptom_name)
-                .execute()
-            )
-            st.rerun()
+                    bump_knowledge_base_version()
+                    rerun()
 
 @st.dialog("Tambah Anak Gejala")
 def add_subsymptom(symptom, existing_subsymptoms):
@@ -616,85 +408,63 @@ def add_subsymptom(symptom, existing_subsymptoms):
     )
     variant_options = ["-"] + [x["name"] for x in response.data]
 
-    ancestor_list = []
-    curr_el = symptom
-    while curr_el is not None:
-        response = (
-            supabase.table("variant_free_subsymptoms")
-            .select("parent")
-            .eq("subsymptom", curr_el)
-            .execute()
-        )
-        if len(response.data) > 0:
-            curr_el = response.data[0]["parent"]
-            ancestor_list.append(curr_el)
-            continue
-
-        response = (
-            supabase.table("variant_specific_subsymptoms")
-            .select("parent")
-            .eq("subsymptom", curr_el)
-            .execute()
-        )
-        if len(response.data) > 0:
-            curr_el = response.data[0]["parent"]
-            ancestor_list.append(curr_el)
-            continue
-
-        curr_el = None
-
-    response = (
-        supabase.table("symptoms")
-        .select("name")
-        .execute()
-    )
+    # Hierarchy and symptom names come from the KB snapshot, so opening the
+    # dialog doesn't walk up the tree one query at a time.
+    snapshot = get_knowledge_base_cache().get()
+    hierarchy = snapshot.knowledge_base.hierarchy
+    ancestor_list = hierarchy.ancestors(symptom) or []
 
     subsymptom_options = []
-    for x in response.data:
-        if x["name"] != symptom and x["name"] not in existing_subsymptoms and x["name"] not in ancestor_list:
-            subsymptom_options.append(x["name"])
+    for x in sorted(snapshot.symptom_descriptions):
+        if x != symptom and x not in existing_subsymptoms and x not in ancestor_list:
+            subsymptom_options.append(x)
 
     with st.form("add_subsymptom_form", enter_to_submit=False, border=False):
         variant = st.selectbox("Variasi", variant_options)
         subsymptom = st.selectbox("Anak gejala", subsymptom_options, index=None)
 
         if st.form_submit_button("Tambah"):
-            # TODO: Check if this is valid to add.
-            (
-                supabase.table("subsymptoms")
-                .delete()
-                .eq("subsymptom", subsymptom)
-                .execute()
-            )
-            (
-                supabase.table("subsymptoms")
-                .insert({
-                    "subsymptom": subsymptom
-                })
-                .execute()
-            )
-
-            if variant == "-":
+            if subsymptom is None:
+                st.warning("Pilih anak gejala.")
+            elif not hierarchy.can_add(symptom, subsymptom):
+                st.error(f"{subsymptom} tidak dapat menjadi anak gejala {symptom} karena akan membentuk siklus.")
+            else:
                 (
-                    supabase.table("variant_free_subsymptoms")
-                    .insert({
-                        "subsymptom": subsymptom,
-                        "parent": symptom,
-                    })
+                    supabase.table("subsymptoms")
+                    .delete()
+                    .eq("subsymptom", subsymptom)
                     .execute()
                 )
-            else:
                 (
-                    supabase.table("variant_specific_subsymptoms")
+                    supabase.table("subsymptoms")
                     .insert({
-                        "subsymptom": subsymptom,
-                        "parent": symptom,
-                        "parent_variant": variant
+                        "subsymptom": subsymptom
                     })
                     .execute()
                 )
+
+                if variant == "-":
+                    (
+                        supabase.table("variant_free_subsymptoms")
+                        .insert({
+                            "subsymptom": subsymptom,
+                            "parent": symptom,
+                        })
+                        .execute()
+                    )
+                else:
+                    (
+                        supabase.table("variant_specific_subsymptoms")
+                        .insert({
+                            "subsymptom": subsymptom,
+                            "parent": symptom,
+                            "parent_variant": variant
+                        })
+                        .execute()
+                    )
             
-            st.rerun()
+                bump_knowledge_base_version()
+                rerun()
 
 @st.dialog(f"Hapus Anak Gejala")
 def delete_subsymptom(subsymptom, parent):
@@ -708,16 +478,148 @@ def delete_subsymptom(subsymptom, parent):
                 .eq("subsymptom", subsymptom)
                 .execute()
             )
-            st.rerun()
+            bump_knowledge_base_version()
+            rerun()
+
+ADMIN_PAGE_SIZE = 50
+
+ADMIN_TABLES = {
+    "diseases": lambda: name_description_frame(fetch_columns(supabase, "diseases", ["name", "description"], "name")),
+    "symptoms": lambda: name_description_frame(fetch_columns(supabase, "symptoms", ["name", "description"], "name")),
+    "disease_symptoms": lambda: fetch_disease_symptoms(supabase),
+}
+
+def name_description_frame(data):
+    return pd.DataFrame({"Nama": data["name"], "Deskripsi": data["description"]})
+
+def fetch_admin_tables():
+    # Everything the admin tabs show, kept in the session while the KB
+    # snapshot they were fetched with is current. A new snapshot (after a
+    # write here, a change-feed delta, or the ttl catching up with writes
+    # made elsewhere) refetches them, so edits aren't made on stale rows.
+    # Whatever is missing is fetched at once, so a reload costs the slowest
+    # query instead of the sum of all of them.
+    snapshot = get_knowledge_base_cache().get()
+    if st.session_state.get("admin_kb_snapshot") is not snapshot:
+        for table in ADMIN_TABLES:
+            st.session_state.pop(f"admin_{table}", None)
+
+        st.session_state["admin_kb_snapshot"] = snapshot
+
+    missing = {k: v for k, v in ADMIN_TABLES.items() if f"admin_{k}" not in st.session_state}
+    for table, df in fetch_concurrently(missing).items():
+        st.session_state[f"admin_{table}"] = df
+
+def fetch_admin_table(table):
+    if f"admin_{table}" not in st.session_state:
+        fetch_admin_tables()
+
+    return st.session_state[f"admin_{table}"]
+
+def read_import_diff(uploaded_file):
+    # (errors, diff against the KB) of an uploaded import. Kept in the
+    # session until another file is uploaded or the KB snapshot is replaced,
+    # so reruns in between neither re-parse the file nor refetch the tables.
+    snapshot = get_knowledge_base_cache().get()
+    cached = st.session_state.get("import_diff")
+    if cached is None or cached["file_id"] != uploaded_file.file_id or cached["kb_snapshot"] is not snapshot:
+        symptom_df, subsymptom_df, errors = kb_transfer.read_import(uploaded_file, uploaded_file.name)
+        import_diff = None
+        if len(errors) == 0:
+            import_diff = kb_transfer.diff(*fetch_knowledge_base_tables(), symptom_df, subsymptom_df)
+
+        cached = {"file_id": uploaded_file.file_id, "kb_snapshot": snapshot, "errors": errors, "diff": import_diff}
+        st.session_state["import_diff"] = cached
+
+    return cached["errors"], cached["diff"]
+
+def normalize_description(name, description):
+    description = (description or "").strip()
+    if description == "-":
+        return ""
+    elif description == "GENERATE":
+        return generate_description(name)
+
+    return description
+
+def save_name_changes(table, changes):
+    kb_admin.save_name_changes(supabase, table, changes, normalize_description)
+    bump_knowledge_base_version()
+    rerun()
+
+@st.dialog("Simpan perubahan")
+def confirm_name_changes(table, label, changes):
+    st.markdown(f"**{label} berikut akan dihapus:**")
+    st.markdown("\n".join(f"- {name}" for name in changes.deleted))
+
+    with st.form(f"confirm_{table}_changes_form", enter_to_submit=False, border=False):
+        if st.form_submit_button("Ya"):
+            save_name_changes(table, changes)
+
+def name_description_editor(table, label):
+    df = fetch_admin_table(table)
+
+    search = st.text_input("Cari", key=f"{table}_search")
+    if search:
+        mask = (
+            df["Nama"].str.contains(search, case=False, regex=False)
+            | df["Deskripsi"].fillna("").str.contains(search, case=False, regex=False)
+        )
+        df = df[mask]
+
+    n_pages = max(1, math.ceil(len(df) / ADMIN_PAGE_SIZE))
+    page_key = f"{table}_page"
+    if st.session_state.get(page_key, 1) > n_pages:
+        st.session_state[page_key] = n_pages
+
+    page = st.number_input(f"Halaman (dari {n_pages})", min_value=1, max_value=n_pages, key=page_key)
+    page_df = df.iloc[(page - 1) * ADMIN_PAGE_SIZE:page * ADMIN_PAGE_SIZE].reset_index(drop=True)
+
+    # One editor per page and search, so switching pages starts a fresh diff.
+    editor_key = f"{table}_editor_{page}_{search}"
+    st.data_editor(
+        page_df,
+        key=editor_key,
+        num_rows="dynamic",
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            "Nama": st.column_config.TextColumn(required=True),
+            "Deskripsi": st.column_config.TextColumn(help="Tulis \"GENERATE\" (tanpa tanda petik) untuk pembangkitan otomatis."),
+        }
+    )
+    st.caption(f"{len(df)} {label.lower()}")
+
+    changes = st.session_state.get(editor_key, {})
+    has_changes = any(len(changes.get(x, [])) > 0 for x in ("edited_rows", "added_rows", "deleted_rows"))
+    if st.button("Simpan perubahan", key=f"{table}_save", type="primary", disabled=not has_changes):
+        name_changes = kb_admin.name_changes(page_df, changes)
+        error = kb_admin.validate_name_changes(name_changes, set(fetch_admin_table(table)["Nama"]), label)
+        if error is not None:
+            st.error(error)
+        elif len(name_changes.deleted) > 0:
+            # Deletes can't be undone, so they are confirmed first.
+            confirm_name_changes(table, label, name_changes)
+        else:
+            save_name_changes(table, name_changes)
+
+if "debug_mode" not in st.session_state:
+    # DEBUG_MODE in the secrets shows the live predictions and the
+    # instrumentation panel next to the questions.
+    st.session_state["debug_mode"] = bool(st.secrets.get("DEBUG_MODE", False))
+
+if st.session_state["debug_mode"]:
+    if "recorder" not in st.session_state:
+        st.session_state["recorder"] = instrumentation.Recorder()
+    instrumentation.set_thread_recorder(st.session_state["recorder"])
+else:
+    instrumentation.set_thread_recorder(None)
 
 if "role" not in st.session_state:
-    if "debug_mode" not in st.session_state:
-        st.session_state["debug_mode"] = False
-    
     if st.button("Mulai", type="primary"):
         st.session_state["role"] = "user"
         init_new_session()
-        st.rerun()
+        rerun()
 
     # Removing debug mode for now.
 
@@ -727,11 +629,12 @@ if "role" not in st.session_state:
         ask_password()
 
 elif st.session_state["role"] == "user":
-    if "current_state" not in st.session_state:
+    if "current_state" not in st.session_state or "kb_snapshot" not in st.session_state:
         del st.session_state["role"]
-        st.rerun()
+        rerun()
 
     current_state = st.session_state["current_state"]
+    kb_snapshot = st.session_state["kb_snapshot"]
     possibilities = st.session_state["possibilities"]
 
     if st.session_state["debug_mode"]:
@@ -753,21 +656,26 @@ elif st.session_state["role"] == "user":
                 label = 'Tidak' if not exists else ('Ya' if variant_column is None else variant_column)
                 label = label.replace(">", "\\>")
                 if st.button(label, use_container_width=True):
-                    current_state.answer(asked_symptom, exists, variant_column)
-                    next_question()
-                    st.rerun()
+                    try:
+                        next_state = current_state.copy()
+                        next_state.answer(asked_symptom, exists, variant_column)
+                        next_question(next_state)
+                    except ScoringCancelled:
+                        pass
+
+                    rerun()
 
         if conversation_view.button("Lewati", type="tertiary"):
-            current_state.skip(asked_symptom)
-            next_question()
-            st.rerun()
+            try:
+                next_state = current_state.copy()
+                next_state.skip(asked_symptom)
+                next_question(next_state)
+            except ScoringCancelled:
+                pass
 
-        description = (
-            supabase.table("symptoms")
-            .select("description")
-            .eq("name", asked_symptom)
-            .execute()
-        ).data[0]["description"]
+            rerun()
+
+        description = kb_snapshot.symptom_descriptions.get(asked_symptom)
 
         if description:
             if right.button("❓", use_container_width=True, type="tertiary"):
@@ -798,12 +706,7 @@ elif st.session_state["role"] == "user":
                 prob = to_proper_percentage_string(prob)
                 prediction_content += f"\n- **{d_name} ({prob})**"
 
-                description = (
-                    supabase.table("diseases")
-                    .select("description")
-                    .eq("name", d_name)
-                    .execute()
-                ).data[0]["description"]
+                description = kb_snapshot.disease_descriptions.get(d_name)
                 if description:
                     prediction_content += f"—{description}"
 
@@ -853,6 +756,13 @@ elif st.session_state["role"] == "user":
             no_disease_prob = to_proper_percentage_string(no_disease_prob)
             right_view.markdown(f":gray[**Tidak ada penyakit**: {no_disease_prob}]")
 
+        recorder = st.session_state.get("recorder")
+        if recorder is not None:
+            with right_view.expander("Instrumentasi"):
+                st.json(recorder.summary())
+                st.json(current_state.transposition_table.stats() if current_state.transposition_table is not None else {})
+                st.download_button("Unduh (JSON Lines)", recorder.to_json_lines(), file_name="instrumentation.jsonl", mime="application/jsonl")
+
     # print(predictions)
     # entropy = predictions["entropy"]
     # right_view.markdown(f":gray[**Entropi**: {entropy}]")
@@ -860,111 +770,58 @@ elif st.session_state["role"] == "user":
     st.divider()
     if st.button("Mulai Ulang", use_container_width=True, type="tertiary"):
         init_new_session()
-        st.rerun()
+        rerun()
 
 else:
     st.title("Ubah data")
-    disease_list_tab, symptom_list_tab, subsymptom_list_tab, disease_symptom_tab = st.tabs([
+    disease_list_tab, symptom_list_tab, subsymptom_list_tab, disease_symptom_tab, transfer_tab = st.tabs([
         "Daftar Penyakit",
         "Daftar Gejala",
         "Daftar Anak Gejala",
-        "Gejala Penyakit"
+        "Gejala Penyakit",
+        "Impor/Ekspor"
     ])
 
+    fetch_admin_tables()
+
     with disease_list_tab:
-        response = (
-            supabase.table("diseases")
-            .select("name", "description")
-            .execute()
-        )
-        if len(response.data) > 0:
-            layout = [4, 8, 1, 1]
-            name_column, description_column, _, _ = st.columns(layout)
-            name_column.markdown("**Nama**")
-            description_column.markdown("**Deskripsi**")
-
-            for x in response.data:
-                name_column, description_column, edit_column, del_column = st.columns(layout)
-                disease_name = x["name"]
-                description = x["description"]
-
-                name_column.text(disease_name)
-                description_column.text(description if description != "" else "-")
-
-                if edit_column.button("⚙️", key=f"disease_{disease_name}_edit", type="tertiary"):
-                    edit_disease(disease_name, description)
-
-                if del_column.button("🗑️", key=f"disease_{disease_name}_delete", type="tertiary"):
-                    delete_disease(disease_name)
-                
-            
-        else:
-            st.info("Tidak ada data penyakit.")
+        name_description_editor("diseases", "Penyakit")
 
         if st.button("Tambah penyakit"):
             add_disease()
 
     with symptom_list_tab:
-        response = (
-            supabase.table("symptoms")
-            .select("name", "description")
-            .execute()
-        )
-        if len(response.data) > 0:
-            layout = [4, 8, 1, 1]
-            name_column, description_column, _, _ = st.columns(layout)
-            name_column.markdown("**Nama**")
-            description_column.markdown("**Deskripsi**")
-
-            for x in response.data:
-                name_column, description_column, edit_column, del_column = st.columns(layout)
-                symptom_name = x["name"]
-                description = x["description"]
-
-                name_column.text(symptom_name)
-                description_column.text(description if description != "" else "-")
-
-                if edit_column.button("⚙️", key=f"symptom_{symptom_name}_edit", type="tertiary"):
-                    edit_symptom(symptom_name, description)
-
-                if del_column.button("🗑️", key=f"symptom_{symptom_name}_delete", type="tertiary"):
-                    delete_symptom(symptom_name)
-            
-        else:
-            st.info("Tidak ada data gejala.")
+        name_description_editor("symptoms", "Gejala")
 
         if st.button("Tambah gejala"):
             add_symptom()
 
     with subsymptom_list_tab:
-        response = (
-            supabase.table("symptoms")
-            .select("name")
-            .execute()
-        )
-        symptoms = [x["name"] for x in response.data]
+        symptoms = list(fetch_admin_table("symptoms")["Nama"])
 
         if len(symptoms) > 0:
             chosen_symptom = st.selectbox("Gejala", symptoms, key="chosen_symptom")
 
+            responses = fetch_concurrently({
+                "variant_free": lambda: (
+                    supabase.table("variant_free_subsymptoms")
+                    .select("subsymptom", "subsymptoms(created_at)")
+                    .eq("parent", chosen_symptom)
+                    .execute()
+                ),
+                "variant_specific": lambda: (
+                    supabase.table("variant_specific_subsymptoms")
+                    .select("parent_variant", "subsymptom", "subsymptoms(created_at)")
+                    .eq("parent", chosen_symptom)
+                    .execute()
+                ),
+            })
+
             view_data = []
-            response = (
-                supabase.table("variant_free_subsymptoms")
-                .select("subsymptom", "subsymptoms(created_at)")
-                .eq("parent", chosen_symptom)
-                .execute()
-            )
-            for x in response.data:
+            for x in responses["variant_free"].data:
                 view_data.append((x["subsymptoms"]["created_at"], "-", x["subsymptom"]))
 
-            response = (
-                supabase.table("variant_specific_subsymptoms")
-                .select("parent_variant", "subsymptom", "subsymptoms(created_at)")
-                .eq("parent", chosen_symptom)
-                .execute()
-            )
-            
-            for x in response.data:
+            for x in responses["variant_specific"].data:
                 view_data.append((x["subsymptoms"]["created_at"], x["parent_variant"], x["subsymptom"]))
             
             view_data.sort(key=lambda x: x[0])
@@ -990,14 +847,8 @@ else:
             st.info("Tidak ada data gejala.")
 
     with disease_symptom_tab:
-        sb_df = fetch_disease_symptoms_from_supabase(supabase)
-
-        response = (
-            supabase.table("diseases")
-            .select("name")
-            .execute()
-        )
-        diseases = [x["name"] for x in response.data]
+        sb_df = fetch_admin_table("disease_symptoms")
+        diseases = list(fetch_admin_table("diseases")["Nama"])
         if len(diseases) > 0:
             chosen_disease = st.selectbox("Penyakit", diseases, key="chosen_disease")
 
@@ -1028,8 +879,41 @@ else:
         else:
             st.text("Tidak ada data penyakit.")
 
+    with transfer_tab:
+        st.markdown("**Impor**")
+        st.caption("Berkas Excel dengan sheet SymptomTable dan SubsymptomTable (seperti data.xlsx), atau CSV berisi SymptomTable saja.")
+        uploaded_file = st.file_uploader("Berkas", type=["xlsx", "csv"])
+        if uploaded_file is not None:
+            errors, import_diff = read_import_diff(uploaded_file)
+
+            if len(errors) > 0:
+                st.error("\n".join(f"- {x}" for x in errors[:20]) + (f"\n- ... ({len(errors) - 20} lainnya)" if len(errors) > 20 else ""))
+            else:
+                st.table(pd.DataFrame({"Perubahan": list(import_diff.summary()), "Jumlah": list(import_diff.summary().values())}))
+
+                if st.button("Terapkan", type="primary", disabled=import_diff.is_empty()):
+                    with st.spinner("Menerapkan perubahan..."):
+                        kb_transfer.apply_diff(supabase, import_diff)
+
+                    bump_knowledge_base_version()
+                    rerun()
+
+        st.markdown("**Ekspor**")
+        if st.button("Siapkan berkas ekspor"):
+            st.session_state["export_file"] = kb_transfer.export_workbook(supabase)
+
+        if "export_file" in st.session_state:
+            st.download_button(
+                "Unduh (Excel)",
+                st.session_state["export_file"],
+                file_name="data.xlsx",
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            )
+
     st.divider()
 
     if st.button("Keluar dari menu ubah data", type="tertiary"):
         del st.session_state["role"]
-        st.rerun()
+        rerun()
+
+finish_rerun()
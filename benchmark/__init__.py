@@ -0,0 +1,4 @@
+from benchmark.synthetic import generate_knowledge_base
+from benchmark.run import run_benchmark
+
+__all__ = ["generate_knowledge_base", "run_benchmark"]
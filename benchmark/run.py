@@ -0,0 +1,182 @@
+import argparse
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from benchmark.synthetic import generate_knowledge_base
+from experiment_3 import KnowledgeBase, UnnamedState
+
+PRESETS = {
+    "small": {"n_diseases": 50, "n_symptoms": 100},
+    "medium": {"n_diseases": 200, "n_symptoms": 400},
+    "large": {"n_diseases": 1000, "n_symptoms": 1500},
+}
+
+def summarize(durations: list[float]) -> dict:
+    return {
+        "count": len(durations),
+        "min": min(durations),
+        "median": statistics.median(durations),
+        "mean": statistics.fmean(durations),
+        "max": max(durations),
+    }
+
+def new_state(knowledge_base: KnowledgeBase) -> UnnamedState:
+    # No transposition table, so every call measures the engine itself.
+    return UnnamedState(knowledge_base, transposition_table=None)
+
+def run_session(knowledge_base: KnowledgeBase, seed: int) -> int:
+    r = random.Random(seed)
+    state = new_state(knowledge_base)
+    question_no = 1
+    while question_no <= 10 and not (state.is_certain() or state.should_stop()):
+        symptom = state.get_best_symptom_to_ask()
+        if symptom is None:
+            break
+
+        possibilities = state.get_possibilities(symptom)
+        answer = r.randrange(len(possibilities) + 1)
+        if answer < len(possibilities):
+            exists, variant, _ = possibilities[answer]
+            state.answer(symptom, exists, variant)
+        else:
+            state.skip(symptom)
+
+        question_no += 1
+
+    return question_no - 1
+
+def time_call(function) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+def run_benchmark(
+    n_diseases: int = 100,
+    n_symptoms: int = 200,
+    variant_rate: float = 0.2,
+    hierarchy_depth: int = 2,
+    sparsity: float = 0.9,
+    seed: int = 0,
+    repeat: int = 5,
+    sessions: int = 20
+) -> dict:
+    symptom_df, subsymptom_df = generate_knowledge_base(n_diseases, n_symptoms, variant_rate, hierarchy_depth, sparsity, seed)
+    knowledge_base = KnowledgeBase(symptom_df, subsymptom_df)
+
+    timings = {
+        "construction": [time_call(lambda: UnnamedState(symptom_df, subsymptom_df, transposition_table=None)) for _ in range(repeat)],
+        "get_best_symptom_to_ask": [],
+        "answer": [],
+        "skip": [],
+    }
+
+    for _ in range(repeat):
+        state = new_state(knowledge_base)
+        timings["get_best_symptom_to_ask"].append(time_call(state.get_best_symptom_to_ask))
+
+        symptom = state.get_best_symptom_to_ask()
+        if symptom is None:
+            continue
+
+        exists, variant, _ = state.get_possibilities(symptom)[0]
+        timings["answer"].append(time_call(lambda: state.answer(symptom, exists, variant)))
+
+        state = new_state(knowledge_base)
+        state.get_best_symptom_to_ask()
+        timings["skip"].append(time_call(lambda: state.skip(symptom)))
+
+    session_durations = []
+    question_counts = []
+    for i in range(sessions):
+        start = time.perf_counter()
+        question_counts.append(run_session(knowledge_base, seed + i))
+        session_durations.append(time.perf_counter() - start)
+
+    results = {name: summarize(durations) for name, durations in timings.items() if len(durations) > 0}
+    results["session"] = summarize(session_durations)
+    results["session"]["mean_questions"] = statistics.fmean(question_counts)
+
+    return {
+        "parameters": {
+            "n_diseases": n_diseases,
+            "n_symptoms": n_symptoms,
+            "variant_rate": variant_rate,
+            "hierarchy_depth": hierarchy_depth,
+            "sparsity": sparsity,
+            "seed": seed,
+            "repeat": repeat,
+            "sessions": sessions,
+        },
+        "knowledge_base": {
+            "rows": len(symptom_df),
+            "subsymptom_rows": len(subsymptom_df),
+            "diseases": len(knowledge_base.disease_names),
+            "symptoms": len(knowledge_base.symptom_names),
+            "version": knowledge_base.version,
+        },
+        "seconds": results,
+    }
+
+def get_environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=Path(__file__).resolve().parent, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the diagnosis engine on synthetic knowledge bases.")
+    parser.add_argument("--preset", choices=sorted(PRESETS), action="append", help="Size preset; can be given more than once.")
+    parser.add_argument("--diseases", type=int, default=100)
+    parser.add_argument("--symptoms", type=int, default=200)
+    parser.add_argument("--variant-rate", type=float, default=0.2)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--sparsity", type=float, default=0.9)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--output", help="Write the JSON results here instead of stdout.")
+    args = parser.parse_args()
+
+    if args.preset:
+        sizes = [PRESETS[x] for x in args.preset]
+    else:
+        sizes = [{"n_diseases": args.diseases, "n_symptoms": args.symptoms}]
+
+    runs = [
+        run_benchmark(
+            variant_rate=args.variant_rate,
+            hierarchy_depth=args.depth,
+            sparsity=args.sparsity,
+            seed=args.seed,
+            repeat=args.repeat,
+            sessions=args.sessions,
+            **size
+        )
+        for size in sizes
+    ]
+
+    output = json.dumps({"environment": get_environment(), "runs": runs}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
@@ -0,0 +1,218 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import random
+import statistics
+import time
+from collections import Counter
+
+import pandas as pd
+
+from benchmark.synthetic import generate_knowledge_base
+from experiment_3 import KnowledgeBase, UnnamedState
+
+MAX_QUESTIONS = 10
+
+class VirtualPatient:
+    # Answers questions from a fixed set of present symptoms. Anything not
+    # present is answered "no", or skipped if "no" is not an option.
+    def __init__(self, disease: str | None, present: dict[str, str | None], skipped: set[str] | None = None, seed: int = 0):
+        self.disease = disease
+        self.present = present
+        self.skipped = skipped or set()
+        self.random = random.Random(seed)
+
+    @classmethod
+    def sample(cls, knowledge_base: KnowledgeBase, seed: int) -> "VirtualPatient":
+        # Draws a disease uniformly, then each linked symptom with its
+        # frequency probability, in the linked variant if there is one.
+        r = random.Random(seed)
+        d = r.randrange(len(knowledge_base.disease_names))
+        present = {}
+        for s, symptom in enumerate(knowledge_base.symptom_names):
+            if knowledge_base.unlinked[s, d] or r.random() >= knowledge_base.link_probs[s, d]:
+                continue
+
+            variant_id = knowledge_base.link_variants[s, d]
+            present[symptom] = list(knowledge_base.variant_index[s])[variant_id] if variant_id >= 0 else None
+
+        return cls(knowledge_base.disease_names[d], present, seed=seed)
+
+    @classmethod
+    def from_script(cls, script: dict, seed: int = 0) -> "VirtualPatient":
+        # {"disease": ..., "answers": {symptom: {"exists": ..., "variant": ...} | "skip"}}
+        present = {}
+        skipped = set()
+        for symptom, answer in script["answers"].items():
+            if answer == "skip":
+                skipped.add(symptom)
+            elif answer["exists"]:
+                present[symptom] = answer.get("variant")
+
+        return cls(script.get("disease"), present, skipped, seed)
+
+    def has_symptom(self, knowledge_base: KnowledgeBase, symptom: str) -> bool:
+        if symptom in self.present:
+            return True
+
+        # A parent symptom is there if any of its subsymptoms is.
+        if knowledge_base.hierarchy is not None:
+            return any(x in self.present for x in knowledge_base.hierarchy.descendants(symptom))
+
+        return False
+
+    def respond(self, knowledge_base: KnowledgeBase, symptom: str, possibilities: list[tuple[bool, str | None, float]]) -> int | None:
+        # Index into possibilities, or None to skip.
+        if symptom in self.skipped:
+            return None
+
+        if self.has_symptom(knowledge_base, symptom):
+            variant = self.present.get(symptom)
+            options = [i for i, (exists, x, _) in enumerate(possibilities) if exists and (x == variant or variant is None)]
+            if variant is None:
+                plain = [i for i in options if possibilities[i][1] is None]
+                if len(plain) > 0:
+                    options = plain
+        else:
+            options = [i for i, (exists, _, _) in enumerate(possibilities) if not exists]
+
+        if len(options) == 0:
+            return None
+
+        return self.random.choice(options)
+
+def run_session(knowledge_base: KnowledgeBase, patient: VirtualPatient, stop_early: bool = False) -> dict:
+    # Same rules as app.py: at most MAX_QUESTIONS questions, ending early when
+    # there is nothing left to ask. stop_early adds the CLI's should_stop rule.
+    state = UnnamedState(knowledge_base)
+    asked = []
+    question_no = 1
+    while question_no <= MAX_QUESTIONS:
+        if stop_early and (state.is_certain() or state.should_stop()):
+            break
+
+        symptom = state.get_best_symptom_to_ask()
+        if symptom is None:
+            break
+
+        possibilities = state.get_possibilities(symptom)
+        answer = patient.respond(knowledge_base, symptom, possibilities)
+        if answer is None:
+            state.skip(symptom)
+        else:
+            exists, variant, _ = possibilities[answer]
+            state.answer(symptom, exists, variant)
+
+        asked.append((symptom, answer))
+        question_no += 1
+
+    predictions = [x["name"] for x in state.get_predictions()["diseases"]]
+    return {
+        "disease": patient.disease,
+        "asked": asked,
+        "predictions": predictions[:5],
+        "rank": predictions.index(patient.disease) + 1 if patient.disease in predictions else None,
+    }
+
+_knowledge_base: KnowledgeBase | None = None
+
+def _init_worker(symptom_df: pd.DataFrame, subsymptom_df: pd.DataFrame | None):
+    global _knowledge_base
+    _knowledge_base = KnowledgeBase(symptom_df, subsymptom_df)
+
+def _run_task(task: tuple[int, dict | None, bool]) -> dict:
+    seed, script, stop_early = task
+    if script is None:
+        patient = VirtualPatient.sample(_knowledge_base, seed)
+    else:
+        patient = VirtualPatient.from_script(script, seed)
+
+    return run_session(_knowledge_base, patient, stop_early)
+
+def simulate(
+    symptom_df: pd.DataFrame,
+    subsymptom_df: pd.DataFrame | None,
+    sessions: int = 1000,
+    seed: int = 0,
+    workers: int = 1,
+    scripts: list[dict] | None = None,
+    stop_early: bool = False
+) -> dict:
+    # Session i always uses seed + i, so results don't depend on the number
+    # of workers.
+    if scripts is not None:
+        tasks = [(seed + i, script, stop_early) for i, script in enumerate(scripts)]
+    else:
+        tasks = [(seed + i, None, stop_early) for i in range(sessions)]
+
+    start = time.perf_counter()
+    if workers > 1:
+        with multiprocessing.get_context("spawn").Pool(workers, _init_worker, (symptom_df, subsymptom_df)) as pool:
+            results = pool.map(_run_task, tasks, chunksize=max(1, len(tasks) // (workers * 8)))
+    else:
+        _init_worker(symptom_df, subsymptom_df)
+        results = [_run_task(x) for x in tasks]
+
+    elapsed = time.perf_counter() - start
+
+    question_counts = Counter(len(x["asked"]) for x in results)
+    labelled = [x for x in results if x["disease"] is not None]
+    transcript = hashlib.sha1(json.dumps([[x["asked"], x["predictions"]] for x in results]).encode()).hexdigest()
+    return {
+        "sessions": len(results),
+        "workers": workers,
+        "seed": seed,
+        "seconds": elapsed,
+        "sessions_per_second": len(results) / elapsed if elapsed > 0 else None,
+        "accuracy": {
+            f"@{k}": sum(1 for x in labelled if x["rank"] is not None and x["rank"] <= k) / len(labelled) if len(labelled) > 0 else None
+            for k in (1, 3, 5)
+        },
+        "questions": {
+            "mean": statistics.fmean(len(x["asked"]) for x in results) if len(results) > 0 else None,
+            "distribution": {str(k): question_counts[k] for k in sorted(question_counts)},
+        },
+        # Identical across commits iff every session asked the same questions
+        # and ended with the same top predictions.
+        "transcript_digest": transcript,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Run simulated patients through the diagnosis engine.")
+    parser.add_argument("--data", help="Excel file with SymptomTable and SubsymptomTable sheets; synthetic if omitted.")
+    parser.add_argument("--scripts", help="JSON lines file of recorded answer scripts to replay.")
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stop-early", action="store_true", help="Also stop on should_stop, like the CLI.")
+    parser.add_argument("--diseases", type=int, default=100)
+    parser.add_argument("--symptoms", type=int, default=200)
+    parser.add_argument("--variant-rate", type=float, default=0.2)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--sparsity", type=float, default=0.9)
+    parser.add_argument("--output", help="Write the JSON results here instead of stdout.")
+    args = parser.parse_args()
+
+    if args.data:
+        symptom_df = pd.read_excel(args.data, "SymptomTable")
+        subsymptom_df = pd.read_excel(args.data, "SubsymptomTable")
+    else:
+        symptom_df, subsymptom_df = generate_knowledge_base(args.diseases, args.symptoms, args.variant_rate, args.depth, args.sparsity, args.seed)
+
+    scripts = None
+    if args.scripts:
+        with open(args.scripts) as f:
+            scripts = [json.loads(line) for line in f if line.strip()]
+
+    result = simulate(symptom_df, subsymptom_df, args.sessions, args.seed, args.workers, scripts, args.stop_early)
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import random
+
+import pandas as pd
+
+FREQUENCIES = ["Jarang", "Kadang", "Sering", "Sangat sering", None]
+
+def generate_knowledge_base(
+    n_diseases: int = 100,
+    n_symptoms: int = 200,
+    variant_rate: float = 0.2,
+    hierarchy_depth: int = 2,
+    sparsity: float = 0.9,
+    seed: int = 0
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    # Returns (symptom_df, subsymptom_df) in the same schemas as data.xlsx:
+    # Penyakit/Gejala/Variasi/Frekuensi and Gejala/Variasi/AnakGejala.
+    # variant_rate is the share of symptoms that have variants, sparsity the
+    # share of (disease, symptom) pairs that are not linked, and
+    # hierarchy_depth the number of symptom levels (1 means no subsymptoms).
+    r = random.Random(seed)
+
+    symptoms = [f"Gejala {i + 1}" for i in range(n_symptoms)]
+    variants = {}
+    for symptom in symptoms:
+        if r.random() < variant_rate:
+            variants[symptom] = [f"{symptom} varian {j + 1}" for j in range(r.randint(2, 4))]
+        else:
+            variants[symptom] = []
+
+    symptom_rows = {
+        "Penyakit": [],
+        "Gejala": [],
+        "Variasi": [],
+        "Frekuensi": []
+    }
+    for i in range(n_diseases):
+        disease = f"Penyakit {i + 1}"
+        linked = [symptom for symptom in symptoms if r.random() >= sparsity]
+        if len(linked) == 0:
+            linked = [r.choice(symptoms)]
+
+        for symptom in linked:
+            symptom_rows["Penyakit"].append(disease)
+            symptom_rows["Gejala"].append(symptom)
+            symptom_rows["Variasi"].append(r.choice(variants[symptom]) if len(variants[symptom]) > 0 and r.random() < 0.8 else None)
+            symptom_rows["Frekuensi"].append(r.choice(FREQUENCIES))
+
+    subsymptom_rows = {
+        "Gejala": [],
+        "Variasi": [],
+        "AnakGejala": []
+    }
+    if hierarchy_depth > 1 and n_symptoms > 1:
+        shuffled = list(symptoms)
+        r.shuffle(shuffled)
+
+        # Roughly half of the symptoms stay at the top level; the rest are
+        # spread evenly over the deeper levels.
+        n_top = max(1, n_symptoms // 2)
+        levels = [shuffled[:n_top]]
+        rest = shuffled[n_top:]
+        n_per_level = max(1, len(rest) // (hierarchy_depth - 1))
+        for level in range(1, hierarchy_depth):
+            current = rest[:n_per_level] if level < hierarchy_depth - 1 else rest
+            rest = rest[len(current):]
+            for child in current:
+                parent = r.choice(levels[-1])
+                subsymptom_rows["Gejala"].append(parent)
+                subsymptom_rows["Variasi"].append(r.choice(variants[parent]) if len(variants[parent]) > 0 and r.random() < 0.5 else None)
+                subsymptom_rows["AnakGejala"].append(child)
+
+            if len(current) == 0:
+                break
+
+            levels.append(current)
+
+    return pd.DataFrame(symptom_rows), pd.DataFrame(subsymptom_rows)
@@ -1,5 +1,14 @@
+import copy
+import hashlib
 import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+import numpy as np
 import pandas as pd
+
+import instrumentation
     
 FREQUENCY_PROB_MAP = {
     "jarang":        0.10,
@@ -48,22 +57,595 @@ def disease_entropy(disease_probs: list[float]):
 
     return result
 
-class UnnamedState:
-    def __init__(self, symptom_df: pd.DataFrame, subsymptom_df: pd.DataFrame | None = None):
+def log_sum_exp(values: np.ndarray) -> float:
+    if len(values) == 0:
+        return -np.inf
+
+    max_value = values.max()
+    if max_value == -np.inf:
+        return -np.inf
+
+    return float(max_value + np.log(np.exp(values - max_value).sum()))
+
+def expected_entropies(disease_probs: np.ndarray, likelihoods: np.ndarray, no_disease_likelihoods: np.ndarray, possibility_mask: np.ndarray):
+    # Batched version of symptom_prob, new_disease_probs and disease_entropy over
+    # every (symptom, possibility) pair at once. likelihoods has shape
+    # (symptom, possibility, disease) with -1.0 marking unlinked diseases.
+    # Returns the expected posterior entropy of each symptom and the posterior
+    # entropy of each possibility.
+    linked = likelihoods != -1.0
+    no_disease_prob = 1.0 - disease_probs.sum()
+
+    weighted = np.where(linked, disease_probs * likelihoods, 0.0)
+    denominators = 1.0 - np.where(linked, 0.0, disease_probs).sum(axis=-1)
+    if np.any(denominators[possibility_mask] <= 0.0):
+        raise ValueError("You can't find the symptom prob if there is no disease related to this!!!!")
+
+    default_probs = (no_disease_prob * no_disease_likelihoods + weighted.sum(axis=-1)) / np.where(possibility_mask, denominators, 1.0)
+
+    next_probs = np.where(linked, weighted, disease_probs * default_probs[..., None])
+    normalizers = next_probs.sum(axis=-1) + no_disease_prob * no_disease_likelihoods
+    if np.any(normalizers[possibility_mask] == 0):
+        raise ValueError("Impossible")
+
+    next_probs /= np.where(possibility_mask, normalizers, 1.0)[..., None]
+    next_no_disease_probs = 1.0 - next_probs.sum(axis=-1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        entropies = -np.where(next_probs > 0.0, next_probs * np.log(next_probs), 0.0).sum(axis=-1)
+        entropies -= np.where(next_no_disease_probs > 0.0, next_no_disease_probs * np.log(next_no_disease_probs), 0.0)
+
+    possibility_probs = np.where(possibility_mask, default_probs, 0.0)
+    possibility_probs /= possibility_probs.sum(axis=-1, keepdims=True)
+
+    scores = (possibility_probs * np.where(possibility_mask, entropies, 0.0)).sum(axis=-1)
+    return scores, entropies
+
+def argmax_first(scores: dict[str, float], rel_tol: float = 1e-9, abs_tol: float = 1e-12) -> str:
+    # Key of the highest score. Scores within the tolerance of each other are
+    # ties, which go to the first key in iteration order, so the choice
+    # doesn't depend on how the sums that produced them were rounded.
+    best_key = None
+    best_score = -math.inf
+    for key, score in scores.items():
+        if best_key is None or (score > best_score and not math.isclose(score, best_score, rel_tol=rel_tol, abs_tol=abs_tol)):
+            best_key = key
+            best_score = score
+
+    return best_key
+
+class SymptomHierarchy:
+    def __init__(self, subsymptom_df: pd.DataFrame):
+        # A subsymptom only has one parent; like the original lookup, the first
+        # row wins if there are duplicates.
+        self.parents: dict[str, str] = {}
+        for parent, child in zip(subsymptom_df["Gejala"], subsymptom_df["AnakGejala"]):
+            self.parents.setdefault(child, parent)
+
+        self.children: dict[str, list[str]] = {}
+        for child, parent in self.parents.items():
+            self.children.setdefault(parent, []).append(child)
+
+        self.depths: dict[str, int] = {}
+        for node in list(self.parents) + list(self.children):
+            ancestors = self.ancestors(node)
+            if ancestors is not None:
+                self.depths[node] = len(ancestors)
+
+    def ancestors(self, symptom: str) -> list[str] | None:
+        # Nearest first. None if the parent chain loops.
+        result = []
+        visited = {symptom}
+        parent = self.parents.get(symptom)
+        while parent is not None:
+            if parent in visited:
+                return None
+
+            visited.add(parent)
+            result.append(parent)
+            parent = self.parents.get(parent)
+
+        return result
+
+    def descendants(self, symptom: str) -> list[str]:
+        result = []
+        visited = {symptom}
+        stack = list(reversed(self.children.get(symptom, [])))
+        while len(stack) > 0:
+            child = stack.pop()
+            if child in visited:
+                continue
+
+            visited.add(child)
+            result.append(child)
+            stack.extend(reversed(self.children.get(child, [])))
+
+        return result
+
+    def can_add(self, parent: str, child: str) -> bool:
+        # Whether child can be put under parent (replacing its current parent,
+        # if any) without closing a loop in the parent chain.
+        if child == parent:
+            return False
+
+        ancestors = self.ancestors(parent)
+        return ancestors is not None and child not in ancestors
+
+    def askable_symptoms(self, symptom_names) -> dict[str | None, dict[int, str]]:
+        # For each possible top of the context stack (None for an empty stack),
+        # maps the id of every symptom that can be asked under it to the symptom
+        # that is actually asked: the child of the context on the way up.
+        result: dict[str | None, dict[int, str]] = {None: {}}
+        for i, symptom in enumerate(symptom_names):
+            current = symptom
+            visited = {current}
+            while True:
+                parent = self.parents.get(current)
+                if parent is None:
+                    result[None][i] = current
+                    break
+
+                result.setdefault(parent, {})[i] = current
+                if parent in visited:
+                    break
+
+                visited.add(parent)
+                current = parent
+
+        return result
+
+def knowledge_base_version(symptom_df: pd.DataFrame, subsymptom_df: pd.DataFrame | None = None) -> str:
+    digest = hashlib.sha1()
+    for df in (symptom_df, subsymptom_df):
+        if df is None:
+            digest.update(b"-")
+            continue
+
+        digest.update(",".join(df.columns).encode())
+        digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+
+    return digest.hexdigest()
+
+class KnowledgeBase:
+    # Compiled, read-only view of the symptom tables. It is safe to share one
+    # instance between any number of UnnamedState objects and threads; the
+    # per-session state lives in UnnamedState.
+    def __init__(self, symptom_df: pd.DataFrame, subsymptom_df: pd.DataFrame | None = None, opening_book_depth: int = 0):
         self.symptom_df = symptom_df
         self.subsymptom_df = subsymptom_df
+        self.hierarchy = SymptomHierarchy(subsymptom_df) if subsymptom_df is not None else None
+        self.version = knowledge_base_version(symptom_df, subsymptom_df)
+
+        # Set by kb_snapshot.load_snapshot, so worker processes can map the
+        # same snapshot instead of receiving a pickled copy.
+        self.snapshot_path: str | None = None
+
+        # Interns diseases, symptoms and variants to integer ids once, so that
+        # every later query is an array lookup instead of a DataFrame filter.
+        self.disease_names = self.symptom_df["Penyakit"].unique()
+        self.disease_index = {d: i for i, d in enumerate(self.disease_names)}
+        self.symptom_names = self.symptom_df["Gejala"].unique()
+        self.symptom_index = {s: i for i, s in enumerate(self.symptom_names)}
+
+        n_symptoms = len(self.symptom_names)
+        n_diseases = len(self.disease_names)
+
+        # Per (symptom, disease) link: frequency probability and variant id
+        # (-1 if the link is variant-free). Only the first row of a pair counts.
+        self.link_probs = np.zeros((n_symptoms, n_diseases))
+        self.link_variants = np.full((n_symptoms, n_diseases), -1)
+        self.unlinked = np.ones((n_symptoms, n_diseases), dtype=bool)
+        self.variant_index: list[dict[str, int]] = [{} for _ in range(n_symptoms)]
+        self.possibilities: list[list[tuple[bool, str | None, float]]] = [[] for _ in range(n_symptoms)]
+        self._compile_links(range(n_symptoms), self.symptom_df)
+
+        # likelihoods[s, p, d] is P(answer p to symptom s | disease d), or -1.0
+        # if the disease is not linked to the symptom (or p is padding).
+        n_possibilities = max((len(x) for x in self.possibilities), default=0)
+        self.likelihoods = np.full((n_symptoms, n_possibilities, n_diseases), -1.0)
+        self.no_disease_likelihoods = np.zeros((n_symptoms, n_possibilities))
+        self.possibility_mask = np.zeros((n_symptoms, n_possibilities), dtype=bool)
+        for s in range(n_symptoms):
+            self._compile_likelihoods(s)
+
+        if self.hierarchy is not None:
+            self.askable = self.hierarchy.askable_symptoms(self.symptom_names)
+        else:
+            self.askable = {None: {i: s for i, s in enumerate(self.symptom_names)}}
+
+        for array in (self.link_probs, self.link_variants, self.unlinked, self.likelihoods, self.no_disease_likelihoods, self.possibility_mask):
+            array.flags.writeable = False
+
+        self.opening_book_depth = opening_book_depth
+        self.opening_book: dict[tuple[tuple, tuple[str, ...]], str | None] = {}
+        if opening_book_depth > 0:
+            self.build_opening_book(opening_book_depth)
+
+    def _compile_links(self, symptom_ids, symptom_df: pd.DataFrame):
+        # (Re)compiles the links, variants and possibilities of the given
+        # symptoms from their rows in symptom_df, in row order.
+        symptom_ids = set(symptom_ids)
+        has_non_variant = {s: False for s in symptom_ids}
+        all_na = {s: True for s in symptom_ids}
+        for s in symptom_ids:
+            self.link_probs[s] = 0.0
+            self.link_variants[s] = -1
+            self.unlinked[s] = True
+            self.variant_index[s] = {}
+
+        for disease, symptom, variant, frequency in zip(
+            symptom_df["Penyakit"],
+            symptom_df["Gejala"],
+            symptom_df["Variasi"],
+            symptom_df["Frekuensi"]
+        ):
+            s = self.symptom_index[symptom]
+            if s not in symptom_ids:
+                continue
+
+            if isinstance(variant, str):
+                variant_id = self.variant_index[s].setdefault(variant, len(self.variant_index[s]))
+            else:
+                variant_id = -1
+                has_non_variant[s] = True
+
+            if not pd.isna(variant):
+                all_na[s] = False
+
+            d = self.disease_index[disease]
+            if not self.unlinked[s, d]:
+                continue
+
+            if not isinstance(frequency, str):
+                frequency = "Sering"
+
+            self.unlinked[s, d] = False
+            self.link_probs[s, d] = FREQUENCY_PROB_MAP[frequency.lower()]
+            self.link_variants[s, d] = variant_id
+
+        for s in symptom_ids:
+            if all_na[s]:
+                possibilities = [(True, None, 0.0), (False, None, 1.0)]
+            else:
+                possibilities = [(True, v, 0.0) for v in self.variant_index[s]]
+                if has_non_variant[s]:
+                    possibilities.append((False, None, 1.0))
+
+            self.possibilities[s] = possibilities
+
+    def _compile_likelihoods(self, symptom_id: int):
+        self.likelihoods[symptom_id] = -1.0
+        self.no_disease_likelihoods[symptom_id] = 0.0
+        self.possibility_mask[symptom_id] = False
+        for p, (exists, variant, prob_for_no_disease) in enumerate(self.possibilities[symptom_id]):
+            self.likelihoods[symptom_id, p] = self._compute_likelihood_row(symptom_id, exists, variant)
+            self.no_disease_likelihoods[symptom_id, p] = prob_for_no_disease
+            self.possibility_mask[symptom_id, p] = True
+
+    def updated(self, symptom_df: pd.DataFrame, subsymptom_df: pd.DataFrame | None, changed_symptoms: set[str]) -> "KnowledgeBase":
+        # A new knowledge base for the given tables, which differ from this
+        # one's only in the rows of changed_symptoms (and possibly the
+        # hierarchy). Only those symptoms are recompiled, unless the set or
+        # order of diseases or symptoms changed, in which case it is rebuilt.
+        # This knowledge base is left as it is for the sessions using it.
+        version = knowledge_base_version(symptom_df, subsymptom_df)
+        if version == self.version:
+            return self
+
+        disease_names = symptom_df["Penyakit"].unique()
+        symptom_names = symptom_df["Gejala"].unique()
+        if not (np.array_equal(disease_names, self.disease_names) and np.array_equal(symptom_names, self.symptom_names)):
+            return KnowledgeBase(symptom_df, subsymptom_df, self.opening_book_depth)
+
+        result = copy.copy(self)
+        result.symptom_df = symptom_df
+        result.subsymptom_df = subsymptom_df
+        result.version = version
+        result.snapshot_path = None
+        result.link_probs = self.link_probs.copy()
+        result.link_variants = self.link_variants.copy()
+        result.unlinked = self.unlinked.copy()
+        result.variant_index = list(self.variant_index)
+        result.possibilities = list(self.possibilities)
+
+        symptom_ids = sorted(self.symptom_index[x] for x in changed_symptoms if x in self.symptom_index)
+        result._compile_links(symptom_ids, symptom_df[symptom_df["Gejala"].isin(changed_symptoms)])
+
+        n_possibilities = max((len(x) for x in result.possibilities), default=0)
+        if n_possibilities != self.likelihoods.shape[1]:
+            return KnowledgeBase(symptom_df, subsymptom_df, self.opening_book_depth)
+
+        result.likelihoods = self.likelihoods.copy()
+        result.no_disease_likelihoods = self.no_disease_likelihoods.copy()
+        result.possibility_mask = self.possibility_mask.copy()
+        for s in symptom_ids:
+            result._compile_likelihoods(s)
+
+        hierarchy_changed = (subsymptom_df is None) != (self.subsymptom_df is None) or (
+            subsymptom_df is not None and not subsymptom_df.equals(self.subsymptom_df)
+        )
+        if hierarchy_changed:
+            result.hierarchy = SymptomHierarchy(subsymptom_df) if subsymptom_df is not None else None
+            if result.hierarchy is not None:
+                result.askable = result.hierarchy.askable_symptoms(result.symptom_names)
+            else:
+                result.askable = {None: {i: s for i, s in enumerate(result.symptom_names)}}
+
+        for array in (result.link_probs, result.link_variants, result.unlinked, result.likelihoods, result.no_disease_likelihoods, result.possibility_mask):
+            array.flags.writeable = False
+
+        result.opening_book = {}
+        if result.opening_book_depth > 0:
+            result.build_opening_book(result.opening_book_depth)
+
+        return result
+
+    def build_opening_book(self, depth: int):
+        # Every fresh session starts from the same prior, so the questions for
+        # the first few answers can be worked out once. Entries are keyed by the
+        # ordered answer history and the context stack.
+        book = {}
+        pending = [(UnnamedState(self), depth)]
+        while len(pending) > 0:
+            state, remaining = pending.pop()
+            best_symptom = state.get_best_symptom_to_ask()
+            history_key = state.get_history_key()
+            answered = frozenset(state.answer_history)
+            for (entry_answered, contexts), result in state._best_symptoms.items():
+                # Entries copied from the parent state were worked out for a
+                # different answered set.
+                if entry_answered == answered:
+                    book[(history_key, contexts)] = result
+
+            if best_symptom is None or remaining <= 0:
+                continue
+
+            for exists, variant, _ in state.get_possibilities(best_symptom):
+                next_state = state.copy()
+                next_state.answer(best_symptom, exists, variant)
+                pending.append((next_state, remaining - 1))
+
+            next_state = state.copy()
+            next_state.skip(best_symptom)
+            pending.append((next_state, remaining - 1))
+
+        self.opening_book = book
+
+    def _compute_likelihood_row(self, symptom_id: int, exists: bool, variant: str | None):
+        probs = self.link_probs[symptom_id]
+        if exists:
+            variant_id = self.variant_index[symptom_id].get(variant, -2) if variant is not None else -2
+            link_variants = self.link_variants[symptom_id]
+            row = np.where((link_variants == -1) | (link_variants == variant_id), probs, 1 - probs)
+        else:
+            row = 1 - probs
+
+        row[self.unlinked[symptom_id]] = -1.0
+        return row
+
+    def likelihood_row(self, symptom_id: int, exists: bool, variant: str | None):
+        for p, (p_exists, p_variant, _) in enumerate(self.possibilities[symptom_id]):
+            if p_exists == exists and p_variant == variant:
+                return self.likelihoods[symptom_id, p]
+
+        return self._compute_likelihood_row(symptom_id, exists, variant)
+
+    def get_possibilities(self, symptom_name: str) -> list[tuple[bool, str | None, float]]:
+        s = self.symptom_index.get(symptom_name)
+        if s is None:
+            return [(True, None, 0.0), (False, None, 1.0)]
+
+        return list(self.possibilities[s])
+
+    def get_conditional_symptom_probs_with_variant(self, symptom_name: str, exists: bool = True, variant: str | None = None):
+        s = self.symptom_index.get(symptom_name)
+        if s is None:
+            return None
+
+        row = self.likelihood_row(s, exists, variant)
+        if self.unlinked[s].all():
+            return None
+        else:
+            return row.tolist()
+
+def score_symptoms(knowledge_base: KnowledgeBase, disease_probs: np.ndarray, symptom_ids: list[int], active: np.ndarray | None = None):
+    # expected_entropies for the given symptoms of a knowledge base. If active
+    # is given, disease_probs only covers those diseases.
+    if active is None:
+        likelihoods = knowledge_base.likelihoods[symptom_ids]
+    else:
+        likelihoods = knowledge_base.likelihoods[np.ix_(symptom_ids, np.arange(knowledge_base.likelihoods.shape[1]), active)]
+
+    return expected_entropies(
+        disease_probs,
+        likelihoods,
+        knowledge_base.no_disease_likelihoods[symptom_ids],
+        knowledge_base.possibility_mask[symptom_ids]
+    )
+
+class TranspositionTable:
+    # Process-wide LRU of question selections, shared by every session. Keys
+    # are digests of (KB version, options, answer history, context stack), so
+    # the same answer path on the same knowledge base is scored only once.
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[str | None, list[tuple[bool, str | None, float]]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(version: str, options: tuple, history_key: tuple, contexts: tuple[str, ...]) -> str:
+        return hashlib.blake2b(repr((version, options, history_key, contexts)).encode(), digest_size=16).hexdigest()
+
+    def get(self, key: str) -> tuple[str | None, list[tuple[bool, str | None, float]]] | None:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+
+            return value
+
+    def put(self, key: str, best_symptom: str | None, possibilities: list[tuple[bool, str | None, float]]):
+        with self._lock:
+            self._entries[key] = (best_symptom, possibilities)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0
+            }
+
+transposition_table = TranspositionTable()
+
+class ScoringCancelled(Exception):
+    # Raised out of question selection when the state's should_cancel returns
+    # True. The state may be left half updated, so callers should work on a
+    # copy.
+    pass
+
+class _PlanningTimeout(Exception):
+    pass
+
+class _PlanningClock:
+    # Deadline of a plan_best_symptom_to_ask call. Each answer or scoring step
+    # runs through run(), which refuses to start a step when the time left is
+    # less than the slowest step seen so far.
+    def __init__(self, time_budget: float, should_cancel: Callable[[], bool] | None = None):
+        self.deadline = time.perf_counter() + time_budget
+        self.step_cost = 0.0
+        self.should_cancel = should_cancel
+
+    def run(self, step, *args):
+        if self.should_cancel is not None and self.should_cancel():
+            raise ScoringCancelled()
+
+        start = time.perf_counter()
+        if start + self.step_cost > self.deadline:
+            raise _PlanningTimeout()
+
+        result = step(*args)
+        self.step_cost = max(self.step_cost, time.perf_counter() - start)
+        return result
 
-        self.disease_names = symptom_df["Penyakit"].unique()
+class UnnamedState:
+    def __init__(
+        self,
+        symptom_df: pd.DataFrame | KnowledgeBase,
+        subsymptom_df: pd.DataFrame | None = None,
+        log_space: bool = False,
+        prune_below: float = 0.0,
+        top_k: int | None = None,
+        transposition_table: TranspositionTable | None = transposition_table,
+        scoring_pool=None,
+        should_cancel: Callable[[], bool] | None = None
+    ):
+        if isinstance(symptom_df, KnowledgeBase):
+            self.knowledge_base = symptom_df
+        else:
+            self.knowledge_base = KnowledgeBase(symptom_df, subsymptom_df)
+
+        self.disease_names = self.knowledge_base.disease_names
         initial_single_prob = 1 / (len(self.disease_names) + 1)
         self.disease_probs = [initial_single_prob for _ in self.disease_names]
 
+        # In log space the posterior is kept as log probabilities (and
+        # disease_probs is derived from them), so long answer sequences over
+        # large catalogs don't underflow.
+        self.log_space = log_space
+        if log_space:
+            self.log_disease_probs = np.full(len(self.disease_names), math.log(initial_single_prob))
+            self.log_no_disease_prob = math.log(initial_single_prob)
+
+        # Diseases below prune_below, or outside the top_k, are left out of
+        # question scoring. They are still updated and reported.
+        self.prune_below = prune_below
+        self.top_k = top_k
+
+        self.transposition_table = transposition_table
+
+        # Optional scoring_pool.ScoringPool to score candidates out of process.
+        self.scoring_pool = scoring_pool
+
+        # Polled during question selection; once it returns True, scoring and
+        # planning stop with ScoringCancelled.
+        self.should_cancel = should_cancel
+
         self.answer_history = {}
 
         self.contexts: list[str] = []
 
+        # Copy-on-write overrides of knowledge_base.askable for the contexts
+        # touched by this session's answers.
+        self._askable: dict[str | None, dict[int, str]] = {}
+
+        # Scores only depend on the posterior, so they survive skips and context
+        # pops. Best symptoms additionally depend on what is askable.
+        self._scored_posterior: tuple[float, ...] | None = None
+        self._symptom_scores: dict[int, tuple[float, bool]] = {}
+        self._best_symptoms: dict[tuple[frozenset[str], tuple[str, ...]], str | None] = {}
+
+    def copy(self) -> "UnnamedState":
+        # Shares the knowledge base, copies everything the session changes.
+        result = copy.copy(self)
+        result.disease_probs = list(self.disease_probs)
+        result.answer_history = dict(self.answer_history)
+        result.contexts = list(self.contexts)
+        result._askable = {k: dict(v) for k, v in self._askable.items()}
+        result._symptom_scores = dict(self._symptom_scores)
+        result._best_symptoms = dict(self._best_symptoms)
+        return result
+
+    def get_history_key(self) -> tuple:
+        return tuple(
+            (symptom, x.get("exists"), x.get("variant"), x.get("skip", False))
+            for symptom, x in self.answer_history.items()
+        )
+
+    def get_no_disease_prob(self) -> float:
+        if self.log_space:
+            return math.exp(self.log_no_disease_prob)
+        else:
+            return 1.0 - sum(self.disease_probs)
+
+    def get_active_diseases(self) -> np.ndarray | None:
+        # Indices of the diseases that take part in scoring, or None if no
+        # pruning is configured.
+        if self.prune_below <= 0.0 and self.top_k is None:
+            return None
+
+        probs = np.asarray(self.disease_probs)
+        keep = probs >= self.prune_below
+        if self.top_k is not None and self.top_k < len(probs):
+            top = np.zeros(len(probs), dtype=bool)
+            top[np.argsort(-probs, kind="stable")[:self.top_k]] = True
+            keep &= top
+
+        if len(probs) > 0:
+            keep[np.argmax(probs)] = True
+
+        return np.flatnonzero(keep)
+
     def print_diseases(self):
         sorted_disease_and_prob = sorted([(d_name, prob) for d_name, prob in zip(self.disease_names, self.disease_probs) if prob > 0.0], key=lambda x: (-x[1], x[0].lower()))
-        no_disease_prob = 1.0 - sum(self.disease_probs)
+        no_disease_prob = self.get_no_disease_prob()
         if len(sorted_disease_and_prob) > 0:
             for d_name, prob in sorted_disease_and_prob:
                 print(f"{d_name}: {prob:.6f}")
@@ -74,7 +656,7 @@ class UnnamedState:
     def get_predictions(self):
         sorted_disease_and_prob = sorted([(d_name, prob) for d_name, prob in zip(self.disease_names, self.disease_probs) if prob > 0.0], key=lambda x: (-x[1], x[0].lower()))
         entropy = disease_entropy(self.disease_probs)
-        no_disease_prob = 1.0 - sum(self.disease_probs)
+        no_disease_prob = self.get_no_disease_prob()
         return {
             "diseases": [
                 {
@@ -92,131 +674,293 @@ class UnnamedState:
     def should_stop(self):
         return max(self.disease_probs) >= 0.8 or sum(self.disease_probs) <= 0.1
     
+    def _sync_score_cache(self):
+        posterior = tuple(self.disease_probs)
+        if posterior != self._scored_posterior:
+            self._scored_posterior = posterior
+            self._symptom_scores = {}
+            self._best_symptoms = {}
+
     def get_best_symptom_to_ask(self):
-        symptoms = self.symptom_df["Gejala"].unique()
-        results: dict[str, float] = {}
+        self._sync_score_cache()
 
-        current_entropy = disease_entropy(self.disease_probs)
+        key = (frozenset(self.answer_history), tuple(self.contexts))
+        if key in self._best_symptoms:
+            instrumentation.count("memo_hits")
+            return self._best_symptoms[key]
 
-        for s in symptoms:
-            vs = self.get_valid_symptom_to_ask(s)
-            if vs is None:
-                continue
+        # The opening book was built with the default options.
+        if not self.log_space and self.get_active_diseases() is None:
+            book_key = (self.get_history_key(), key[1])
+            if book_key in self.knowledge_base.opening_book:
+                instrumentation.count("opening_book_hits")
+                self._best_symptoms[key] = self.knowledge_base.opening_book[book_key]
+                return self._best_symptoms[key]
 
-            possibilities = self.get_possibilities(s)
+        table_key = None
+        if self.transposition_table is not None:
+            table_key = TranspositionTable.make_key(
+                self.knowledge_base.version,
+                (self.log_space, self.prune_below, self.top_k),
+                self.get_history_key(),
+                key[1]
+            )
+            entry = self.transposition_table.get(table_key)
+            if entry is not None:
+                instrumentation.count("transposition_hits")
+                self._best_symptoms[key] = entry[0]
+                return entry[0]
 
-            score = 0.0
-            possibility_probs: list[float] = []
-            entropies: list[float] = []
-            for exists, variant, prob_for_no_disease in possibilities:
-                conditional_symptom_probs = self.get_conditional_symptom_probs_with_variant(s, exists, variant)
-                if conditional_symptom_probs is None:
-                    continue
+            instrumentation.count("transposition_misses")
+
+        with instrumentation.span("select_question", answered=len(self.answer_history)):
+            results = self.get_candidate_scores()
+        if len(results) == 0:
+            best_symptom = None
+        else:
+            best_symptom = argmax_first(results)
 
-                possibility_probs.append(symptom_prob(self.disease_probs, conditional_symptom_probs, prob_for_no_disease))
+        self._best_symptoms[key] = best_symptom
+        if table_key is not None:
+            possibilities = self.get_possibilities(best_symptom) if best_symptom is not None else []
+            self.transposition_table.put(table_key, best_symptom, possibilities)
 
-                next_disease_prob = new_disease_probs(self.disease_probs, conditional_symptom_probs, prob_for_no_disease)
-                entropy = disease_entropy(next_disease_prob)
-                entropies.append(entropy)
+        return best_symptom
 
-            if all(x == current_entropy for x in entropies):
-                continue  # Why you need to ask something that doesn't have any information?
+    def get_candidate_scores(self) -> dict[str, float]:
+        # Score (negative expected posterior entropy) of every symptom that can
+        # be asked now, in asking order.
+        self._sync_score_cache()
 
-            # input("(ENTER)")
-            
-            sum_possibility_probs = sum(possibility_probs)
-            possibility_probs = [x / sum_possibility_probs for x in possibility_probs]
+        askable = self.get_askable_symptoms()
+        symptom_ids = list(askable.keys())
+        valid_symptoms = list(askable.values())
 
-            score = -sum(x * y for x, y in zip(possibility_probs, entropies))
+        self._score_symptoms([i for i in symptom_ids if i not in self._symptom_scores])
+
+        results: dict[str, float] = {}
+        for i, vs in zip(symptom_ids, valid_symptoms):
+            score, uninformative = self._symptom_scores[i]
+            if uninformative:
+                continue
 
             if vs in results:
                 results[vs] = max(score, results[vs])
             else:
                 results[vs] = score
 
-        if len(results) == 0:
-            return None
+        return results
+
+    def plan_best_symptom_to_ask(self, depth: int = 2, time_budget: float = 0.25, beam_width: int = 4) -> str | None:
+        # Expectimax over the answers to the next `depth` questions, minimizing
+        # the expected entropy at the end. Only the beam_width best questions by
+        # one-step score are expanded at each level. Deepens one level at a time
+        # and returns the choice of the deepest level finished within
+        # time_budget seconds (the greedy choice if none is). The greedy choice
+        # is always worked out, so the budget can't be shorter than one
+        # scoring pass.
+        clock = _PlanningClock(time_budget, self.should_cancel)
+        best_symptom = self.get_best_symptom_to_ask()
+        clock.step_cost = time.perf_counter() - (clock.deadline - time_budget)
+        if best_symptom is None or depth <= 1:
+            return best_symptom
+
+        try:
+            candidates = clock.run(self._get_top_candidates, beam_width)
+            for current_depth in range(2, depth + 1):
+                best_value = math.inf
+                level_best_symptom = best_symptom
+                for symptom in candidates:
+                    value = self._expected_entropy_after(symptom, current_depth, best_value, clock, beam_width)
+                    if value < best_value:
+                        best_value = value
+                        level_best_symptom = symptom
+
+                best_symptom = level_best_symptom
+
+        except _PlanningTimeout:
+            pass
+
+        return best_symptom
+
+    def _get_top_candidates(self, beam_width: int) -> list[str]:
+        scores = self.get_candidate_scores()
+        return sorted(scores, key=lambda x: -scores[x])[:beam_width]
+
+    def _expected_entropy(self, depth: int, bound: float, clock: _PlanningClock, beam_width: int) -> float:
+        # Lowest expected entropy reachable in `depth` more questions, or bound
+        # if it can't beat bound.
+        entropy = disease_entropy(self.disease_probs)
+        if depth <= 0 or self.is_certain() or self.should_stop():
+            return min(entropy, bound)
+
+        candidates = clock.run(self._get_top_candidates, beam_width)
+        if len(candidates) == 0:
+            return min(entropy, bound)
+
+        for symptom in candidates:
+            bound = min(bound, self._expected_entropy_after(symptom, depth, bound, clock, beam_width))
+
+        return bound
+
+    def _expected_entropy_after(self, symptom: str, depth: int, bound: float, clock: _PlanningClock, beam_width: int) -> float:
+        if time.perf_counter() > clock.deadline:
+            raise _PlanningTimeout()
+
+        possibilities = self.get_possibilities(symptom)
+        weights = []
+        for exists, variant, prob_for_no_disease in possibilities:
+            conditional_symptom_probs = self.get_conditional_symptom_probs_with_variant(symptom, exists, variant)
+            if conditional_symptom_probs is None:
+                weights.append(0.0)
+            else:
+                weights.append(symptom_prob(self.disease_probs, conditional_symptom_probs, prob_for_no_disease))
+
+        total_weight = sum(weights)
+        if total_weight <= 0.0:
+            # Not linked to any disease; the answers only open up subsymptoms.
+            weights = [1.0 for _ in possibilities]
+            total_weight = len(possibilities)
+
+        # Entropies are never negative, so once the partial sum reaches the
+        # bound the remaining answers can't bring it back under.
+        value = 0.0
+        for (exists, variant, _), weight in zip(possibilities, weights):
+            if weight <= 0.0:
+                continue
+
+            weight /= total_weight
+            next_state = self.copy()
+            # Answering scores the candidates again when it pops contexts.
+            clock.run(next_state.answer, symptom, exists, variant)
+            value += weight * next_state._expected_entropy(depth - 1, (bound - value) / weight, clock, beam_width)
+            if value >= bound:
+                return bound
+
+        return value
+
+    def _score_symptoms(self, symptom_ids: list[int]):
+        kb = self.knowledge_base
+        probs = np.asarray(self.disease_probs)
+        active = self.get_active_diseases()
+        if active is not None:
+            # Score as if the pruned diseases were ruled out. A symptom that no
+            # remaining disease is linked to tells nothing about them.
+            probs = probs[active] / (probs[active].sum() + self.get_no_disease_prob())
+            relevant = ~kb.unlinked[np.ix_(symptom_ids, active)].all(axis=1)
+            for i in np.asarray(symptom_ids, dtype=int)[~relevant].tolist():
+                self._symptom_scores[i] = (0.0, True)
+
+            symptom_ids = np.asarray(symptom_ids, dtype=int)[relevant].tolist()
+
+        if len(symptom_ids) == 0:
+            return
 
-        return max(results.keys(), key=lambda x: results[x])
+        instrumentation.count("candidates_scored", len(symptom_ids))
+        with instrumentation.span("score_symptoms", candidates=len(symptom_ids), pooled=self.scoring_pool is not None):
+            if self.scoring_pool is not None:
+                expected, entropies = self.scoring_pool.score(kb, probs, symptom_ids, active, self.should_cancel)
+            else:
+                if self.should_cancel is not None and self.should_cancel():
+                    raise ScoringCancelled()
+
+                expected, entropies = score_symptoms(kb, probs, symptom_ids, active)
+
+        current_entropy = disease_entropy(probs.tolist())
+        possibility_mask = kb.possibility_mask[symptom_ids]
+
+        # Why you need to ask something that doesn't have any information?
+        uninformative = np.where(possibility_mask, np.isclose(entropies, current_entropy, rtol=1e-12, atol=1e-15), True).all(axis=-1)
+
+        for i, score, skip in zip(symptom_ids, (-expected).tolist(), uninformative.tolist()):
+            self._symptom_scores[i] = (score, skip)
     
+    def get_askable_symptoms(self) -> dict[int, str]:
+        if len(self.contexts) > 0 and self.knowledge_base.hierarchy is not None:
+            context = self.contexts[-1]
+        else:
+            context = None
+
+        if context in self._askable:
+            return self._askable[context]
+        else:
+            return self.knowledge_base.askable.get(context, {})
+
     def get_valid_symptom_to_ask(self, symptom: str) -> str | None:
         if symptom in self.answer_history:
             return None
 
-        if self.subsymptom_df is None:
+        hierarchy = self.knowledge_base.hierarchy
+        if hierarchy is None:
             return symptom
-        
-        filtered_df = self.subsymptom_df[self.subsymptom_df["AnakGejala"] == symptom]
 
-        if len(filtered_df) == 0:
-            if len(self.contexts) > 0:
-                return None
-            else:
-                return symptom
-            
-        else:
-            parent_symptom: str = filtered_df.iloc[0]["Gejala"]
-            if len(self.contexts) > 0 and parent_symptom == self.contexts[-1]:
+        visited = set()
+        while symptom not in visited:
+            visited.add(symptom)
+            parent_symptom = hierarchy.parents.get(symptom)
+            if parent_symptom is None:
+                if len(self.contexts) > 0:
+                    return None
+                else:
+                    return symptom
+
+            elif len(self.contexts) > 0 and parent_symptom == self.contexts[-1]:
                 return symptom
-            else:
-                return self.get_valid_symptom_to_ask(parent_symptom)
 
-    def get_possibilities(self, symptom_name: str) -> list[tuple[bool, str | None, float]]:
-        symptom_filter = self.symptom_df["Gejala"] == symptom_name
-        possibilities = []
-        filtered_df = self.symptom_df[symptom_filter]
-        if filtered_df["Variasi"].isna().all():
-            possibilities = [(True, None, 0.0), (False, None, 1.0)]
+            symptom = parent_symptom
+            if symptom in self.answer_history:
+                return None
 
-        else:
-            na_exists = False
-            for opt_el in filtered_df["Variasi"].unique():
-                if isinstance(opt_el, str):
-                    possibilities.append((True, opt_el, 0.0))
-                else:
-                    na_exists = True
+        return None
 
-            if na_exists:
-                possibilities.append((False, None, 1.0))
-        
-        return possibilities
-    
-    def get_conditional_symptom_probs_with_variant(self, symptom_name: str, exists: bool = True, variant: str | None = None):
-        conditional_symptom_probs = []
-        symptom_filter = self.symptom_df["Gejala"] == symptom_name
-        for d in self.disease_names:
-            disease_filter = self.symptom_df["Penyakit"] == d
-            filtered_df = self.symptom_df[symptom_filter & disease_filter]
-            if len(filtered_df) == 0:
-                conditional_symptom_probs.append(-1.0)
+    def _remove_askable(self, symptom: str):
+        # Nothing at or below an answered symptom can be asked anymore, and only
+        # the contexts above it can reach those symptoms.
+        kb = self.knowledge_base
+        if kb.hierarchy is None:
+            blocked = [symptom]
+            contexts = [None]
+        else:
+            blocked = [symptom] + kb.hierarchy.descendants(symptom)
+            ancestors = kb.hierarchy.ancestors(symptom)
+            if ancestors is None:
+                # The parent chain loops, so every context may reach it.
+                contexts = list(kb.askable)
             else:
-                current_variant = filtered_df.iloc[0]["Variasi"]
-                frequency = filtered_df.iloc[0]["Frekuensi"]
-                if not isinstance(frequency, str):
-                    frequency = "Sering"
+                contexts = [None] + ancestors
+
+        blocked_ids = [kb.symptom_index[x] for x in blocked if x in kb.symptom_index]
+        for context in contexts:
+            askable = self._askable.get(context, kb.askable.get(context))
+            if askable is None or not any(i in askable for i in blocked_ids):
+                continue
 
-                frequency = frequency.lower()
-                prob = FREQUENCY_PROB_MAP[frequency]
+            if context not in self._askable:
+                askable = dict(askable)
+                self._askable[context] = askable
 
-                if (not exists) or (isinstance(current_variant, str) and current_variant != variant):
-                    prob = 1 - prob
-                
-                conditional_symptom_probs.append(prob)
+            for i in blocked_ids:
+                askable.pop(i, None)
 
-        if all(x == -1.0 for x in conditional_symptom_probs):
-            return None
-        else:
-            return conditional_symptom_probs
+    def get_possibilities(self, symptom_name: str) -> list[tuple[bool, str | None, float]]:
+        return self.knowledge_base.get_possibilities(symptom_name)
+    
+    def get_conditional_symptom_probs_with_variant(self, symptom_name: str, exists: bool = True, variant: str | None = None):
+        return self.knowledge_base.get_conditional_symptom_probs_with_variant(symptom_name, exists, variant)
     
     def answer(self, symptom: str, exists: bool, variant: str | None = None):
         self.answer_history[symptom] = {
             "exists": exists,
             "variant": variant
         }
+        self._remove_askable(symptom)
 
         conditional_symptom_probs = self.get_conditional_symptom_probs_with_variant(symptom, exists, variant)
         if conditional_symptom_probs is not None:
-            self.disease_probs = new_disease_probs(self.disease_probs, conditional_symptom_probs, 0.0 if exists else 1.0)
+            if self.log_space:
+                self._update_log_disease_probs(conditional_symptom_probs, 0.0 if exists else 1.0)
+            else:
+                self.disease_probs = new_disease_probs(self.disease_probs, conditional_symptom_probs, 0.0 if exists else 1.0)
 
         # Update contexts
         if exists:
@@ -224,6 +968,30 @@ class UnnamedState:
 
         self.pop_contexts_if_no_questions()
 
+    def _update_log_disease_probs(self, conditional_symptom_probs: list[float], symptom_prob_if_no_disease: float):
+        # Same update as new_disease_probs, done on log probabilities.
+        probs = np.exp(self.log_disease_probs)
+        likelihoods = np.asarray(conditional_symptom_probs)
+        linked = likelihoods != -1.0
+
+        denominator = self.get_no_disease_prob() + probs[linked].sum()
+        if denominator <= 0.0:
+            raise ValueError("You can't find the symptom prob if there is no disease related to this!!!!")
+
+        default_prob = (self.get_no_disease_prob() * symptom_prob_if_no_disease + (probs * likelihoods)[linked].sum()) / denominator
+
+        with np.errstate(divide="ignore"):
+            log_probs = self.log_disease_probs + np.log(np.where(linked, likelihoods, default_prob))
+            log_no_disease_prob = self.log_no_disease_prob + np.log(symptom_prob_if_no_disease)
+
+        log_normalizer = np.logaddexp(log_sum_exp(log_probs), log_no_disease_prob)
+        if log_normalizer == -np.inf:
+            raise ValueError("Impossible")
+
+        self.log_disease_probs = log_probs - log_normalizer
+        self.log_no_disease_prob = float(log_no_disease_prob - log_normalizer)
+        self.disease_probs = np.exp(self.log_disease_probs).tolist()
+
     def pop_contexts_if_no_questions(self):
         while len(self.contexts) > 0 and self.get_best_symptom_to_ask() is None:
             self.contexts.pop()
@@ -232,13 +1000,86 @@ class UnnamedState:
         self.answer_history[symptom] = {
             "skip": True
         }
+        self._remove_askable(symptom)
 
         self.pop_contexts_if_no_questions()
 
+def predict_batch(knowledge_base: KnowledgeBase, answers: list[dict[str, dict]], batch_size: int = 4096) -> list[dict]:
+    # get_predictions for many patients whose answers are already known, as if
+    # each dict (in the answer_history format: symptom -> {"exists", "variant"}
+    # or {"skip": True}) had been fed to UnnamedState.answer in order. The
+    # update of every answer step is done for all patients at once.
+    kb = knowledge_base
+    n_diseases = len(kb.disease_names)
+    name_order = np.argsort([x.lower() for x in kb.disease_names], kind="stable")
+    name_ranks = np.empty(n_diseases, dtype=int)
+    name_ranks[name_order] = np.arange(n_diseases)
+
+    results = []
+    for batch_start in range(0, len(answers), batch_size):
+        batch = answers[batch_start:batch_start + batch_size]
+
+        steps: list[list[tuple[int, int, bool, str | None]]] = [[] for _ in batch]
+        for i, patient_answers in enumerate(batch):
+            for symptom, answer in patient_answers.items():
+                s = kb.symptom_index.get(symptom)
+                if s is None or answer.get("skip", False):
+                    continue
+
+                steps[i].append((i, s, answer["exists"], answer.get("variant")))
+
+        probs = np.full((len(batch), n_diseases), 1 / (n_diseases + 1))
+        for j in range(max((len(x) for x in steps), default=0)):
+            current = [x[j] for x in steps if len(x) > j]
+            rows = [x[0] for x in current]
+            likelihoods = np.stack([kb.likelihood_row(s, exists, variant) for _, s, exists, variant in current])
+            no_disease_likelihoods = np.array([0.0 if exists else 1.0 for _, _, exists, _ in current])
+
+            p = probs[rows]
+            linked = likelihoods != -1.0
+            no_disease_probs = 1.0 - p.sum(axis=1)
+            weighted = np.where(linked, p * likelihoods, 0.0)
+
+            denominators = 1.0 - np.where(linked, 0.0, p).sum(axis=1)
+            if np.any(denominators <= 0.0):
+                raise ValueError("You can't find the symptom prob if there is no disease related to this!!!!")
+
+            default_probs = (no_disease_probs * no_disease_likelihoods + weighted.sum(axis=1)) / denominators
+            next_probs = np.where(linked, weighted, p * default_probs[:, None])
+            normalizers = next_probs.sum(axis=1) + no_disease_probs * no_disease_likelihoods
+            if np.any(normalizers == 0):
+                raise ValueError("Impossible")
+
+            probs[rows] = next_probs / normalizers[:, None]
+
+        no_disease_probs = 1.0 - probs.sum(axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            entropies = -np.where(probs > 0.0, probs * np.log(probs), 0.0).sum(axis=1)
+            entropies -= np.where(no_disease_probs > 0.0, no_disease_probs * np.log(no_disease_probs), 0.0)
+
+        for patient_probs, no_disease_prob, entropy in zip(probs, no_disease_probs.tolist(), entropies.tolist()):
+            order = np.lexsort((name_ranks, -patient_probs))
+            order = order[patient_probs[order] > 0.0]
+            results.append({
+                "diseases": [
+                    {
+                        "name": kb.disease_names[d],
+                        "prob": prob
+                    } for d, prob in zip(order.tolist(), patient_probs[order].tolist())
+                ],
+                "no_disease_prob": no_disease_prob,
+                "entropy": entropy
+            })
+
+    return results
+
 if __name__ == "__main__":
-    df = pd.read_excel("data.xlsx", "SymptomTable")
-    subsymptom_df = pd.read_excel("data.xlsx", "SubsymptomTable")
-    current_state = UnnamedState(df, subsymptom_df)
+    # kb_snapshot imports this file as experiment_3, so its knowledge base is
+    # an experiment_3.KnowledgeBase rather than a __main__ one.
+    from experiment_3 import UnnamedState
+    from kb_snapshot import load_excel_knowledge_base
+
+    current_state = UnnamedState(load_excel_knowledge_base("data.xlsx"))
 
     question_no = 1
     stop_asking = False
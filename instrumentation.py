@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+import time
+from collections import Counter, deque
+from typing import Callable
+
+# Spans and counters for finding where time goes. Nothing is recorded unless a
+# recorder is active: either the process-wide one (enable(), or the
+# KODOK_TRACE_FILE environment variable) or one set for the current thread
+# (set_thread_recorder(), used per session by app.py in debug mode). When
+# neither is active, span() and count() return immediately.
+
+class Recorder:
+    def __init__(self, path: str | None = None, max_spans: int = 10_000):
+        # With a path, every span and counter update is also appended to it as
+        # a JSON line.
+        self.path = path
+        self.spans: deque[dict] = deque(maxlen=max_spans)
+        self.counters: Counter[str] = Counter()
+        self._lock = threading.Lock()
+
+    def record_span(self, name: str, start: float, duration: float, attrs: dict):
+        record = {"type": "span", "name": name, "start": start, "duration": duration, **attrs}
+        with self._lock:
+            self.spans.append(record)
+            self._write(record)
+
+    def record_count(self, name: str, n: int):
+        with self._lock:
+            self.counters[name] += n
+            self._write({"type": "count", "name": name, "n": n, "time": time.time()})
+
+    def _write(self, record: dict):
+        if self.path is not None:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+
+    def summary(self) -> dict:
+        with self._lock:
+            spans = {}
+            for x in self.spans:
+                item = spans.setdefault(x["name"], {"count": 0, "total": 0.0, "max": 0.0})
+                item["count"] += 1
+                item["total"] += x["duration"]
+                item["max"] = max(item["max"], x["duration"])
+
+            for item in spans.values():
+                item["mean"] = item["total"] / item["count"]
+
+            return {"spans": spans, "counters": dict(self.counters)}
+
+    def to_json_lines(self) -> str:
+        with self._lock:
+            lines = [json.dumps(x, default=str) for x in self.spans]
+            lines += [json.dumps({"type": "counter", "name": k, "value": v}) for k, v in self.counters.items()]
+            return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+            self.counters.clear()
+
+_global_recorder: Recorder | None = None
+_local = threading.local()
+
+def enable(recorder: Recorder | None = None) -> Recorder:
+    global _global_recorder
+    _global_recorder = recorder or Recorder()
+    return _global_recorder
+
+def disable():
+    global _global_recorder
+    _global_recorder = None
+
+def set_thread_recorder(recorder: Recorder | None):
+    _local.recorder = recorder
+
+def bind_thread_recorder(function: Callable) -> Callable:
+    # For work handed to another thread: the returned function records to
+    # the calling thread's recorder, wherever it runs.
+    recorder = getattr(_local, "recorder", None)
+
+    def run(*args, **kwargs):
+        previous = getattr(_local, "recorder", None)
+        _local.recorder = recorder
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.recorder = previous
+
+    return run
+
+def _active_recorders() -> tuple[Recorder, ...]:
+    thread_recorder = getattr(_local, "recorder", None)
+    if thread_recorder is None:
+        return () if _global_recorder is None else (_global_recorder,)
+    elif _global_recorder is None or _global_recorder is thread_recorder:
+        return (thread_recorder,)
+    else:
+        return (thread_recorder, _global_recorder)
+
+class _Span:
+    def __init__(self, recorders: tuple[Recorder, ...], name: str, attrs: dict):
+        self.recorders = recorders
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start
+        for recorder in self.recorders:
+            recorder.record_span(self.name, self.wall_start, duration, self.attrs)
+
+        return False
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+def span(name: str, **attrs):
+    recorders = _active_recorders()
+    if len(recorders) == 0:
+        return _NULL_SPAN
+
+    return _Span(recorders, name, attrs)
+
+def record_span(name: str, start: float, duration: float, **attrs):
+    for recorder in _active_recorders():
+        recorder.record_span(name, start, duration, attrs)
+
+def count(name: str, n: int = 1):
+    for recorder in _active_recorders():
+        recorder.record_count(name, n)
+
+if os.environ.get("KODOK_TRACE_FILE"):
+    enable(Recorder(os.environ["KODOK_TRACE_FILE"]))
@@ -0,0 +1,74 @@
+from typing import Callable
+
+import pandas as pd
+from supabase import Client
+
+# Edits of the disease and symptom lists (name and description) made in the
+# admin data editors, saved with one call to save_names in
+# sql/006_save_names.sql.
+
+class NameChanges:
+    def __init__(self):
+        self.deleted: list[str] = []
+        # (old name, new name, description)
+        self.renamed: list[tuple[str, str, str | None]] = []
+        # (name, description) of rows whose description alone changed
+        self.edited: list[tuple[str, str | None]] = []
+        # (name, description) of new rows
+        self.added: list[tuple[str, str | None]] = []
+
+    def new_names(self) -> list[str]:
+        return [name for _, name, _ in self.renamed] + [name for name, _ in self.added]
+
+def name_changes(page_df: pd.DataFrame, changes: dict) -> NameChanges:
+    # Reads a data_editor diff (edited_rows, added_rows, deleted_rows) of a
+    # page with the columns Nama and Deskripsi.
+    result = NameChanges()
+    result.deleted = [page_df.loc[i, "Nama"] for i in changes.get("deleted_rows", [])]
+    for i, edit in changes.get("edited_rows", {}).items():
+        old_name = page_df.loc[int(i), "Nama"]
+        if old_name in result.deleted:
+            continue
+
+        name = (edit.get("Nama", old_name) or "").strip()
+        description = edit.get("Deskripsi", page_df.loc[int(i), "Deskripsi"])
+        if name != old_name:
+            result.renamed.append((old_name, name, description))
+        else:
+            result.edited.append((name, description))
+
+    result.added = [((x.get("Nama") or "").strip(), x.get("Deskripsi")) for x in changes.get("added_rows", [])]
+    return result
+
+def validate_name_changes(changes: NameChanges, existing_names, label: str) -> str | None:
+    # Returns an error message, or None if the changes can be saved. A name
+    # can be reused by another row once its own row is renamed or deleted.
+    new_names = changes.new_names()
+    if "" in new_names:
+        return "Nama tidak boleh kosong."
+
+    taken = set(existing_names) - set(changes.deleted) - {old_name for old_name, _, _ in changes.renamed}
+    for name in new_names:
+        if name in taken:
+            return f"{label} dengan nama \"{name}\" sudah ada."
+
+        taken.add(name)
+
+    return None
+
+def save_name_changes(supabase: Client, table: str, changes: NameChanges, describe: Callable[[str, str | None], str]):
+    # One round trip and one transaction for the deletes, renames and
+    # upserts. describe turns an edited description into the one stored
+    # (e.g. generating it on request).
+    supabase.rpc("save_names", {
+        "p_table": table,
+        "p_deleted": changes.deleted,
+        "p_renamed": [
+            {"old_name": old_name, "name": name, "description": describe(name, description)}
+            for old_name, name, description in changes.renamed
+        ],
+        "p_upserted": [
+            {"name": name, "description": describe(name, description)}
+            for name, description in changes.edited + changes.added
+        ],
+    }).execute()
@@ -0,0 +1,149 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import pandas as pd
+
+import instrumentation
+from experiment_3 import KnowledgeBase, knowledge_base_version
+from kb_snapshot import load_source_knowledge_base
+
+class KnowledgeBaseSnapshot:
+    def __init__(
+        self,
+        version: int,
+        symptom_df: pd.DataFrame,
+        subsymptom_df: pd.DataFrame,
+        knowledge_base: KnowledgeBase,
+        symptom_descriptions: dict[str, str] | None = None,
+        disease_descriptions: dict[str, str] | None = None
+    ):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.symptom_df = symptom_df
+        self.subsymptom_df = subsymptom_df
+        self.knowledge_base = knowledge_base
+        self.symptom_descriptions = symptom_descriptions or {}
+        self.disease_descriptions = disease_descriptions or {}
+
+class KnowledgeBaseCache:
+    # Process-wide snapshot of the knowledge base. A snapshot is served until
+    # it is older than ttl seconds or the version has been bumped (after an
+    # admin write), whichever comes first. The ttl bounds how long edits made
+    # by other processes can go unnoticed.
+    #
+    # description_loader, if given, returns (symptom descriptions, disease
+    # descriptions) by name. They are refreshed together with the tables, so
+    # pages can render them without going to the database.
+    #
+    # source_loader, if given with snapshot_dir, returns a cheap name for the
+    # tables' current contents. The knowledge base is then mapped from the
+    # on-disk snapshot of that source, and loader only runs when there is
+    # none yet (e.g. after an edit). source_prefix, if given, is the part of
+    # every source name that doesn't change between revisions; older
+    # snapshots of it are deleted once a new one is saved.
+    def __init__(
+        self,
+        loader: Callable[[], tuple[pd.DataFrame, pd.DataFrame]],
+        ttl: float = 300.0,
+        opening_book_depth: int = 0,
+        description_loader: Callable[[], tuple[dict[str, str], dict[str, str]]] | None = None,
+        source_loader: Callable[[], str] | None = None,
+        snapshot_dir: str | None = None,
+        source_prefix: str | None = None
+    ):
+        self.loader = loader
+        self.description_loader = description_loader
+        self.source_loader = source_loader
+        self.snapshot_dir = snapshot_dir
+        self.source_prefix = source_prefix
+        self.ttl = ttl
+        self.opening_book_depth = opening_book_depth
+        self.version = 0
+        self._snapshot: KnowledgeBaseSnapshot | None = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def bump_version(self):
+        with self._lock:
+            self.version += 1
+
+    def is_fresh(self, snapshot: KnowledgeBaseSnapshot | None) -> bool:
+        return (
+            snapshot is not None
+            and snapshot.version == self.version
+            and time.monotonic() - snapshot.loaded_at < self.ttl
+        )
+
+    def get(self) -> KnowledgeBaseSnapshot:
+        with self._lock:
+            if self.is_fresh(self._snapshot):
+                return self._snapshot
+
+        # Only one thread loads; the others wait for its snapshot.
+        with self._load_lock:
+            with self._lock:
+                if self.is_fresh(self._snapshot):
+                    return self._snapshot
+
+                version = self.version
+                previous = self._snapshot
+
+            if self.description_loader is not None:
+                # Independent of the tables, so loaded at the same time.
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    descriptions = executor.submit(instrumentation.bind_thread_recorder(self.description_loader))
+                    knowledge_base = self._load_knowledge_base(previous)
+                    symptom_descriptions, disease_descriptions = descriptions.result()
+            else:
+                knowledge_base = self._load_knowledge_base(previous)
+                symptom_descriptions, disease_descriptions = {}, {}
+
+            snapshot = KnowledgeBaseSnapshot(
+                version,
+                knowledge_base.symptom_df,
+                knowledge_base.subsymptom_df,
+                knowledge_base,
+                symptom_descriptions,
+                disease_descriptions
+            )
+            with self._lock:
+                self._snapshot = snapshot
+
+            return snapshot
+
+    def _load_knowledge_base(self, previous: KnowledgeBaseSnapshot | None) -> KnowledgeBase:
+        if self.source_loader is not None and self.snapshot_dir is not None:
+            with instrumentation.span("load_kb_snapshot"):
+                knowledge_base = load_source_knowledge_base(
+                    self.source_loader(),
+                    self.loader,
+                    self.snapshot_dir,
+                    self.opening_book_depth,
+                    self.source_prefix
+                )
+        else:
+            symptom_df, subsymptom_df = self.loader()
+            if previous is not None and previous.knowledge_base.version == knowledge_base_version(symptom_df, subsymptom_df):
+                return previous.knowledge_base
+
+            knowledge_base = KnowledgeBase(symptom_df, subsymptom_df, opening_book_depth=self.opening_book_depth)
+
+        # Unchanged content keeps the compiled knowledge base (and with it
+        # the opening book and transposition table entries).
+        if previous is not None and previous.knowledge_base.version == knowledge_base.version:
+            return previous.knowledge_base
+
+        return knowledge_base
+
+    def replace(self, expected: KnowledgeBaseSnapshot, snapshot: KnowledgeBaseSnapshot) -> bool:
+        # Publishes a snapshot derived from expected (e.g. by applying
+        # changes to it), unless the cache has moved on since.
+        with self._lock:
+            if self._snapshot is not expected:
+                return False
+
+            snapshot.version = self.version
+            self._snapshot = snapshot
+            return True
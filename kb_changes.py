@@ -0,0 +1,353 @@
+import asyncio
+import threading
+from typing import Callable, Protocol
+
+import pandas as pd
+
+import instrumentation
+from kb_cache import KnowledgeBaseCache, KnowledgeBaseSnapshot
+
+# Keeps a KnowledgeBaseCache up to date from row-level changes to the tables
+# behind the knowledge base, instead of reloading everything after each edit.
+# Changes are applied to a mirror of the rows, and only the symptoms they
+# touch are recompiled (KnowledgeBase.updated). Every batch of changes makes
+# a new snapshot; sessions that already started keep the one they have.
+
+KB_TABLES = [
+    "diseases",
+    "symptoms",
+    "disease_symptoms",
+    "disease_variant_free_symptoms",
+    "disease_variant_specific_symptoms",
+    "subsymptoms",
+    "variant_free_subsymptoms",
+    "variant_specific_subsymptoms",
+]
+
+class ChangeEvent:
+    def __init__(self, table: str, type: str, record: dict | None = None, old_record: dict | None = None):
+        # type is "INSERT", "UPDATE" or "DELETE". Deletes and renames need
+        # old_record, which needs the tables' replica identity to be full
+        # (sql/002_kb_change_feed.sql).
+        self.table = table
+        self.type = type
+        self.record = record or {}
+        self.old_record = old_record or {}
+
+    @classmethod
+    def from_realtime(cls, payload: dict) -> "ChangeEvent":
+        data = payload["data"]
+        return cls(data["table"], data["type"], data.get("record"), data.get("old_record"))
+
+class ChangeSource(Protocol):
+    def subscribe(self, callback: Callable[[ChangeEvent], None]): ...
+
+class FakeChangeSource:
+    # Delivers events given to emit() synchronously, for running the
+    # subscriber without a database.
+    def __init__(self):
+        self.callbacks: list[Callable[[ChangeEvent], None]] = []
+
+    def subscribe(self, callback: Callable[[ChangeEvent], None]):
+        self.callbacks.append(callback)
+
+    def emit(self, table: str, type: str, record: dict | None = None, old_record: dict | None = None):
+        event = ChangeEvent(table, type, record, old_record)
+        for callback in self.callbacks:
+            callback(event)
+
+class RealtimeChangeSource:
+    # Supabase Realtime postgres_changes for KB_TABLES. The realtime client is
+    # async only, so it runs on its own event loop in a daemon thread.
+    def __init__(self, supabase_url: str, supabase_key: str, tables: list[str] = KB_TABLES):
+        self.url = f"{supabase_url}/realtime/v1".replace("http", "ws")
+        self.key = supabase_key
+        self.tables = tables
+
+    def subscribe(self, callback: Callable[[ChangeEvent], None]):
+        thread = threading.Thread(target=asyncio.run, args=(self._listen(callback),), daemon=True)
+        thread.start()
+
+    async def _listen(self, callback: Callable[[ChangeEvent], None]):
+        from realtime import AsyncRealtimeClient
+
+        client = AsyncRealtimeClient(self.url, token=self.key)
+        await client.connect()
+        channel = client.channel("kb_changes")
+        for table in self.tables:
+            channel.on_postgres_changes("*", lambda payload: callback(ChangeEvent.from_realtime(payload)), table=table, schema="public")
+
+        await channel.subscribe()
+        await asyncio.Event().wait()
+
+class KnowledgeBaseTables:
+    # Row-level mirror of the tables the supabase_loader views are made of,
+    # keyed like the database, producing the same DataFrames as the loader.
+    def __init__(self, symptom_df: pd.DataFrame, subsymptom_df: pd.DataFrame | None, symptom_descriptions: dict[str, str], disease_descriptions: dict[str, str]):
+        self.links: dict = {}
+        self.variant_free: dict = {}
+        self.variant_specific: dict = {}
+        for id_, disease, symptom, variant, frequency in zip(
+            symptom_df["Id"],
+            symptom_df["Penyakit"],
+            symptom_df["Gejala"],
+            symptom_df["Variasi"],
+            symptom_df["Frekuensi"]
+        ):
+            self.links[id_] = (disease, frequency)
+            if isinstance(variant, str):
+                self.variant_specific[id_] = (symptom, variant)
+            else:
+                self.variant_free[id_] = symptom
+
+        self.variant_free_subsymptoms: dict[str, str] = {}
+        self.variant_specific_subsymptoms: dict[str, tuple[str, str]] = {}
+        if subsymptom_df is not None:
+            for parent, variant, subsymptom in zip(subsymptom_df["Gejala"], subsymptom_df["Variasi"], subsymptom_df["AnakGejala"]):
+                if isinstance(variant, str):
+                    self.variant_specific_subsymptoms[subsymptom] = (parent, variant)
+                else:
+                    self.variant_free_subsymptoms[subsymptom] = parent
+
+        self.symptom_descriptions = dict(symptom_descriptions)
+        self.disease_descriptions = dict(disease_descriptions)
+
+    @classmethod
+    def from_snapshot(cls, snapshot: KnowledgeBaseSnapshot) -> "KnowledgeBaseTables":
+        return cls(snapshot.symptom_df, snapshot.subsymptom_df, snapshot.symptom_descriptions, snapshot.disease_descriptions)
+
+    def symptom_of(self, id_) -> str | None:
+        if id_ in self.variant_free:
+            return self.variant_free[id_]
+        elif id_ in self.variant_specific:
+            return self.variant_specific[id_][0]
+        else:
+            return None
+
+    def _remove_link(self, id_) -> str | None:
+        symptom = self.symptom_of(id_)
+        self.links.pop(id_, None)
+        self.variant_free.pop(id_, None)
+        self.variant_specific.pop(id_, None)
+        return symptom
+
+    def apply(self, event: ChangeEvent) -> set[str]:
+        # Returns the symptoms whose rows in the symptom table changed.
+        # Foreign key cascades are applied here too, since the feed only
+        # reports the row that was written.
+        changed = set()
+        record = event.record
+        old = event.old_record
+
+        if event.table == "disease_symptoms":
+            if event.type == "DELETE":
+                changed.add(self._remove_link(old["id"]))
+            else:
+                self.links[record["id"]] = (record["disease"], record["frequency"] or None)
+                changed.add(self.symptom_of(record["id"]))
+
+        elif event.table == "disease_variant_free_symptoms":
+            changed.add(self.symptom_of(old.get("id", record.get("id"))))
+            if event.type == "DELETE":
+                self.variant_free.pop(old["id"], None)
+            else:
+                self.variant_free[record["id"]] = record["symptom"]
+                changed.add(record["symptom"])
+
+        elif event.table == "disease_variant_specific_symptoms":
+            changed.add(self.symptom_of(old.get("id", record.get("id"))))
+            if event.type == "DELETE":
+                self.variant_specific.pop(old["id"], None)
+            else:
+                self.variant_specific[record["id"]] = (record["symptom"], record["variant"])
+                changed.add(record["symptom"])
+
+        elif event.table == "subsymptoms":
+            if event.type == "DELETE":
+                self.variant_free_subsymptoms.pop(old["subsymptom"], None)
+                self.variant_specific_subsymptoms.pop(old["subsymptom"], None)
+
+        elif event.table == "variant_free_subsymptoms":
+            self.variant_free_subsymptoms.pop(old.get("subsymptom"), None)
+            if event.type != "DELETE":
+                self.variant_free_subsymptoms[record["subsymptom"]] = record["parent"]
+
+        elif event.table == "variant_specific_subsymptoms":
+            self.variant_specific_subsymptoms.pop(old.get("subsymptom"), None)
+            if event.type != "DELETE":
+                self.variant_specific_subsymptoms[record["subsymptom"]] = (record["parent"], record["parent_variant"])
+
+        elif event.table == "symptoms":
+            changed |= self._apply_symptom(event)
+
+        elif event.table == "diseases":
+            changed |= self._apply_disease(event)
+
+        changed.discard(None)
+        return changed
+
+    def _apply_symptom(self, event: ChangeEvent) -> set[str]:
+        old_name = event.old_record.get("name")
+        new_name = event.record.get("name") if event.type != "DELETE" else None
+        if event.type != "DELETE":
+            if old_name is not None and old_name != new_name:
+                self.symptom_descriptions.pop(old_name, None)
+
+            self.symptom_descriptions[new_name] = event.record.get("description")
+
+        if old_name is None or old_name == new_name:
+            return set()
+
+        if event.type == "DELETE":
+            self.symptom_descriptions.pop(old_name, None)
+            for id_ in [k for k in self.links if self.symptom_of(k) == old_name]:
+                self._remove_link(id_)
+
+            self.variant_free_subsymptoms = {
+                k: v for k, v in self.variant_free_subsymptoms.items() if old_name not in (k, v)
+            }
+            self.variant_specific_subsymptoms = {
+                k: v for k, v in self.variant_specific_subsymptoms.items() if old_name not in (k, v[0])
+            }
+
+            return {old_name}
+
+        # Renamed: names are foreign keys with on update cascade.
+        for id_, symptom in self.variant_free.items():
+            if symptom == old_name:
+                self.variant_free[id_] = new_name
+
+        for id_, (symptom, variant) in self.variant_specific.items():
+            if symptom == old_name:
+                self.variant_specific[id_] = (new_name, variant)
+
+        self.variant_free_subsymptoms = {
+            new_name if k == old_name else k: new_name if v == old_name else v
+            for k, v in self.variant_free_subsymptoms.items()
+        }
+        self.variant_specific_subsymptoms = {
+            new_name if k == old_name else k: (new_name if v[0] == old_name else v[0], v[1])
+            for k, v in self.variant_specific_subsymptoms.items()
+        }
+        return {old_name, new_name}
+
+    def _apply_disease(self, event: ChangeEvent) -> set[str]:
+        old_name = event.old_record.get("name")
+        new_name = event.record.get("name") if event.type != "DELETE" else None
+        if event.type != "DELETE":
+            if old_name is not None and old_name != new_name:
+                self.disease_descriptions.pop(old_name, None)
+
+            self.disease_descriptions[new_name] = event.record.get("description")
+
+        if old_name is None or old_name == new_name:
+            return set()
+
+        changed = set()
+        if event.type == "DELETE":
+            self.disease_descriptions.pop(old_name, None)
+            for id_ in [k for k, (disease, _) in self.links.items() if disease == old_name]:
+                changed.add(self._remove_link(id_))
+        else:
+            for id_, (disease, frequency) in self.links.items():
+                if disease == old_name:
+                    self.links[id_] = (new_name, frequency)
+                    changed.add(self.symptom_of(id_))
+
+        return changed
+
+    def to_dataframes(self) -> tuple[pd.DataFrame, pd.DataFrame]:
+        # Same rows, order and columns as supabase_loader. Links whose
+        # variant row hasn't arrived yet are left out until it does.
+        data = {"Id": [], "Penyakit": [], "Gejala": [], "Variasi": [], "Frekuensi": []}
+        for id_ in sorted(self.links):
+            if id_ in self.variant_free:
+                symptom, variant = self.variant_free[id_], None
+            elif id_ in self.variant_specific:
+                symptom, variant = self.variant_specific[id_]
+            else:
+                continue
+
+            disease, frequency = self.links[id_]
+            data["Id"].append(id_)
+            data["Penyakit"].append(disease)
+            data["Gejala"].append(symptom)
+            data["Variasi"].append(variant)
+            data["Frekuensi"].append(frequency)
+
+        rows = [(k, v, None) for k, v in self.variant_free_subsymptoms.items()]
+        rows += [(k, parent, variant) for k, (parent, variant) in self.variant_specific_subsymptoms.items()]
+        rows.sort(key=lambda x: x[0])
+        subsymptom_df = pd.DataFrame({
+            "Gejala": [x[1] for x in rows],
+            "Variasi": [x[2] for x in rows],
+            "AnakGejala": [x[0] for x in rows],
+        })
+        return pd.DataFrame(data), subsymptom_df
+
+class KnowledgeBaseSubscriber:
+    # Collects events from a ChangeSource and, once they stop arriving for
+    # delay seconds (so the rows of one admin save land together), publishes
+    # a new snapshot to the cache. flush() applies pending events right away.
+    def __init__(self, cache: KnowledgeBaseCache, source: ChangeSource, delay: float = 0.5):
+        self.cache = cache
+        self.delay = delay
+        self._pending: list[ChangeEvent] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer: threading.Timer | None = None
+        self._tables: KnowledgeBaseTables | None = None
+        self._tables_snapshot: KnowledgeBaseSnapshot | None = None
+        source.subscribe(self.handle)
+
+    def handle(self, event: ChangeEvent):
+        with self._lock:
+            self._pending.append(event)
+            if self.delay > 0:
+                if self._timer is not None:
+                    self._timer.cancel()
+
+                self._timer = threading.Timer(self.delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self) -> KnowledgeBaseSnapshot | None:
+        with self._flush_lock:
+            with self._lock:
+                events = self._pending
+                self._pending = []
+
+            if len(events) == 0:
+                return None
+
+            with instrumentation.span("apply_kb_changes", events=len(events)):
+                snapshot = self.cache.get()
+                if self._tables_snapshot is not snapshot:
+                    # First batch, or the cache reloaded in the meantime.
+                    self._tables = KnowledgeBaseTables.from_snapshot(snapshot)
+
+                changed = set()
+                for event in events:
+                    changed |= self._tables.apply(event)
+
+                symptom_df, subsymptom_df = self._tables.to_dataframes()
+                knowledge_base = snapshot.knowledge_base.updated(symptom_df, subsymptom_df, changed)
+                new_snapshot = KnowledgeBaseSnapshot(
+                    snapshot.version,
+                    symptom_df,
+                    subsymptom_df,
+                    knowledge_base,
+                    dict(self._tables.symptom_descriptions),
+                    dict(self._tables.disease_descriptions)
+                )
+
+                # The ttl still counts from the last full load, so a missed
+                # event is corrected by the next one.
+                new_snapshot.loaded_at = snapshot.loaded_at
+                if self.cache.replace(snapshot, new_snapshot):
+                    self._tables_snapshot = new_snapshot
+                else:
+                    self._tables_snapshot = None
+
+            instrumentation.count("kb_change_events", len(events))
+            return new_snapshot
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from experiment_3 import KnowledgeBase, SymptomHierarchy
+
+# On-disk snapshot of a compiled KnowledgeBase. A snapshot is a directory with
+#
+#   manifest.json        names, variants, possibilities, opening book
+#   symptoms.parquet     the source tables, as given to KnowledgeBase
+#   subsymptoms.parquet
+#   <array>.arrow        one uncompressed Arrow IPC file per compiled array
+#
+# The arrays are memory-mapped on load, so opening a snapshot costs almost
+# nothing and every process that loads the same snapshot shares its pages.
+# Snapshots are never modified after they are written.
+
+SNAPSHOT_FORMAT = 1
+
+_ARRAYS = ["link_probs", "link_variants", "unlinked", "likelihoods", "no_disease_likelihoods", "possibility_mask"]
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def save_snapshot(knowledge_base: KnowledgeBase, path: str, source: str | None = None):
+    # Written to a temporary directory first and renamed into place, so a
+    # reader never sees a partial snapshot. If another process got there
+    # first, its snapshot is kept.
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=parent)
+    try:
+        arrays = {}
+        for name in _ARRAYS:
+            array = getattr(knowledge_base, name)
+            arrays[name] = {"dtype": array.dtype.str, "shape": list(array.shape)}
+            values = np.ascontiguousarray(array).reshape(-1)
+            if values.dtype == bool:
+                values = values.view(np.uint8)
+
+            table = pa.table({"values": values})
+            with pa.OSFile(os.path.join(tmp, f"{name}.arrow"), "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+
+        pq.write_table(pa.Table.from_pandas(knowledge_base.symptom_df, preserve_index=False), os.path.join(tmp, "symptoms.parquet"))
+        if knowledge_base.subsymptom_df is not None:
+            pq.write_table(pa.Table.from_pandas(knowledge_base.subsymptom_df, preserve_index=False), os.path.join(tmp, "subsymptoms.parquet"))
+
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "version": knowledge_base.version,
+            "source": source,
+            "disease_names": list(knowledge_base.disease_names),
+            "symptom_names": list(knowledge_base.symptom_names),
+            "variant_index": [list(x) for x in knowledge_base.variant_index],
+            "possibilities": knowledge_base.possibilities,
+            "opening_book_depth": knowledge_base.opening_book_depth,
+            "opening_book": [[history_key, contexts, result] for (history_key, contexts), result in knowledge_base.opening_book.items()],
+            "arrays": arrays,
+        }
+        with open(os.path.join(tmp, "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            if not os.path.exists(os.path.join(path, "manifest.json")):
+                raise
+
+    finally:
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+
+def _read_array(path: str, dtype: str, shape: list[int]) -> np.ndarray:
+    with pa.memory_map(path) as source:
+        values = pa.ipc.open_file(source).get_batch(0).column(0)
+
+    # Zero-copy: the array keeps the memory map alive.
+    array = values.to_numpy(zero_copy_only=True).view(np.dtype(dtype)).reshape(shape)
+    array.flags.writeable = False
+    return array
+
+def load_snapshot(path: str) -> KnowledgeBase:
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+
+    if manifest["format"] != SNAPSHOT_FORMAT:
+        raise ValueError(f"Unsupported snapshot format: {manifest['format']}")
+
+    symptom_df = pd.read_parquet(os.path.join(path, "symptoms.parquet"))
+    subsymptom_path = os.path.join(path, "subsymptoms.parquet")
+    subsymptom_df = pd.read_parquet(subsymptom_path) if os.path.exists(subsymptom_path) else None
+
+    # Fills in the same attributes as KnowledgeBase.__init__, taking the
+    # expensive ones from the snapshot instead of recomputing them.
+    knowledge_base = KnowledgeBase.__new__(KnowledgeBase)
+    knowledge_base.symptom_df = symptom_df
+    knowledge_base.subsymptom_df = subsymptom_df
+    knowledge_base.hierarchy = SymptomHierarchy(subsymptom_df) if subsymptom_df is not None else None
+    knowledge_base.version = manifest["version"]
+    knowledge_base.snapshot_path = path
+
+    knowledge_base.disease_names = np.array(manifest["disease_names"], dtype=object)
+    knowledge_base.disease_index = {d: i for i, d in enumerate(knowledge_base.disease_names)}
+    knowledge_base.symptom_names = np.array(manifest["symptom_names"], dtype=object)
+    knowledge_base.symptom_index = {s: i for i, s in enumerate(knowledge_base.symptom_names)}
+    knowledge_base.variant_index = [{v: i for i, v in enumerate(x)} for x in manifest["variant_index"]]
+    knowledge_base.possibilities = [[tuple(p) for p in x] for x in manifest["possibilities"]]
+
+    for name, spec in manifest["arrays"].items():
+        setattr(knowledge_base, name, _read_array(os.path.join(path, f"{name}.arrow"), spec["dtype"], spec["shape"]))
+
+    if knowledge_base.hierarchy is not None:
+        knowledge_base.askable = knowledge_base.hierarchy.askable_symptoms(knowledge_base.symptom_names)
+    else:
+        knowledge_base.askable = {None: {i: s for i, s in enumerate(knowledge_base.symptom_names)}}
+
+    knowledge_base.opening_book_depth = manifest.get("opening_book_depth", 0)
+    knowledge_base.opening_book = {
+        (tuple(tuple(x) for x in history_key), tuple(contexts)): result
+        for history_key, contexts, result in manifest["opening_book"]
+    }
+    return knowledge_base
+
+def load_source_knowledge_base(
+    source: str,
+    loader: Callable[[], tuple[pd.DataFrame, pd.DataFrame | None]],
+    snapshot_dir: str,
+    opening_book_depth: int = 0,
+    source_prefix: str | None = None
+) -> KnowledgeBase:
+    # Loads the snapshot of the given source (anything that names the tables'
+    # contents, e.g. a file hash), or builds and saves it from loader's tables
+    # if there is none yet.
+    #
+    # source_prefix, if given, is the part of source that stays the same
+    # across revisions (e.g. "supabase-<db>" of "supabase-<db>-<revision>").
+    # Once a new snapshot is saved, the older ones of that prefix and depth
+    # are deleted.
+    snapshot_path = os.path.join(snapshot_dir, snapshot_name(source, opening_book_depth))
+    if not os.path.exists(os.path.join(snapshot_path, "manifest.json")):
+        symptom_df, subsymptom_df = loader()
+        knowledge_base = KnowledgeBase(symptom_df, subsymptom_df, opening_book_depth=opening_book_depth)
+        save_snapshot(knowledge_base, snapshot_path, source)
+        if source_prefix is not None:
+            remove_older_snapshots(snapshot_dir, source_prefix, source, opening_book_depth)
+
+    return load_snapshot(snapshot_path)
+
+def snapshot_name(source: str, opening_book_depth: int) -> str:
+    return f"v{SNAPSHOT_FORMAT}-{source}-{opening_book_depth}"
+
+def remove_older_snapshots(snapshot_dir: str, source_prefix: str, source: str, opening_book_depth: int):
+    # Processes that still have an older snapshot mapped keep its pages
+    # until they let go of it; the scoring pool sends those knowledge bases
+    # to its workers by value once their directory is gone.
+    head = f"v{SNAPSHOT_FORMAT}-{source_prefix}-"
+    tail = f"-{opening_book_depth}"
+    keep = snapshot_name(source, opening_book_depth)
+    for name in os.listdir(snapshot_dir):
+        revision = name[len(head):-len(tail)]
+        if name == keep or not (name.startswith(head) and name.endswith(tail)) or revision == "" or "-" in revision:
+            continue
+
+        shutil.rmtree(os.path.join(snapshot_dir, name), ignore_errors=True)
+
+def load_excel_knowledge_base(path: str, snapshot_dir: str | None = None, opening_book_depth: int = 0) -> KnowledgeBase:
+    # Re-parses the workbook only when its contents change; otherwise loads
+    # the snapshot written the last time it was parsed.
+    if snapshot_dir is None:
+        snapshot_dir = os.path.join(os.path.dirname(os.path.abspath(path)), ".kb_snapshots")
+
+    return load_source_knowledge_base(
+        file_hash(path),
+        lambda: (pd.read_excel(path, "SymptomTable"), pd.read_excel(path, "SubsymptomTable")),
+        snapshot_dir,
+        opening_book_depth
+    )
@@ -0,0 +1,244 @@
+import io
+import zipfile
+from xml.etree.ElementTree import ParseError
+
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.utils.exceptions import InvalidFileException
+from supabase import Client
+
+from experiment_3 import FREQUENCY_PROB_MAP, SymptomHierarchy
+from supabase_loader import fetch_concurrently, fetch_disease_symptoms, fetch_subsymptoms
+
+# Bulk import and export of the knowledge base in the data.xlsx layout:
+#
+#   SymptomTable     Penyakit, Gejala, Variasi, Frekuensi
+#   SubsymptomTable  Gejala, Variasi, AnakGejala
+#
+# An import replaces the disease symptoms and the subsymptom hierarchy with
+# the workbook's. Diseases, symptoms and variants it mentions are added if
+# missing; ones it doesn't mention are kept, with their descriptions.
+
+SYMPTOM_COLUMNS = ["Penyakit", "Gejala", "Variasi", "Frekuensi"]
+SUBSYMPTOM_COLUMNS = ["Gejala", "Variasi", "AnakGejala"]
+FREQUENCY_LABELS = {x.lower(): x for x in ["Jarang", "Kadang", "Sering", "Sangat sering"]}
+
+# What pandas and openpyxl raise for files they can't read: corrupt or
+# truncated archives, broken XML, bad encodings (a ValueError), and so on.
+READ_ERRORS = (ValueError, KeyError, OSError, zipfile.BadZipFile, InvalidFileException, ParseError)
+
+def _text(value) -> str | None:
+    if pd.isna(value):
+        return None
+
+    value = str(value).strip()
+    return value if value != "" else None
+
+def read_workbook(file, name: str) -> tuple[pd.DataFrame, pd.DataFrame | None]:
+    # A CSV file only holds SymptomTable; the hierarchy is then left as is.
+    if name.lower().endswith(".csv"):
+        return pd.read_csv(file), None
+
+    sheets = pd.read_excel(file, sheet_name=None)
+    if "SymptomTable" not in sheets:
+        raise ValueError("Sheet SymptomTable tidak ditemukan.")
+
+    return sheets["SymptomTable"], sheets.get("SubsymptomTable")
+
+def read_import(file, name: str) -> tuple[pd.DataFrame | None, pd.DataFrame | None, list[str]]:
+    # read_workbook and validate for an uploaded file, with a file that can't
+    # be read reported like any other problem.
+    try:
+        symptom_df, subsymptom_df = read_workbook(file, name)
+    except READ_ERRORS as e:
+        return None, None, [f"Berkas tidak dapat dibaca: {e}"]
+
+    return validate(symptom_df, subsymptom_df)
+
+def validate(symptom_df: pd.DataFrame, subsymptom_df: pd.DataFrame | None) -> tuple[pd.DataFrame, pd.DataFrame | None, list[str]]:
+    # Returns the normalized tables and a list of problems; nothing should be
+    # imported unless the list is empty. Row numbers are as shown in Excel.
+    errors = []
+    for df, sheet, columns in ((symptom_df, "SymptomTable", SYMPTOM_COLUMNS), (subsymptom_df, "SubsymptomTable", SUBSYMPTOM_COLUMNS)):
+        if df is not None:
+            missing = [x for x in columns if x not in df.columns]
+            if len(missing) > 0:
+                errors.append(f"{sheet}: kolom {', '.join(missing)} tidak ada.")
+
+    if len(errors) > 0:
+        return symptom_df, subsymptom_df, errors
+
+    rows = []
+    seen = {}
+    for i, (disease, symptom, variant, frequency) in enumerate(zip(*(symptom_df[x] for x in SYMPTOM_COLUMNS))):
+        row_no = i + 2
+        disease, symptom, variant, frequency = _text(disease), _text(symptom), _text(variant), _text(frequency)
+        if disease is None or symptom is None:
+            errors.append(f"SymptomTable baris {row_no}: Penyakit dan Gejala harus diisi.")
+            continue
+
+        if frequency is not None and frequency.lower() not in FREQUENCY_PROB_MAP:
+            errors.append(f"SymptomTable baris {row_no}: frekuensi \"{frequency}\" tidak dikenal.")
+            continue
+
+        if (disease, symptom) in seen:
+            errors.append(f"SymptomTable baris {row_no}: {disease} - {symptom} sudah ada di baris {seen[disease, symptom]}.")
+            continue
+
+        seen[disease, symptom] = row_no
+        rows.append((disease, symptom, variant, FREQUENCY_LABELS[frequency.lower()] if frequency is not None else None))
+
+    symptom_df = pd.DataFrame(rows, columns=SYMPTOM_COLUMNS)
+
+    if subsymptom_df is not None:
+        rows = []
+        parents = {}
+        for i, (parent, variant, subsymptom) in enumerate(zip(*(subsymptom_df[x] for x in SUBSYMPTOM_COLUMNS))):
+            row_no = i + 2
+            parent, variant, subsymptom = _text(parent), _text(variant), _text(subsymptom)
+            if parent is None or subsymptom is None:
+                errors.append(f"SubsymptomTable baris {row_no}: Gejala dan AnakGejala harus diisi.")
+                continue
+
+            if subsymptom in parents:
+                errors.append(f"SubsymptomTable baris {row_no}: {subsymptom} sudah menjadi anak gejala {parents[subsymptom]}.")
+                continue
+
+            parents[subsymptom] = parent
+            rows.append((parent, variant, subsymptom))
+
+        subsymptom_df = pd.DataFrame(rows, columns=SUBSYMPTOM_COLUMNS)
+        hierarchy = SymptomHierarchy(subsymptom_df)
+        for subsymptom in hierarchy.parents:
+            if hierarchy.ancestors(subsymptom) is None:
+                errors.append(f"SubsymptomTable: {subsymptom} berada dalam siklus.")
+
+    return symptom_df, subsymptom_df, errors
+
+class KnowledgeBaseDiff:
+    def __init__(self):
+        self.diseases: set[str] = set()
+        self.symptoms: set[str] = set()
+        self.variants: set[tuple[str, str]] = set()
+
+        # (disease, symptom, variant, frequency) to insert.
+        self.added_links: list[tuple[str, str, str | None, str | None]] = []
+        # (id, disease, frequency) whose frequency changed.
+        self.updated_frequencies: list[tuple] = []
+        # (id, symptom, old variant, new variant) whose variant changed.
+        self.updated_variants: list[tuple] = []
+        self.deleted_links: list = []
+
+        # (parent, variant, subsymptom) to (re)insert; subsymptoms to remove.
+        self.added_subsymptoms: list[tuple[str, str | None, str]] = []
+        self.deleted_subsymptoms: list[str] = []
+
+    def summary(self) -> dict[str, int]:
+        return {
+            "Gejala penyakit baru": len(self.added_links),
+            "Gejala penyakit diubah": len({x[0] for x in self.updated_frequencies} | {x[0] for x in self.updated_variants}),
+            "Gejala penyakit dihapus": len(self.deleted_links),
+            "Anak gejala baru/diubah": len(self.added_subsymptoms),
+            "Anak gejala dihapus": len(set(self.deleted_subsymptoms) - {x[2] for x in self.added_subsymptoms}),
+        }
+
+    def is_empty(self) -> bool:
+        return sum(self.summary().values()) == 0
+
+def diff(current_symptom_df: pd.DataFrame, current_subsymptom_df: pd.DataFrame, symptom_df: pd.DataFrame, subsymptom_df: pd.DataFrame | None) -> KnowledgeBaseDiff:
+    # current_* are as loaded by supabase_loader; the others as returned by
+    # validate.
+    result = KnowledgeBaseDiff()
+    current = {}
+    for id_, disease, symptom, variant, frequency in zip(*(current_symptom_df[x] for x in ["Id"] + SYMPTOM_COLUMNS)):
+        current[disease, symptom] = (id_, variant, frequency)
+
+    for disease, symptom, variant, frequency in zip(*(symptom_df[x] for x in SYMPTOM_COLUMNS)):
+        result.diseases.add(disease)
+        result.symptoms.add(symptom)
+        if variant is not None:
+            result.variants.add((symptom, variant))
+
+        link = current.pop((disease, symptom), None)
+        if link is None:
+            result.added_links.append((disease, symptom, variant, frequency))
+            continue
+
+        id_, old_variant, old_frequency = link
+        if frequency != old_frequency:
+            result.updated_frequencies.append((id_, disease, frequency))
+
+        if variant != old_variant:
+            result.updated_variants.append((id_, symptom, old_variant, variant))
+
+    result.deleted_links = [id_ for id_, _, _ in current.values()]
+
+    if subsymptom_df is not None:
+        current = {}
+        for parent, variant, subsymptom in zip(*(current_subsymptom_df[x] for x in SUBSYMPTOM_COLUMNS)):
+            current[subsymptom] = (parent, variant)
+
+        for parent, variant, subsymptom in zip(*(subsymptom_df[x] for x in SUBSYMPTOM_COLUMNS)):
+            result.symptoms.update((parent, subsymptom))
+            if variant is not None:
+                result.variants.add((parent, variant))
+
+            old = current.pop(subsymptom, None)
+            if old != (parent, variant):
+                if old is not None:
+                    result.deleted_subsymptoms.append(subsymptom)
+
+                result.added_subsymptoms.append((parent, variant, subsymptom))
+
+        result.deleted_subsymptoms += list(current)
+
+    return result
+
+def apply_diff(supabase: Client, result: KnowledgeBaseDiff):
+    # One call to apply_kb_import (sql/007_apply_kb_import.sql), which applies
+    # the whole import in a single transaction.
+    supabase.rpc("apply_kb_import", {"p_diff": {
+        "diseases": sorted(result.diseases),
+        "symptoms": sorted(result.symptoms),
+        "variants": [{"symptom": s, "name": v} for s, v in sorted(result.variants)],
+        "deleted_links": [int(x) for x in result.deleted_links],
+        "deleted_subsymptoms": result.deleted_subsymptoms,
+        "updated_frequencies": [{"id": int(id_), "frequency": frequency} for id_, _, frequency in result.updated_frequencies],
+        "updated_variants": [
+            {"id": int(id_), "symptom": symptom, "old_variant": old, "variant": new}
+            for id_, symptom, old, new in result.updated_variants
+        ],
+        "added_links": [
+            {"disease": disease, "symptom": symptom, "variant": variant, "frequency": frequency}
+            for disease, symptom, variant, frequency in result.added_links
+        ],
+        "added_subsymptoms": [
+            {"parent": parent, "variant": variant, "subsymptom": subsymptom}
+            for parent, variant, subsymptom in result.added_subsymptoms
+        ],
+    }}).execute()
+
+def write_workbook(symptom_df: pd.DataFrame, subsymptom_df: pd.DataFrame, file=None):
+    # Streams rows into a write-only workbook, which doesn't keep cells in
+    # memory. Writes to file if given, otherwise returns the bytes.
+    workbook = Workbook(write_only=True)
+    for sheet, df, columns in (("SymptomTable", symptom_df, SYMPTOM_COLUMNS), ("SubsymptomTable", subsymptom_df, SUBSYMPTOM_COLUMNS)):
+        worksheet = workbook.create_sheet(sheet)
+        worksheet.append(columns)
+        for row in zip(*(df[x] for x in columns)):
+            worksheet.append([None if pd.isna(x) else x for x in row])
+
+    if file is not None:
+        workbook.save(file)
+        return None
+
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+def export_workbook(supabase: Client) -> bytes:
+    result = fetch_concurrently({
+        "disease_symptoms": lambda: fetch_disease_symptoms(supabase),
+        "subsymptoms": lambda: fetch_subsymptoms(supabase),
+    })
+    return write_workbook(result["disease_symptoms"], result["subsymptoms"])
@@ -0,0 +1,136 @@
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+from typing import Callable
+
+import numpy as np
+
+from experiment_3 import KnowledgeBase, ScoringCancelled, score_symptoms
+
+# Knowledge bases that a worker process keeps resident, most recently used
+# last. Tasks only carry the version, the posterior and the candidate ids; a
+# version the worker doesn't have is sent to it once.
+WORKER_KNOWLEDGE_BASES = 4
+_knowledge_bases: OrderedDict[str, KnowledgeBase] = OrderedDict()
+
+class _UnknownKnowledgeBase(Exception):
+    pass
+
+def _load_knowledge_base(knowledge_base: KnowledgeBase | str):
+    # A snapshot path is mapped rather than unpickled, so all workers share
+    # the knowledge base's pages.
+    if isinstance(knowledge_base, str):
+        from kb_snapshot import load_snapshot
+        knowledge_base = load_snapshot(knowledge_base)
+
+    _knowledge_bases[knowledge_base.version] = knowledge_base
+    _knowledge_bases.move_to_end(knowledge_base.version)
+    while len(_knowledge_bases) > WORKER_KNOWLEDGE_BASES:
+        _knowledge_bases.popitem(last=False)
+
+def _init_worker(knowledge_base: KnowledgeBase | str | None):
+    if knowledge_base is not None:
+        _load_knowledge_base(knowledge_base)
+
+def _score_chunk(
+    version: str,
+    disease_probs: np.ndarray,
+    symptom_ids: list[int],
+    active: np.ndarray | None,
+    knowledge_base: KnowledgeBase | str | None = None
+):
+    if knowledge_base is not None:
+        _load_knowledge_base(knowledge_base)
+
+    if version not in _knowledge_bases:
+        raise _UnknownKnowledgeBase(version)
+
+    _knowledge_bases.move_to_end(version)
+    return score_symptoms(_knowledge_bases[version], disease_probs, symptom_ids, active)
+
+class ScoringPool:
+    # Worker processes that score candidate symptoms for any number of
+    # UnnamedState objects. Workers load each knowledge base version the first
+    # time they are asked about it, so sessions on an older version keep
+    # working after a reload. Large candidate lists are split across workers.
+    def __init__(self, knowledge_base: KnowledgeBase | None = None, max_workers: int | None = None, min_symptoms_per_task: int = 64):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.min_symptoms_per_task = min_symptoms_per_task
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=((knowledge_base.snapshot_path or knowledge_base) if knowledge_base is not None else None,)
+        )
+
+    def score(
+        self,
+        knowledge_base: KnowledgeBase,
+        disease_probs: np.ndarray,
+        symptom_ids: list[int],
+        active: np.ndarray | None = None,
+        should_cancel: Callable[[], bool] | None = None
+    ):
+        # Same result as experiment_3.score_symptoms. should_cancel is polled
+        # while the chunks run; once it returns True (e.g. on a Streamlit
+        # rerun) the chunks that haven't started are cancelled and
+        # ScoringCancelled is raised right away. A chunk that is already
+        # running is one array pass and can't be interrupted; it finishes in
+        # its worker and the result is dropped.
+        n_tasks = max(1, min(self.max_workers, len(symptom_ids) // self.min_symptoms_per_task))
+        chunks = [x.tolist() for x in np.array_split(np.asarray(symptom_ids, dtype=int), n_tasks)]
+
+        # A snapshot directory can be deleted once a newer one is saved
+        # (kb_snapshot.remove_older_snapshots); workers then get the
+        # knowledge base itself.
+        snapshot_path = knowledge_base.snapshot_path
+        if snapshot_path is not None and not os.path.exists(snapshot_path):
+            snapshot_path = None
+
+        def submit(chunk, payload=None):
+            return self._executor.submit(_score_chunk, knowledge_base.version, disease_probs, chunk, active, payload)
+
+        futures = [submit(chunk) for chunk in chunks]
+        try:
+            pending = set(futures)
+            while len(pending) > 0:
+                if should_cancel is not None and should_cancel():
+                    raise ScoringCancelled()
+
+                done, pending = wait(pending, timeout=0.05, return_when=FIRST_EXCEPTION)
+                for future in done:
+                    if isinstance(future.exception(), _UnknownKnowledgeBase):
+                        # The worker hasn't seen this version yet.
+                        i = futures.index(future)
+                        futures[i] = submit(chunks[i], snapshot_path or knowledge_base)
+                        pending.add(futures[i])
+                    elif future.exception() is not None:
+                        raise future.exception()
+
+            results = [future.result() for future in futures]
+
+        finally:
+            for future in futures:
+                future.cancel()
+
+        expected = np.concatenate([x[0] for x in results])
+        entropies = np.concatenate([x[1] for x in results])
+        return expected, entropies
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+_shared_pool: ScoringPool | None = None
+_shared_pool_lock = threading.Lock()
+
+def get_shared_scoring_pool(knowledge_base: KnowledgeBase, max_workers: int | None = None) -> ScoringPool:
+    # One pool per process, for every knowledge base version. It is never shut
+    # down here, since sessions started on an older version still hold it.
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = ScoringPool(knowledge_base, max_workers)
+
+        return _shared_pool
@@ -0,0 +1,274 @@
+import argparse
+import asyncio
+import json
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from experiment_3 import KnowledgeBase, UnnamedState
+from kb_snapshot import load_excel_knowledge_base
+from scoring_pool import get_shared_scoring_pool
+
+# JSON over HTTP/1.1 with keep-alive, for clients that don't go through
+# Streamlit. Engine calls run in an executor so the event loop only does I/O.
+#
+#   POST   /sessions                     start a session, returns the first question
+#   GET    /sessions/{id}/question       current question
+#   POST   /sessions/{id}/answer         {"exists": bool, "variant": str | null}
+#   POST   /sessions/{id}/skip
+#   GET    /sessions/{id}/predictions
+#   DELETE /sessions/{id}
+
+MAX_QUESTIONS = 10
+MAX_BODY_SIZE = 64 * 1024
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+class Session:
+    def __init__(self, state: UnnamedState):
+        self.state = state
+        self.question_no = 1
+        self.asked_symptom: str | None = None
+        self.possibilities: list[tuple[bool, str | None, float]] = []
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+    def update_question(self):
+        # Same as update_asked_symptom_and_answer_possibilities in app.py.
+        self.asked_symptom = self.state.get_best_symptom_to_ask()
+        if self.asked_symptom is not None and self.question_no <= MAX_QUESTIONS:
+            self.possibilities = self.state.get_possibilities(self.asked_symptom)
+        else:
+            self.possibilities = []
+
+    def question(self) -> dict:
+        if len(self.possibilities) == 0:
+            return {"done": True, "question_no": self.question_no}
+
+        return {
+            "done": False,
+            "question_no": self.question_no,
+            "symptom": self.asked_symptom,
+            "possibilities": [{"exists": exists, "variant": variant} for exists, variant, _ in self.possibilities],
+        }
+
+class DiagnosisService:
+    def __init__(self, knowledge_base: KnowledgeBase, workers: int = 4, scoring_workers: int = 0, session_ttl: float = 3600.0):
+        self.knowledge_base = knowledge_base
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.scoring_pool = get_shared_scoring_pool(knowledge_base, scoring_workers) if scoring_workers > 0 else None
+        self.session_ttl = session_ttl
+        self.sessions: dict[str, Session] = {}
+
+    async def run_engine(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    def get_session(self, session_id: str) -> Session:
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Unknown session.")
+
+        session.last_used = time.monotonic()
+        return session
+
+    def expire_sessions(self):
+        now = time.monotonic()
+        for session_id in [k for k, v in self.sessions.items() if now - v.last_used > self.session_ttl]:
+            del self.sessions[session_id]
+
+    async def start_session(self) -> dict:
+        session = Session(UnnamedState(self.knowledge_base, scoring_pool=self.scoring_pool))
+        await self.run_engine(session.update_question)
+        session_id = uuid.uuid4().hex
+        self.sessions[session_id] = session
+        return {"session_id": session_id, **session.question()}
+
+    async def answer(self, session: Session, body: dict) -> dict:
+        if len(session.possibilities) == 0:
+            raise HTTPError(HTTPStatus.CONFLICT, "Session is finished.")
+
+        exists = body.get("exists")
+        variant = body.get("variant")
+        if not any(exists == x and variant == y for x, y, _ in session.possibilities):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Not a possible answer to the current question.")
+
+        def apply():
+            session.state.answer(session.asked_symptom, exists, variant)
+            session.question_no += 1
+            session.update_question()
+
+        await self.run_engine(apply)
+        return session.question()
+
+    async def skip(self, session: Session) -> dict:
+        if len(session.possibilities) == 0:
+            raise HTTPError(HTTPStatus.CONFLICT, "Session is finished.")
+
+        def apply():
+            session.state.skip(session.asked_symptom)
+            session.question_no += 1
+            session.update_question()
+
+        await self.run_engine(apply)
+        return session.question()
+
+    async def route(self, method: str, path: str, body: dict) -> tuple[HTTPStatus, dict]:
+        parts = [x for x in path.split("?", 1)[0].split("/") if x]
+        if parts == ["sessions"] and method == "POST":
+            self.expire_sessions()
+            return HTTPStatus.CREATED, await self.start_session()
+
+        if len(parts) < 2 or parts[0] != "sessions":
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Not found.")
+
+        session = self.get_session(parts[1])
+        action = parts[2] if len(parts) == 3 else None
+        if len(parts) > 3:
+            raise HTTPError(HTTPStatus.NOT_FOUND, "Not found.")
+
+        if action is None and method == "DELETE":
+            # Another DELETE or expire_sessions may have got there first.
+            self.sessions.pop(parts[1], None)
+            return HTTPStatus.OK, {}
+
+        async with session.lock:
+            if action == "question" and method == "GET":
+                return HTTPStatus.OK, session.question()
+            elif action == "answer" and method == "POST":
+                return HTTPStatus.OK, await self.answer(session, body)
+            elif action == "skip" and method == "POST":
+                return HTTPStatus.OK, await self.skip(session)
+            elif action == "predictions" and method == "GET":
+                return HTTPStatus.OK, session.state.get_predictions()
+
+        raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, "Method not allowed.")
+
+    async def read_request_head(self, reader: asyncio.StreamReader) -> tuple[str, str, str, dict[str, str]] | None:
+        # (method, path, version, headers), or None once the client has
+        # closed the connection.
+        try:
+            request_line = await reader.readline()
+            if not request_line:
+                return None
+
+            try:
+                method, path, version = request_line.decode("latin-1").split()
+            except ValueError:
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "Bad request line.")
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+        except (ValueError, asyncio.LimitOverrunError):
+            # readline raises these for lines longer than the stream's limit.
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Request line or header too long.")
+
+        return method, path, version, headers
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            keep_alive = True
+            while keep_alive:
+                # Any error before the body has been read leaves the stream
+                # out of step with the requests, so the connection is closed.
+                try:
+                    head = await self.read_request_head(reader)
+                    if head is None:
+                        break
+
+                    method, path, version, headers = head
+                    try:
+                        content_length = int(headers.get("content-length", "0"))
+                    except ValueError:
+                        content_length = -1
+
+                    if content_length < 0:
+                        raise HTTPError(HTTPStatus.BAD_REQUEST, "Bad Content-Length.")
+
+                    if content_length > MAX_BODY_SIZE:
+                        raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Body too large.")
+
+                except HTTPError as e:
+                    await self.write_response(writer, e.status, {"error": e.message}, False)
+                    break
+
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+
+                try:
+                    raw_body = await reader.readexactly(content_length) if content_length > 0 else b""
+                    try:
+                        body = json.loads(raw_body) if raw_body else {}
+                    except json.JSONDecodeError:
+                        raise HTTPError(HTTPStatus.BAD_REQUEST, "Body is not valid JSON.")
+
+                    if not isinstance(body, dict):
+                        raise HTTPError(HTTPStatus.BAD_REQUEST, "Body must be a JSON object.")
+
+                    status, payload = await self.route(method.upper(), path, body)
+
+                except HTTPError as e:
+                    status, payload = e.status, {"error": e.message}
+                except ValueError as e:
+                    status, payload = HTTPStatus.UNPROCESSABLE_ENTITY, {"error": str(e)}
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    raise
+                except Exception:
+                    # Whatever went wrong, the client still gets an answer.
+                    traceback.print_exc()
+                    status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "Internal server error."}
+
+                await self.write_response(writer, status, payload, keep_alive)
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def write_response(self, writer: asyncio.StreamWriter, status: HTTPStatus, payload: dict, keep_alive: bool):
+        body = json.dumps(payload).encode()
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+            "\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+async def serve(service: DiagnosisService, host: str, port: int):
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the diagnosis engine over HTTP.")
+    parser.add_argument("--data", default="data.xlsx", help="Excel file with SymptomTable and SubsymptomTable sheets.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=4, help="Threads running engine calls.")
+    parser.add_argument("--scoring-workers", type=int, default=0, help="Processes for candidate scoring (0 to score in the engine threads).")
+    parser.add_argument("--opening-book-depth", type=int, default=3)
+    parser.add_argument("--snapshot-dir", help="Where compiled snapshots of --data are kept (default: .kb_snapshots next to it).")
+    args = parser.parse_args()
+
+    knowledge_base = load_excel_knowledge_base(args.data, args.snapshot_dir, args.opening_book_depth)
+
+    service = DiagnosisService(knowledge_base, args.workers, args.scoring_workers)
+    asyncio.run(serve(service, args.host, args.port))
+
+if __name__ == "__main__":
+    main()
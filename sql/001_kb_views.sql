@@ -0,0 +1,18 @@
+-- One view per dataset the engine loads, so each is a single paginated
+-- select instead of one select per underlying table.
+
+create or replace view kb_disease_symptoms with (security_invoker = true) as
+    select ds.id, ds.disease, vf.symptom, null::text as variant, ds.frequency
+    from disease_symptoms ds
+    join disease_variant_free_symptoms vf on vf.id = ds.id
+    union all
+    select ds.id, ds.disease, vs.symptom, vs.variant, ds.frequency
+    from disease_symptoms ds
+    join disease_variant_specific_symptoms vs on vs.id = ds.id;
+
+create or replace view kb_subsymptoms with (security_invoker = true) as
+    select subsymptom, parent, null::text as parent_variant
+    from variant_free_subsymptoms
+    union all
+    select subsymptom, parent, parent_variant
+    from variant_specific_subsymptoms;
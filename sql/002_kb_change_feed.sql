@@ -0,0 +1,23 @@
+-- Publishes row changes of the knowledge base tables to Supabase Realtime,
+-- for kb_changes.RealtimeChangeSource. Full replica identity makes deletes
+-- and updates carry the old row, which the subscriber needs to find what
+-- changed.
+
+alter table diseases replica identity full;
+alter table symptoms replica identity full;
+alter table disease_symptoms replica identity full;
+alter table disease_variant_free_symptoms replica identity full;
+alter table disease_variant_specific_symptoms replica identity full;
+alter table subsymptoms replica identity full;
+alter table variant_free_subsymptoms replica identity full;
+alter table variant_specific_subsymptoms replica identity full;
+
+alter publication supabase_realtime add table
+    diseases,
+    symptoms,
+    disease_symptoms,
+    disease_variant_free_symptoms,
+    disease_variant_specific_symptoms,
+    subsymptoms,
+    variant_free_subsymptoms,
+    variant_specific_subsymptoms;
@@ -0,0 +1,31 @@
+-- Rejects subsymptom edges that would make the parent chain loop. The app
+-- checks this against its cached hierarchy; this covers writes made from a
+-- stale one.
+
+create or replace function check_subsymptom_cycle() returns trigger
+language plpgsql as $$
+begin
+    if exists (
+        with recursive ancestors(name) as (
+            select new.parent
+            union
+            select h.parent
+            from kb_subsymptoms h
+            join ancestors a on h.subsymptom = a.name
+        )
+        select 1 from ancestors where name = new.subsymptom
+    ) then
+        raise exception 'Adding % under % would create a cycle', new.subsymptom, new.parent;
+    end if;
+
+    return new;
+end;
+$$;
+
+create trigger variant_free_subsymptoms_no_cycle
+    before insert or update on variant_free_subsymptoms
+    for each row execute function check_subsymptom_cycle();
+
+create trigger variant_specific_subsymptoms_no_cycle
+    before insert or update on variant_specific_subsymptoms
+    for each row execute function check_subsymptom_cycle();
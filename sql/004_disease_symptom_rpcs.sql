@@ -0,0 +1,49 @@
+-- Atomic versions of the admin edits that touch several tables. Each is one
+-- round trip and runs in a single transaction, so the knowledge base is
+-- never seen half-updated. A null variant means variant-free; an empty
+-- frequency means unspecified.
+
+create or replace function add_disease_symptom(p_disease text, p_symptom text, p_variant text, p_frequency text)
+returns disease_symptoms.id%type
+language plpgsql as $$
+declare
+    new_id disease_symptoms.id%type;
+begin
+    insert into symptoms (name) values (p_symptom) on conflict (name) do nothing;
+    if p_variant is not null then
+        insert into symptom_variants (symptom, name) values (p_symptom, p_variant) on conflict do nothing;
+    end if;
+
+    insert into disease_symptoms (disease, frequency)
+    values (p_disease, coalesce(p_frequency, ''))
+    returning id into new_id;
+
+    if p_variant is null then
+        insert into disease_variant_free_symptoms (id, symptom) values (new_id, p_symptom);
+    else
+        insert into disease_variant_specific_symptoms (id, symptom, variant) values (new_id, p_symptom, p_variant);
+    end if;
+
+    return new_id;
+end;
+$$;
+
+create or replace function edit_disease_symptom(p_id disease_symptoms.id%type, p_symptom text, p_variant text, p_frequency text)
+returns disease_symptoms.id%type
+language plpgsql as $$
+begin
+    if p_variant is null then
+        delete from disease_variant_specific_symptoms where id = p_id;
+        insert into disease_variant_free_symptoms (id, symptom) values (p_id, p_symptom)
+        on conflict (id) do nothing;
+    else
+        insert into symptom_variants (symptom, name) values (p_symptom, p_variant) on conflict do nothing;
+        delete from disease_variant_free_symptoms where id = p_id;
+        insert into disease_variant_specific_symptoms (id, symptom, variant) values (p_id, p_symptom, p_variant)
+        on conflict (id) do update set variant = excluded.variant;
+    end if;
+
+    update disease_symptoms set frequency = coalesce(p_frequency, '') where id = p_id;
+    return p_id;
+end;
+$$;
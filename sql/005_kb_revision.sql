@@ -0,0 +1,40 @@
+-- A counter that moves on every write to the tables behind the kb_* views,
+-- so a process can tell whether its on-disk snapshot of the compiled
+-- knowledge base (kb_snapshot.load_source_knowledge_base) is still current
+-- with one single-row select instead of loading the views. Renames of
+-- diseases and symptoms reach these tables through their foreign keys.
+
+create table if not exists kb_revision (
+    id int primary key default 1 check (id = 1),
+    revision bigint not null default 0
+);
+
+insert into kb_revision (id, revision) values (1, 0) on conflict (id) do nothing;
+
+create or replace function bump_kb_revision() returns trigger
+language plpgsql as $$
+begin
+    update kb_revision set revision = revision + 1 where id = 1;
+    return null;
+end;
+$$;
+
+create trigger disease_symptoms_kb_revision
+    after insert or update or delete or truncate on disease_symptoms
+    for each statement execute function bump_kb_revision();
+
+create trigger disease_variant_free_symptoms_kb_revision
+    after insert or update or delete or truncate on disease_variant_free_symptoms
+    for each statement execute function bump_kb_revision();
+
+create trigger disease_variant_specific_symptoms_kb_revision
+    after insert or update or delete or truncate on disease_variant_specific_symptoms
+    for each statement execute function bump_kb_revision();
+
+create trigger variant_free_subsymptoms_kb_revision
+    after insert or update or delete or truncate on variant_free_subsymptoms
+    for each statement execute function bump_kb_revision();
+
+create trigger variant_specific_subsymptoms_kb_revision
+    after insert or update or delete or truncate on variant_specific_subsymptoms
+    for each statement execute function bump_kb_revision();
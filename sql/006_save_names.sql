@@ -0,0 +1,39 @@
+-- Saves an admin data editor diff of the diseases or symptoms list
+-- (kb_admin.save_name_changes) in one round trip and one transaction:
+-- deletes, then renames, then upserts. Renames reach the tables that refer
+-- to a name through their foreign keys.
+
+create or replace function save_names(p_table text, p_deleted text[], p_renamed jsonb, p_upserted jsonb)
+returns void
+language plpgsql as $$
+declare
+    renamed jsonb;
+    i bigint;
+begin
+    if p_table not in ('diseases', 'symptoms') then
+        raise exception 'save_names: unknown table %', p_table;
+    end if;
+
+    execute format('delete from %I where name = any($1)', p_table) using coalesce(p_deleted, '{}');
+
+    -- Through a temporary name first, so two rows can swap names.
+    for renamed, i in select * from jsonb_array_elements(coalesce(p_renamed, '[]')) with ordinality
+    loop
+        execute format('update %I set name = $1 where name = $2', p_table)
+        using 'save_names ' || txid_current() || ' ' || i, renamed->>'old_name';
+    end loop;
+
+    for renamed, i in select * from jsonb_array_elements(coalesce(p_renamed, '[]')) with ordinality
+    loop
+        execute format('update %I set name = $1, description = $2 where name = $3', p_table)
+        using renamed->>'name', renamed->>'description', 'save_names ' || txid_current() || ' ' || i;
+    end loop;
+
+    execute format(
+        'insert into %I (name, description)
+         select x->>''name'', x->>''description'' from jsonb_array_elements($1) x
+         on conflict (name) do update set description = excluded.description',
+        p_table
+    ) using coalesce(p_upserted, '[]');
+end;
+$$;
@@ -0,0 +1,79 @@
+-- Applies a bulk import (kb_transfer.apply_diff) in one round trip and one
+-- transaction, so a failed import leaves the knowledge base as it was and
+-- readers never see half of one. p_diff holds the lists of
+-- kb_transfer.KnowledgeBaseDiff as JSON. New disease symptoms go through
+-- add_disease_symptom (sql/004_disease_symptom_rpcs.sql), so each gets its
+-- own id back instead of relying on the order of a bulk insert.
+
+create or replace function apply_kb_import(p_diff jsonb)
+returns void
+language plpgsql as $$
+declare
+    link jsonb;
+begin
+    -- Referenced names first, so every foreign key exists when it is needed.
+    insert into diseases (name)
+    select jsonb_array_elements_text(p_diff->'diseases')
+    on conflict do nothing;
+
+    insert into symptoms (name)
+    select jsonb_array_elements_text(p_diff->'symptoms')
+    on conflict do nothing;
+
+    insert into symptom_variants (symptom, name)
+    select x->>'symptom', x->>'name' from jsonb_array_elements(p_diff->'variants') x
+    on conflict do nothing;
+
+    delete from disease_symptoms
+    where id in (select (jsonb_array_elements_text(p_diff->'deleted_links'))::bigint);
+
+    delete from subsymptoms
+    where subsymptom in (select jsonb_array_elements_text(p_diff->'deleted_subsymptoms'));
+
+    update disease_symptoms d
+    set frequency = coalesce(x->>'frequency', '')
+    from jsonb_array_elements(p_diff->'updated_frequencies') x
+    where d.id = (x->>'id')::bigint;
+
+    -- A variant change may move a row between the variant-free and the
+    -- variant-specific table.
+    delete from disease_variant_free_symptoms
+    where id in (
+        select (x->>'id')::bigint from jsonb_array_elements(p_diff->'updated_variants') x
+        where x->>'old_variant' is null
+    );
+
+    delete from disease_variant_specific_symptoms
+    where id in (
+        select (x->>'id')::bigint from jsonb_array_elements(p_diff->'updated_variants') x
+        where x->>'old_variant' is not null and x->>'variant' is null
+    );
+
+    insert into disease_variant_free_symptoms (id, symptom)
+    select (x->>'id')::bigint, x->>'symptom' from jsonb_array_elements(p_diff->'updated_variants') x
+    where x->>'variant' is null
+    on conflict (id) do update set symptom = excluded.symptom;
+
+    insert into disease_variant_specific_symptoms (id, symptom, variant)
+    select (x->>'id')::bigint, x->>'symptom', x->>'variant' from jsonb_array_elements(p_diff->'updated_variants') x
+    where x->>'variant' is not null
+    on conflict (id) do update set symptom = excluded.symptom, variant = excluded.variant;
+
+    for link in select * from jsonb_array_elements(p_diff->'added_links')
+    loop
+        perform add_disease_symptom(link->>'disease', link->>'symptom', link->>'variant', link->>'frequency');
+    end loop;
+
+    insert into subsymptoms (subsymptom)
+    select x->>'subsymptom' from jsonb_array_elements(p_diff->'added_subsymptoms') x
+    on conflict do nothing;
+
+    insert into variant_free_subsymptoms (subsymptom, parent)
+    select x->>'subsymptom', x->>'parent' from jsonb_array_elements(p_diff->'added_subsymptoms') x
+    where x->>'variant' is null;
+
+    insert into variant_specific_subsymptoms (subsymptom, parent, parent_variant)
+    select x->>'subsymptom', x->>'parent', x->>'variant' from jsonb_array_elements(p_diff->'added_subsymptoms') x
+    where x->>'variant' is not null;
+end;
+$$;
@@ -0,0 +1,109 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Iterator
+
+import pandas as pd
+from postgrest.types import CountMethod
+from supabase import Client
+
+import instrumentation
+
+# Loads the knowledge base through the views in sql/001_kb_views.sql. Pages
+# are fetched by keyset (key > last key seen) rather than offset, and the
+# loader keeps going until it has the row count PostgREST reported, so a
+# server-side max-rows cap smaller than page_size can't truncate the result.
+
+PAGE_SIZE = 1000
+
+# Shared by every caller in the process. The supabase client's HTTP session
+# is thread-safe and keeps its connections alive, so concurrent fetches reuse
+# them instead of opening new ones.
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="supabase")
+
+class FetchError(Exception):
+    # Every fetch of a fetch_concurrently call that failed, by key.
+    def __init__(self, errors: dict[str, BaseException]):
+        super().__init__(", ".join(f"{k}: {v!r}" for k, v in errors.items()))
+        self.errors = errors
+
+def fetch_concurrently(functions: dict[str, Callable]) -> dict:
+    # Runs independent fetches at the same time, so the wall time is that of
+    # the slowest one. Spans and counters still go to the caller's recorder.
+    # If any fail, the others are still waited for and FetchError names each
+    # failure by its key.
+    futures = {k: _executor.submit(instrumentation.bind_thread_recorder(v)) for k, v in functions.items()}
+    wait(futures.values())
+    errors = {k: v.exception() for k, v in futures.items() if v.exception() is not None}
+    if len(errors) > 0:
+        raise FetchError(errors) from next(iter(errors.values()))
+
+    return {k: v.result() for k, v in futures.items()}
+
+def fetch_pages(supabase: Client, view: str, columns: list[str], key: str, page_size: int = PAGE_SIZE) -> Iterator[list[dict]]:
+    total = None
+    loaded = 0
+    last_key = None
+    while total is None or loaded < total:
+        query = supabase.table(view).select(*columns, count=CountMethod.exact if total is None else None)
+        if last_key is not None:
+            query = query.gt(key, last_key)
+
+        response = query.order(key).limit(page_size).execute()
+        if total is None:
+            total = response.count
+
+        if len(response.data) == 0:
+            break
+
+        loaded += len(response.data)
+        last_key = response.data[-1][key]
+        yield response.data
+
+def fetch_columns(supabase: Client, view: str, columns: list[str], key: str, page_size: int = PAGE_SIZE) -> dict[str, list]:
+    data = {x: [] for x in columns}
+    pages = 0
+    with instrumentation.span("load_view", view=view):
+        for rows in fetch_pages(supabase, view, columns, key, page_size):
+            pages += 1
+            for x in columns:
+                data[x].extend([row[x] for row in rows])
+
+    instrumentation.count(f"rows_loaded.{view}", len(data[key]))
+    instrumentation.count(f"pages_loaded.{view}", pages)
+    return data
+
+def fetch_disease_symptoms(supabase: Client, page_size: int = PAGE_SIZE) -> pd.DataFrame:
+    data = fetch_columns(supabase, "kb_disease_symptoms", ["id", "disease", "symptom", "variant", "frequency"], "id", page_size)
+    return pd.DataFrame({
+        "Id": data["id"],
+        "Penyakit": data["disease"],
+        "Gejala": data["symptom"],
+        "Variasi": data["variant"],
+        "Frekuensi": [x if x else None for x in data["frequency"]],
+    })
+
+def fetch_subsymptoms(supabase: Client, page_size: int = PAGE_SIZE) -> pd.DataFrame:
+    # A symptom has at most one parent, so subsymptom is a key of the view.
+    data = fetch_columns(supabase, "kb_subsymptoms", ["subsymptom", "parent", "parent_variant"], "subsymptom", page_size)
+    return pd.DataFrame({
+        "Gejala": data["parent"],
+        "Variasi": data["parent_variant"],
+        "AnakGejala": data["subsymptom"],
+    })
+
+def fetch_descriptions(supabase: Client, page_size: int = PAGE_SIZE) -> tuple[dict[str, str], dict[str, str]]:
+    result = fetch_concurrently({
+        "symptoms": lambda: fetch_columns(supabase, "symptoms", ["name", "description"], "name", page_size),
+        "diseases": lambda: fetch_columns(supabase, "diseases", ["name", "description"], "name", page_size),
+    })
+    symptoms = result["symptoms"]
+    diseases = result["diseases"]
+    return (
+        dict(zip(symptoms["name"], symptoms["description"])),
+        dict(zip(diseases["name"], diseases["description"])),
+    )
+
+def fetch_kb_revision(supabase: Client) -> int:
+    # Moves on every write to the tables behind the views
+    # (sql/005_kb_revision.sql).
+    response = supabase.table("kb_revision").select("revision").eq("id", 1).execute()
+    return response.data[0]["revision"]
@@ -0,0 +1,209 @@
+import math
+import random
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmark.synthetic import generate_knowledge_base
+from experiment_3 import KnowledgeBase, SymptomHierarchy, TranspositionTable, UnnamedState, argmax_first, predict_batch
+
+def test_argmax_first_keeps_first_of_tied_scores():
+    assert argmax_first({"a": 1.0, "b": 1.0 + 1e-15, "c": 0.5}) == "a"
+    assert argmax_first({"a": 1.0, "b": 2.0}) == "b"
+
+def test_best_symptom_breaks_exact_ties_in_asking_order():
+    # Every symptom is linked to its own disease with the same frequency, so
+    # under the uniform prior they are all exactly tied.
+    for n in range(2, 12):
+        for frequency in ["Jarang", "Kadang", "Sering", "Sangat sering"]:
+            symptom_df = pd.DataFrame({
+                "Penyakit": [f"Penyakit {i}" for i in range(n)],
+                "Gejala": [f"Gejala {i}" for i in range(n)],
+                "Variasi": [None] * n,
+                "Frekuensi": [frequency] * n
+            })
+            state = UnnamedState(symptom_df, transposition_table=None)
+            assert state.get_best_symptom_to_ask() == "Gejala 0"
+
+def test_plan_best_symptom_to_ask_stays_within_time_budget():
+    knowledge_base = KnowledgeBase(*generate_knowledge_base(n_diseases=400, n_symptoms=800, seed=1))
+    for time_budget in [0.1, 0.25]:
+        state = UnnamedState(knowledge_base, transposition_table=None)
+        start = time.perf_counter()
+        best_symptom = state.plan_best_symptom_to_ask(depth=4, time_budget=time_budget)
+        elapsed = time.perf_counter() - start
+
+        assert best_symptom is not None
+        assert elapsed <= time_budget + 0.05
+
+def test_opening_book_entries_match_a_fresh_selection():
+    symptom_df, subsymptom_df = generate_knowledge_base(n_diseases=15, n_symptoms=30, hierarchy_depth=3, seed=3)
+    knowledge_base = KnowledgeBase(symptom_df, subsymptom_df, opening_book_depth=3)
+    plain = KnowledgeBase(symptom_df, subsymptom_df)
+    assert len(knowledge_base.opening_book) > 0
+
+    for (history_key, contexts), best_symptom in knowledge_base.opening_book.items():
+        state = UnnamedState(plain, transposition_table=None)
+        for symptom, exists, variant, skip in history_key:
+            if skip:
+                state.skip(symptom)
+            else:
+                state.answer(symptom, exists, variant)
+
+        state.contexts = list(contexts)
+        assert state.get_best_symptom_to_ask() == best_symptom
+
+def answer_greedily(states: list[UnnamedState], n_questions: int, seed: int):
+    # Asks the first state's questions with random answers and gives every
+    # state the same answers.
+    r = random.Random(seed)
+    for _ in range(n_questions):
+        symptom = states[0].get_best_symptom_to_ask()
+        if symptom is None:
+            break
+
+        possibilities = states[0].get_possibilities(symptom)
+        if r.random() < 0.2:
+            for state in states:
+                state.skip(symptom)
+        else:
+            exists, variant, _ = r.choice(possibilities)
+            for state in states:
+                state.answer(symptom, exists, variant)
+
+def test_log_space_and_pruning_keep_the_linear_posterior():
+    knowledge_base = KnowledgeBase(*generate_knowledge_base(n_diseases=30, n_symptoms=60, seed=4))
+    for seed in range(5):
+        linear = UnnamedState(knowledge_base, transposition_table=None)
+        others = [
+            UnnamedState(knowledge_base, log_space=True, transposition_table=None),
+            UnnamedState(knowledge_base, prune_below=0.01, transposition_table=None),
+            UnnamedState(knowledge_base, top_k=5, transposition_table=None),
+        ]
+        answer_greedily([linear] + others, 8, seed)
+
+        expected = linear.get_predictions()
+        for state in others:
+            np.testing.assert_allclose(state.disease_probs, linear.disease_probs, rtol=1e-9, atol=1e-12)
+
+            predictions = state.get_predictions()
+            assert [x["name"] for x in predictions["diseases"]] == [x["name"] for x in expected["diseases"]]
+            np.testing.assert_allclose([x["prob"] for x in predictions["diseases"]], [x["prob"] for x in expected["diseases"]], rtol=1e-9, atol=1e-12)
+            assert math.isclose(predictions["no_disease_prob"], expected["no_disease_prob"], rel_tol=1e-9, abs_tol=1e-12)
+            assert math.isclose(predictions["entropy"], expected["entropy"], rel_tol=1e-9, abs_tol=1e-12)
+
+def test_transposition_table_evicts_least_recently_used():
+    table = TranspositionTable(max_entries=2)
+    table.put("a", "Gejala 1", [])
+    table.put("b", "Gejala 2", [])
+    assert table.get("a") == ("Gejala 1", [])
+
+    # "b" is now the least recently used.
+    table.put("c", "Gejala 3", [])
+    assert table.get("b") is None
+    assert table.get("a") == ("Gejala 1", [])
+    assert table.get("c") == ("Gejala 3", [])
+
+    assert table.stats() == {"entries": 2, "max_entries": 2, "hits": 3, "misses": 1, "hit_rate": 0.75}
+
+    table.clear()
+    assert table.stats()["entries"] == 0
+    assert table.stats()["hits"] == 0
+
+def test_transposition_table_is_shared_between_sessions():
+    knowledge_base = KnowledgeBase(*generate_knowledge_base(n_diseases=10, n_symptoms=20, seed=6))
+    table = TranspositionTable()
+    first = UnnamedState(knowledge_base, transposition_table=table)
+    best_symptom = first.get_best_symptom_to_ask()
+    assert table.stats()["misses"] == 1
+
+    second = UnnamedState(knowledge_base, transposition_table=table)
+    assert second.get_best_symptom_to_ask() == best_symptom
+    assert table.stats()["hits"] == 1
+
+    # Other options are other entries.
+    UnnamedState(knowledge_base, top_k=3, transposition_table=table).get_best_symptom_to_ask()
+    assert table.stats()["misses"] == 2
+
+def test_predict_batch_matches_answering_one_by_one():
+    knowledge_base = KnowledgeBase(*generate_knowledge_base(n_diseases=20, n_symptoms=40, seed=7))
+    r = random.Random(7)
+    answers = []
+    for _ in range(30):
+        patient_answers = {}
+        for symptom in r.sample(list(knowledge_base.symptom_names), r.randint(0, 8)):
+            if r.random() < 0.2:
+                patient_answers[symptom] = {"skip": True}
+            else:
+                exists, variant, _ = r.choice(knowledge_base.get_possibilities(symptom))
+                patient_answers[symptom] = {"exists": exists, "variant": variant}
+
+        answers.append(patient_answers)
+
+    # A small batch_size also covers answers split over several batches.
+    results = predict_batch(knowledge_base, answers, batch_size=7)
+    assert len(results) == len(answers)
+    for patient_answers, result in zip(answers, results):
+        state = UnnamedState(knowledge_base, transposition_table=None)
+        for symptom, answer in patient_answers.items():
+            if answer.get("skip", False):
+                state.skip(symptom)
+            else:
+                state.answer(symptom, answer["exists"], answer["variant"])
+
+        # Diseases that are tied only differ in rounding, which can order
+        # them either way; compare by name and check the ranking.
+        expected = state.get_predictions()
+        probs = {x["name"]: x["prob"] for x in result["diseases"]}
+        expected_probs = {x["name"]: x["prob"] for x in expected["diseases"]}
+        assert probs.keys() == expected_probs.keys()
+        for name, prob in probs.items():
+            assert math.isclose(prob, expected_probs[name], rel_tol=1e-9, abs_tol=1e-12)
+
+        ranked = [x["prob"] for x in result["diseases"]]
+        assert all(x >= y - 1e-12 for x, y in zip(ranked, ranked[1:]))
+        assert math.isclose(result["no_disease_prob"], expected["no_disease_prob"], rel_tol=1e-9, abs_tol=1e-12)
+        assert math.isclose(result["entropy"], expected["entropy"], rel_tol=1e-9, abs_tol=1e-12)
+
+def hierarchy(edges: list[tuple[str, str]]) -> SymptomHierarchy:
+    # (parent, child) pairs, as in the subsymptom table.
+    return SymptomHierarchy(pd.DataFrame({
+        "Gejala": [x[0] for x in edges],
+        "Variasi": [None] * len(edges),
+        "AnakGejala": [x[1] for x in edges],
+    }))
+
+def test_hierarchy_ancestors_descendants_and_can_add():
+    h = hierarchy([("Nyeri", "Nyeri kepala"), ("Nyeri kepala", "Migrain"), ("Nyeri", "Nyeri perut"), ("Demam", "Menggigil")])
+
+    assert h.ancestors("Migrain") == ["Nyeri kepala", "Nyeri"]
+    assert h.ancestors("Nyeri") == []
+    assert h.ancestors("Batuk") == []
+    assert h.descendants("Nyeri") == ["Nyeri kepala", "Migrain", "Nyeri perut"]
+    assert h.descendants("Migrain") == []
+    assert h.depths["Migrain"] == 2
+
+    assert h.can_add("Migrain", "Menggigil")
+    assert h.can_add("Demam", "Nyeri kepala")
+    # Moving a symptom under itself or under one of its descendants loops.
+    assert not h.can_add("Nyeri", "Nyeri")
+    assert not h.can_add("Migrain", "Nyeri")
+    assert not h.can_add("Nyeri kepala", "Nyeri")
+
+def test_hierarchy_with_an_existing_loop():
+    # Rows written before the loop check existed can already loop.
+    h = hierarchy([("A", "B"), ("B", "C"), ("C", "A"), ("C", "D"), ("X", "Y")])
+
+    assert h.ancestors("A") is None
+    assert h.ancestors("D") is None
+    assert h.ancestors("Y") == ["X"]
+    assert "A" not in h.depths and "D" not in h.depths
+    # Descendants still end, each symptom listed once.
+    assert sorted(h.descendants("A")) == ["B", "C", "D"]
+
+    # Nothing can be put under a symptom whose parent chain loops.
+    assert not h.can_add("D", "Y")
+    assert not h.can_add("A", "X")
+    assert h.can_add("Y", "A")
+    assert h.can_add("X", "Z")
@@ -0,0 +1,76 @@
+import pandas as pd
+
+from kb_admin import name_changes, save_name_changes, validate_name_changes
+
+PAGE = pd.DataFrame({"Nama": ["Flu", "Pilek", "Campak"], "Deskripsi": ["a", "b", None]})
+EXISTING = {"Flu", "Pilek", "Campak", "Tifus"}
+
+def test_diff_is_split_into_deletes_renames_edits_and_additions():
+    changes = name_changes(PAGE, {
+        "edited_rows": {"0": {"Nama": " Influenza "}, "1": {"Deskripsi": "c"}, "2": {"Nama": "Rubeola"}},
+        "added_rows": [{"Nama": " DBD ", "Deskripsi": "d"}],
+        "deleted_rows": [2],
+    })
+
+    assert changes.deleted == ["Campak"]
+    # The edit of a deleted row is dropped.
+    assert changes.renamed == [("Flu", "Influenza", "a")]
+    assert changes.edited == [("Pilek", "c")]
+    assert changes.added == [("DBD", "d")]
+
+def test_empty_names_are_rejected():
+    for diff in [
+        {"edited_rows": {"0": {"Nama": "  "}}},
+        {"edited_rows": {"0": {"Nama": None}}},
+        {"added_rows": [{"Deskripsi": "x"}]},
+    ]:
+        assert validate_name_changes(name_changes(PAGE, diff), EXISTING, "Penyakit") == "Nama tidak boleh kosong."
+
+def test_duplicate_names_are_rejected():
+    for diff, name in [
+        ({"edited_rows": {"0": {"Nama": "Tifus"}}}, "Tifus"),
+        # Another row on the page.
+        ({"edited_rows": {"0": {"Nama": "Pilek"}}}, "Pilek"),
+        ({"added_rows": [{"Nama": "Campak"}]}, "Campak"),
+        # Two new rows with the same name.
+        ({"added_rows": [{"Nama": "DBD"}, {"Nama": "DBD"}]}, "DBD"),
+        ({"edited_rows": {"0": {"Nama": "DBD"}}, "added_rows": [{"Nama": "DBD"}]}, "DBD"),
+    ]:
+        assert validate_name_changes(name_changes(PAGE, diff), EXISTING, "Penyakit") == f"Penyakit dengan nama \"{name}\" sudah ada."
+
+def test_names_freed_in_the_same_diff_can_be_reused():
+    for diff in [
+        {"deleted_rows": [1], "added_rows": [{"Nama": "Pilek"}]},
+        {"edited_rows": {"0": {"Nama": "Influenza"}, "1": {"Nama": "Flu"}}},
+        # A swap (sql/006_save_names.sql renames through temporary names).
+        {"edited_rows": {"0": {"Nama": "Pilek"}, "1": {"Nama": "Flu"}}},
+        {"edited_rows": {"1": {"Deskripsi": "c"}}},
+    ]:
+        assert validate_name_changes(name_changes(PAGE, diff), EXISTING, "Penyakit") is None
+
+class FakeClient:
+    def __init__(self):
+        self.calls = []
+
+    def rpc(self, name: str, params: dict):
+        self.calls.append((name, params))
+        return self
+
+    def execute(self):
+        return None
+
+def test_changes_are_saved_with_one_call():
+    client = FakeClient()
+    changes = name_changes(PAGE, {
+        "edited_rows": {"0": {"Nama": "Influenza"}, "1": {"Deskripsi": "c"}},
+        "added_rows": [{"Nama": "DBD", "Deskripsi": "d"}],
+        "deleted_rows": [2],
+    })
+    save_name_changes(client, "diseases", changes, lambda name, description: f"{name}: {description}")
+
+    assert client.calls == [("save_names", {
+        "p_table": "diseases",
+        "p_deleted": ["Campak"],
+        "p_renamed": [{"old_name": "Flu", "name": "Influenza", "description": "Influenza: a"}],
+        "p_upserted": [{"name": "Pilek", "description": "Pilek: c"}, {"name": "DBD", "description": "DBD: d"}],
+    })]
@@ -0,0 +1,56 @@
+import numpy as np
+
+from benchmark.synthetic import generate_knowledge_base
+from experiment_3 import KnowledgeBase
+from kb_cache import KnowledgeBaseCache
+
+def test_restart_maps_the_snapshot_of_an_unchanged_source(tmp_path):
+    symptom_df, subsymptom_df = generate_knowledge_base(n_diseases=20, n_symptoms=40, seed=0)
+    loads = []
+    def loader():
+        loads.append(None)
+        return symptom_df, subsymptom_df
+
+    source = ["r1"]
+    def make_cache():
+        return KnowledgeBaseCache(loader, opening_book_depth=1, source_loader=lambda: source[0], snapshot_dir=str(tmp_path))
+
+    first = make_cache().get().knowledge_base
+    assert len(loads) == 1
+
+    # A new process finds the snapshot and doesn't load the rows.
+    restarted = make_cache().get().knowledge_base
+    assert len(loads) == 1
+    assert restarted.snapshot_path is not None
+    assert restarted.version == first.version
+    np.testing.assert_array_equal(restarted.likelihoods, KnowledgeBase(symptom_df, subsymptom_df).likelihoods)
+
+    source[0] = "r2"
+    make_cache().get()
+    assert len(loads) == 2
+
+def test_new_snapshot_removes_older_revisions_of_the_same_source(tmp_path):
+    symptom_df, subsymptom_df = generate_knowledge_base(n_diseases=10, n_symptoms=20, seed=1)
+    source = ["supabase-db-1"]
+    def make_cache(opening_book_depth=1):
+        return KnowledgeBaseCache(
+            lambda: (symptom_df, subsymptom_df),
+            opening_book_depth=opening_book_depth,
+            source_loader=lambda: source[0],
+            snapshot_dir=str(tmp_path),
+            source_prefix="supabase-db"
+        )
+
+    make_cache().get()
+    make_cache(opening_book_depth=0).get()
+    # Neither another database nor another depth is touched.
+    other = KnowledgeBaseCache(lambda: (symptom_df, subsymptom_df), source_loader=lambda: "supabase-db-other-1", snapshot_dir=str(tmp_path))
+    other.get()
+    old = make_cache().get().knowledge_base
+
+    source[0] = "supabase-db-2"
+    make_cache().get()
+    assert sorted(x.name for x in tmp_path.iterdir()) == ["v1-supabase-db-1-0", "v1-supabase-db-2-1", "v1-supabase-db-other-1-0"]
+
+    # The mapped arrays of the removed snapshot stay readable.
+    np.testing.assert_array_equal(old.likelihoods, KnowledgeBase(symptom_df, subsymptom_df).likelihoods)
@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from experiment_3 import KnowledgeBase
+from kb_cache import KnowledgeBaseCache
+from kb_changes import FakeChangeSource, KnowledgeBaseSubscriber
+
+ARRAYS = ["link_probs", "link_variants", "unlinked", "likelihoods", "no_disease_likelihoods", "possibility_mask"]
+
+def symptom_table(rows: list[tuple]) -> pd.DataFrame:
+    # Same columns and order as supabase_loader.fetch_disease_symptoms.
+    return pd.DataFrame({
+        "Id": [x[0] for x in rows],
+        "Penyakit": [x[1] for x in rows],
+        "Gejala": [x[2] for x in rows],
+        "Variasi": [x[3] for x in rows],
+        "Frekuensi": [x[4] for x in rows],
+    })
+
+def subsymptom_table(rows: list[tuple]) -> pd.DataFrame:
+    return pd.DataFrame({
+        "Gejala": [x[0] for x in rows],
+        "Variasi": [x[1] for x in rows],
+        "AnakGejala": [x[2] for x in rows],
+    })
+
+SYMPTOM_ROWS = [
+    (1, "Flu", "Demam", None, "Sering"),
+    (2, "Flu", "Batuk", "Kering", "Kadang"),
+    (3, "Pilek", "Batuk", "Berdahak", "Jarang"),
+    (4, "Pilek", "Bersin", None, None),
+    (5, "Flu", "Sesak", None, "Jarang"),
+]
+SUBSYMPTOM_ROWS = [("Batuk", None, "Sesak")]
+
+@pytest.fixture
+def feed():
+    cache = KnowledgeBaseCache(lambda: (symptom_table(SYMPTOM_ROWS), subsymptom_table(SUBSYMPTOM_ROWS)), opening_book_depth=1)
+    source = FakeChangeSource()
+    subscriber = KnowledgeBaseSubscriber(cache, source, delay=0)
+    return cache, source, subscriber
+
+def assert_same_as_rebuild(knowledge_base: KnowledgeBase, symptom_rows: list[tuple], subsymptom_rows: list[tuple]):
+    rebuilt = KnowledgeBase(symptom_table(symptom_rows), subsymptom_table(subsymptom_rows), opening_book_depth=1)
+    for name in ARRAYS:
+        np.testing.assert_array_equal(getattr(knowledge_base, name), getattr(rebuilt, name), err_msg=name)
+
+    assert knowledge_base.disease_index == rebuilt.disease_index
+    assert knowledge_base.symptom_index == rebuilt.symptom_index
+    assert knowledge_base.variant_index == rebuilt.variant_index
+    assert knowledge_base.possibilities == rebuilt.possibilities
+    assert knowledge_base.askable == rebuilt.askable
+    assert knowledge_base.opening_book == rebuilt.opening_book
+
+def test_insert_update_and_delete_match_a_full_rebuild(feed):
+    cache, source, subscriber = feed
+    cache.get()
+
+    source.emit("disease_symptoms", "UPDATE", {"id": 1, "disease": "Flu", "frequency": "Jarang"}, {"id": 1, "disease": "Flu", "frequency": "Sering"})
+    source.emit("disease_symptoms", "INSERT", {"id": 6, "disease": "Pilek", "frequency": "Kadang"})
+    source.emit("disease_variant_free_symptoms", "INSERT", {"id": 6, "symptom": "Demam"})
+    source.emit("disease_symptoms", "DELETE", old_record={"id": 4, "disease": "Pilek", "frequency": ""})
+    source.emit("disease_variant_free_symptoms", "DELETE", old_record={"id": 4, "symptom": "Bersin"})
+    subscriber.flush()
+
+    assert_same_as_rebuild(cache.get().knowledge_base, [
+        (1, "Flu", "Demam", None, "Jarang"),
+        (2, "Flu", "Batuk", "Kering", "Kadang"),
+        (3, "Pilek", "Batuk", "Berdahak", "Jarang"),
+        (5, "Flu", "Sesak", None, "Jarang"),
+        (6, "Pilek", "Demam", None, "Kadang"),
+    ], SUBSYMPTOM_ROWS)
+
+def test_update_only_recompiles_the_changed_symptom(feed):
+    cache, source, subscriber = feed
+    previous = cache.get().knowledge_base
+
+    source.emit("disease_symptoms", "UPDATE", {"id": 2, "disease": "Flu", "frequency": "Sangat sering"}, {"id": 2, "disease": "Flu", "frequency": "Kadang"})
+    subscriber.flush()
+
+    knowledge_base = cache.get().knowledge_base
+    assert knowledge_base is not previous
+    # Updated in place of a rebuild: the interned names are shared.
+    assert knowledge_base.disease_names is previous.disease_names
+    # Sessions on the previous knowledge base keep what they had.
+    assert previous.link_probs[previous.symptom_index["Batuk"], previous.disease_index["Flu"]] == 0.5
+
+    rows = list(SYMPTOM_ROWS)
+    rows[1] = (2, "Flu", "Batuk", "Kering", "Sangat sering")
+    assert_same_as_rebuild(knowledge_base, rows, SUBSYMPTOM_ROWS)
+
+def test_unknown_disease_and_symptom_match_a_full_rebuild(feed):
+    cache, source, subscriber = feed
+    cache.get()
+
+    source.emit("disease_symptoms", "INSERT", {"id": 7, "disease": "Campak", "frequency": "Sering"})
+    source.emit("disease_variant_free_symptoms", "INSERT", {"id": 7, "symptom": "Ruam"})
+    source.emit("variant_free_subsymptoms", "INSERT", {"subsymptom": "Ruam", "parent": "Demam"})
+    subscriber.flush()
+
+    assert_same_as_rebuild(
+        cache.get().knowledge_base,
+        SYMPTOM_ROWS + [(7, "Campak", "Ruam", None, "Sering")],
+        SUBSYMPTOM_ROWS + [("Demam", None, "Ruam")]
+    )
+
+def test_delete_of_missing_row_changes_nothing(feed):
+    cache, source, subscriber = feed
+    previous = cache.get().knowledge_base
+
+    source.emit("disease_symptoms", "DELETE", old_record={"id": 99, "disease": "Flu", "frequency": "Sering"})
+    source.emit("disease_variant_free_symptoms", "DELETE", old_record={"id": 99, "symptom": "Demam"})
+    source.emit("variant_free_subsymptoms", "DELETE", old_record={"subsymptom": "Bersin", "parent": "Demam"})
+    subscriber.flush()
+
+    assert cache.get().knowledge_base is previous
+    assert_same_as_rebuild(previous, SYMPTOM_ROWS, SUBSYMPTOM_ROWS)
@@ -0,0 +1,83 @@
+import io
+import json
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from benchmark.synthetic import generate_knowledge_base
+from kb_transfer import apply_diff, diff, read_import, write_workbook
+
+def test_read_import_reads_an_exported_workbook():
+    symptom_df, subsymptom_df = generate_knowledge_base(n_diseases=5, n_symptoms=10, seed=0)
+    data = write_workbook(symptom_df, subsymptom_df)
+
+    imported_symptom_df, imported_subsymptom_df, errors = read_import(io.BytesIO(data), "data.xlsx")
+    assert errors == []
+    assert len(imported_symptom_df) == len(symptom_df)
+    assert len(imported_subsymptom_df) == len(subsymptom_df)
+
+def test_read_import_reports_unreadable_files():
+    symptom_df, subsymptom_df = generate_knowledge_base(n_diseases=5, n_symptoms=10, seed=0)
+    data = write_workbook(symptom_df, subsymptom_df)
+    broken_archive = io.BytesIO()
+    with zipfile.ZipFile(broken_archive, "w") as f:
+        f.writestr("[Content_Types].xml", "<Types")
+
+    for content, name in [
+        (data[:len(data) // 2], "data.xlsx"),
+        (b"not a workbook", "data.xlsx"),
+        (broken_archive.getvalue(), "data.xlsx"),
+        (b"\xff\xfe\x00P\x00e\xc3(", "data.csv"),
+        (b"", "data.csv"),
+    ]:
+        _, _, errors = read_import(io.BytesIO(content), name)
+        assert len(errors) == 1
+        assert errors[0].startswith("Berkas tidak dapat dibaca")
+
+class FakeClient:
+    def __init__(self):
+        self.calls = []
+
+    def rpc(self, name: str, params: dict):
+        self.calls.append((name, params))
+        return self
+
+    def execute(self):
+        return None
+
+def test_apply_diff_sends_the_whole_import_in_one_call():
+    current_symptom_df = pd.DataFrame({
+        "Id": np.array([1, 2, 3]),
+        "Penyakit": ["Flu", "Flu", "Pilek"],
+        "Gejala": ["Demam", "Batuk", "Bersin"],
+        "Variasi": [None, "Kering", None],
+        "Frekuensi": ["Sering", None, "Jarang"],
+    })
+    current_subsymptom_df = pd.DataFrame({"Gejala": ["Batuk"], "Variasi": [None], "AnakGejala": ["Sesak"]})
+    symptom_df = pd.DataFrame({
+        "Penyakit": ["Flu", "Flu", "Campak"],
+        "Gejala": ["Demam", "Batuk", "Ruam"],
+        "Variasi": [None, None, "Merah"],
+        "Frekuensi": ["Jarang", None, "Sering"],
+    })
+    subsymptom_df = pd.DataFrame({"Gejala": ["Demam"], "Variasi": [None], "AnakGejala": ["Sesak"]})
+
+    client = FakeClient()
+    apply_diff(client, diff(current_symptom_df, current_subsymptom_df, symptom_df, subsymptom_df))
+
+    assert client.calls == [("apply_kb_import", {"p_diff": {
+        "diseases": ["Campak", "Flu"],
+        "symptoms": ["Batuk", "Demam", "Ruam", "Sesak"],
+        "variants": [{"symptom": "Ruam", "name": "Merah"}],
+        "deleted_links": [3],
+        "deleted_subsymptoms": ["Sesak"],
+        "updated_frequencies": [{"id": 1, "frequency": "Jarang"}],
+        "updated_variants": [{"id": 2, "symptom": "Batuk", "old_variant": "Kering", "variant": None}],
+        # New rows are named by disease and symptom; the database assigns
+        # their ids.
+        "added_links": [{"disease": "Campak", "symptom": "Ruam", "variant": "Merah", "frequency": "Sering"}],
+        "added_subsymptoms": [{"parent": "Demam", "variant": None, "subsymptom": "Sesak"}],
+    }})]
+    # The payload is sent as JSON.
+    json.dumps(client.calls[0][1])
@@ -0,0 +1,84 @@
+import shutil
+
+import numpy as np
+import pytest
+
+from benchmark.synthetic import generate_knowledge_base
+from experiment_3 import KnowledgeBase, ScoringCancelled, score_symptoms
+from kb_snapshot import load_source_knowledge_base
+import scoring_pool
+from scoring_pool import ScoringPool, get_shared_scoring_pool
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = ScoringPool(max_workers=2, min_symptoms_per_task=16)
+    yield pool
+    pool.shutdown()
+
+def make_knowledge_base(seed: int) -> KnowledgeBase:
+    return KnowledgeBase(*generate_knowledge_base(n_diseases=50, n_symptoms=100, seed=seed))
+
+def uniform_probs(knowledge_base: KnowledgeBase) -> np.ndarray:
+    return np.full(len(knowledge_base.disease_names), 1 / (len(knowledge_base.disease_names) + 1))
+
+def test_score_matches_in_process_scoring_across_versions(pool):
+    # Sessions on an older version keep using the same pool after a reload.
+    old_kb = make_knowledge_base(0)
+    new_kb = make_knowledge_base(1)
+    for knowledge_base in [old_kb, new_kb, old_kb]:
+        probs = uniform_probs(knowledge_base)
+        symptom_ids = list(range(len(knowledge_base.symptom_names)))
+        expected, entropies = pool.score(knowledge_base, probs, symptom_ids)
+        local_expected, local_entropies = score_symptoms(knowledge_base, probs, symptom_ids)
+
+        np.testing.assert_array_equal(expected, local_expected)
+        np.testing.assert_array_equal(entropies, local_entropies)
+
+def test_score_can_be_cancelled_while_in_flight():
+    # A fresh pool still has to start its workers, so the chunks are in
+    # flight when should_cancel is polled the second time.
+    pool = ScoringPool(max_workers=2, min_symptoms_per_task=16)
+    knowledge_base = make_knowledge_base(2)
+    probs = uniform_probs(knowledge_base)
+    symptom_ids = list(range(len(knowledge_base.symptom_names)))
+
+    polls = []
+    def should_cancel():
+        # Let the chunks be submitted first, then cancel.
+        polls.append(None)
+        return len(polls) > 1
+
+    with pytest.raises(ScoringCancelled):
+        pool.score(knowledge_base, probs, symptom_ids, should_cancel=should_cancel)
+
+    assert len(polls) == 2
+
+    try:
+        expected, _ = pool.score(knowledge_base, probs, symptom_ids)
+        np.testing.assert_array_equal(expected, score_symptoms(knowledge_base, probs, symptom_ids)[0])
+    finally:
+        pool.shutdown()
+
+def test_shared_pool_survives_a_new_knowledge_base_version(monkeypatch):
+    monkeypatch.setattr(scoring_pool, "_shared_pool", None)
+    old_kb = make_knowledge_base(3)
+    new_kb = make_knowledge_base(4)
+
+    pool = get_shared_scoring_pool(old_kb, 1)
+    try:
+        assert get_shared_scoring_pool(new_kb, 1) is pool
+
+        probs = uniform_probs(old_kb)
+        expected, _ = pool.score(old_kb, probs, [0, 1, 2])
+        np.testing.assert_array_equal(expected, score_symptoms(old_kb, probs, [0, 1, 2])[0])
+    finally:
+        pool.shutdown()
+
+def test_knowledge_base_whose_snapshot_was_removed_is_sent_by_value(pool, tmp_path):
+    knowledge_base = load_source_knowledge_base("removed-1", lambda: generate_knowledge_base(n_diseases=50, n_symptoms=100, seed=5), str(tmp_path))
+    shutil.rmtree(knowledge_base.snapshot_path)
+
+    probs = uniform_probs(knowledge_base)
+    symptom_ids = list(range(len(knowledge_base.symptom_names)))
+    expected, _ = pool.score(knowledge_base, probs, symptom_ids)
+    np.testing.assert_array_equal(expected, score_symptoms(knowledge_base, probs, symptom_ids)[0])
@@ -0,0 +1,92 @@
+import asyncio
+import json
+
+from benchmark.synthetic import generate_knowledge_base
+from experiment_3 import KnowledgeBase
+from service import MAX_BODY_SIZE, DiagnosisService
+
+def make_service() -> DiagnosisService:
+    return DiagnosisService(KnowledgeBase(*generate_knowledge_base(n_diseases=10, n_symptoms=20, seed=0)), workers=1)
+
+async def request(service: DiagnosisService, method: str, path: str, body: bytes = b"") -> tuple[int, dict]:
+    # One request over a fresh connection to a server on a free port.
+    server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+    async with server:
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(
+            f"{method} {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+
+    head, _, payload = response.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(payload)
+
+def test_answer_with_non_object_body_is_bad_request():
+    service = make_service()
+    status, payload = asyncio.run(request(service, "POST", "/sessions"))
+    assert status == 201
+
+    status, payload = asyncio.run(request(service, "POST", f"/sessions/{payload['session_id']}/answer", b"[true, null]"))
+    assert status == 400
+    assert "error" in payload
+
+def test_unexpected_engine_error_is_internal_server_error(monkeypatch):
+    service = make_service()
+
+    async def start_session():
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(service, "start_session", start_session)
+    status, payload = asyncio.run(request(service, "POST", "/sessions"))
+    assert status == 500
+    assert "error" in payload
+
+def test_oversized_body_is_refused_and_the_connection_closed():
+    service = make_service()
+
+    async def send_oversized():
+        server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+        async with server:
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            # Keep-alive is asked for, but the unread body must not be taken
+            # for the next request.
+            writer.write(
+                f"POST /sessions HTTP/1.1\r\nContent-Length: {MAX_BODY_SIZE + 1}\r\n\r\n".encode("latin-1")
+                + b"GET /sessions HTTP/1.1\r\n\r\n" + b"x" * MAX_BODY_SIZE
+            )
+            await writer.drain()
+            response = await asyncio.wait_for(reader.read(), timeout=5)
+            writer.close()
+
+        return response
+
+    response = asyncio.run(send_oversized())
+    head, _, payload = response.partition(b"\r\n\r\n")
+    assert int(head.split()[1]) == 413
+    assert b"Connection: close" in head
+    assert "error" in json.loads(payload)
+
+def test_overlong_request_line_is_bad_request():
+    service = make_service()
+
+    async def send_overlong():
+        server = await asyncio.start_server(service.handle_connection, "127.0.0.1", 0)
+        async with server:
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            # Longer than the stream's line limit, with no end of line.
+            writer.write(b"GET /sessions/" + b"a" * 2 ** 16)
+            await writer.drain()
+            response = await asyncio.wait_for(reader.read(), timeout=5)
+            writer.close()
+
+        return response
+
+    head, _, payload = asyncio.run(send_overlong()).partition(b"\r\n\r\n")
+    assert int(head.split()[1]) == 400
+    assert b"Connection: close" in head
+    assert "error" in json.loads(payload)
@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+
+import pytest
+
+from supabase_loader import FetchError, fetch_columns, fetch_concurrently, fetch_pages
+
+class FakeQuery:
+    def __init__(self, client: "FakeClient", view: str, columns: tuple, count):
+        self.client = client
+        self.view = view
+        self.columns = columns
+        self.count = count
+        self.after = None
+        self.key = None
+        self.page_size = None
+
+    def gt(self, key: str, value):
+        self.after = value
+        return self
+
+    def order(self, key: str):
+        self.key = key
+        return self
+
+    def limit(self, page_size: int):
+        self.page_size = page_size
+        return self
+
+    def execute(self):
+        self.client.queries.append(self)
+        rows = sorted(self.client.views[self.view], key=lambda x: x[self.key])
+        if self.after is not None:
+            rows = [x for x in rows if x[self.key] > self.after]
+
+        # PostgREST's max-rows wins over the requested limit.
+        rows = rows[:min(self.page_size, self.client.max_rows)]
+        return SimpleNamespace(
+            data=[{x: row[x] for x in self.columns} for row in rows],
+            count=len(self.client.views[self.view]) if self.count is not None else None
+        )
+
+class FakeClient:
+    def __init__(self, views: dict[str, list[dict]], max_rows: int):
+        self.views = views
+        self.max_rows = max_rows
+        self.queries = []
+
+    def table(self, view: str):
+        return SimpleNamespace(select=lambda *columns, count=None: FakeQuery(self, view, columns, count))
+
+ROWS = [{"id": i, "disease": f"D{i % 3}", "extra": i * 2} for i in range(1, 24)]
+
+def test_pages_smaller_than_page_size_still_load_every_row():
+    client = FakeClient({"kb_disease_symptoms": list(reversed(ROWS))}, max_rows=5)
+    pages = list(fetch_pages(client, "kb_disease_symptoms", ["id", "disease"], "id", page_size=10))
+
+    assert [len(x) for x in pages] == [5, 5, 5, 5, 3]
+    assert [row for page in pages for row in page] == [{"id": x["id"], "disease": x["disease"]} for x in ROWS]
+    # Only the first query asks for the row count.
+    assert [x.count is not None for x in client.queries] == [True] + [False] * 4
+    assert [x.after for x in client.queries] == [None, 5, 10, 15, 20]
+
+def test_empty_view_and_short_last_page():
+    client = FakeClient({"empty": [], "kb_disease_symptoms": ROWS}, max_rows=1000)
+    assert list(fetch_pages(client, "empty", ["id"], "id")) == []
+
+    data = fetch_columns(client, "kb_disease_symptoms", ["id", "disease"], "id", page_size=10)
+    assert data["id"] == [x["id"] for x in ROWS]
+    assert data["disease"] == [x["disease"] for x in ROWS]
+    assert len(client.queries) == 4
+
+def test_fetch_concurrently_reports_failures_by_table():
+    def fail(message):
+        raise RuntimeError(message)
+
+    with pytest.raises(FetchError) as excinfo:
+        fetch_concurrently({
+            "diseases": lambda: ["Flu"],
+            "symptoms": lambda: fail("symptoms down"),
+            "disease_symptoms": lambda: fail("timeout"),
+        })
+
+    errors = excinfo.value.errors
+    assert sorted(errors) == ["disease_symptoms", "symptoms"]
+    assert str(errors["symptoms"]) == "symptoms down"
+    assert str(errors["disease_symptoms"]) == "timeout"
+
+    assert fetch_concurrently({"diseases": lambda: ["Flu"], "symptoms": lambda: []}) == {"diseases": ["Flu"], "symptoms": []}